@@ -26,6 +26,10 @@ import main_site
 '''
 application.register_blueprint(main_site.bp)
 
+import index_service
+# build the search index once for this worker, shared by all requests
+index_service.service.start()
+
 if __name__ == '__main__':
 	application.run(debug=True,host='0.0.0.0', port=5000)
 
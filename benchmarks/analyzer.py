@@ -0,0 +1,49 @@
+"""
+	Tokens/sec of search.analyze against the old five-filter pipeline,
+	and a check that both give the same terms for every document of
+	data.xml.gz.
+
+	Run from the repo root:
+		python3 -m benchmarks.analyzer --copies 20
+
+	The first pass of analyze() over the corpus fills the memo, so it is
+	reported separately (cold) from the later passes (warm).
+"""
+import argparse
+import time
+import search
+
+def pipeline_analyze(text):
+	# search.analyze before the filters were fused
+	tokens = search.tokenize(text)
+	tokens = search.lowercase_filter(tokens)
+	tokens = search.punctuation_filter(tokens)
+	tokens = search.stopword_filter(tokens)
+	tokens = search.stem_filter(tokens)
+	return [token for token in tokens if token]
+
+def tokens_per_second(analyze, texts, tokens):
+	start = time.perf_counter()
+	for text in texts:
+		analyze(text)
+	return tokens / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--copies', type=int, default=20)
+	args = parser.parse_args()
+
+	texts = [document.fulltext for document in search.load_documents() if document.fulltext is not None]
+	mismatches = sum(search.analyze(text) != pipeline_analyze(text) for text in texts)
+	print(f"{len(texts)} documents, {mismatches} where analyze() differs from the old pipeline")
+
+	texts = texts * args.copies
+	tokens = sum(len(text.split()) for text in texts)
+	old = tokens_per_second(pipeline_analyze, texts, tokens)
+	search._analyzed.clear()
+	cold = tokens_per_second(search.analyze, texts[:len(texts) // args.copies], tokens / args.copies)
+	warm = tokens_per_second(search.analyze, texts, tokens)
+	print(f"{tokens} raw tokens, {len(search._analyzed)} distinct")
+	print(f"old pipeline       {old:12,.0f} tokens/sec")
+	print(f"analyze(), cold    {cold:12,.0f} tokens/sec {cold / old:5.1f}x")
+	print(f"analyze(), warm    {warm:12,.0f} tokens/sec {warm / old:5.1f}x")
@@ -0,0 +1,67 @@
+"""
+	Docs/sec of search.load_documents on the xml corpus against
+	corpus_records.load_records on the same documents, gzip framed and
+	uncompressed.
+
+	Run from the repo root:
+		python3 -m benchmarks.corpus_load --copies 50
+
+	--copies repeats data.xml.gz under fresh doc IDs to get a corpus
+	big enough to time.
+"""
+import argparse
+import gzip
+import os
+import tempfile
+import time
+import corpus_records
+import corpus_writer
+import search
+
+def scaled_documents(copies: int):
+	documents = list(search.load_documents())
+	doc_id = 1
+	for _ in range(copies):
+		for document in documents:
+			yield search.Abstract(ID=doc_id, abstract=document.abstract, _filename=document.filename, _url=document.url)
+			doc_id += 1
+
+def write_xml(documents, path):
+	with gzip.open(path, 'wb', compresslevel=6) as f:
+		f.write(corpus_writer.HEADER)
+		for document in documents:
+			f.write(corpus_writer.format_document(document).encode('utf-8'))
+		f.write(b'</div>\n')
+
+def docs_per_second(load, path, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		count = sum(1 for _ in load(path))
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return count, count / best
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--copies', type=int, default=50)
+	parser.add_argument('--repeat', type=int, default=3, help='best of this many runs')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		xml_path = os.path.join(directory, 'data.xml.gz')
+		gzip_path = os.path.join(directory, 'data.docs.gz')
+		raw_path = os.path.join(directory, 'data.docs')
+		write_xml(scaled_documents(args.copies), xml_path)
+		corpus_records.convert(xml_path, gzip_path)
+		corpus_records.convert(xml_path, raw_path, compress=False)
+
+		baseline = None
+		for name, load, path in (
+				('xml (lxml iterparse)', search.load_documents, xml_path),
+				('records, gzip', corpus_records.load_records, gzip_path),
+				('records, uncompressed', corpus_records.load_records, raw_path)):
+			count, rate = docs_per_second(load, path, args.repeat)
+			baseline = baseline or rate
+			print(f"{name:24} {count} docs {rate:12,.0f} docs/sec {rate / baseline:5.1f}x "
+				f"{os.path.getsize(path) / 2**20:8.1f} MiB")
@@ -0,0 +1,178 @@
+"""
+	Crawling a local fixture site: the old MemeScraper way (a serial
+	breadth-first walk, get_all_links and get_img_urls each fetching the
+	page and parsing it with html.parser) against crawler.Crawler.
+
+	Run from the repo root:
+		python3 -m benchmarks.crawler --pages 500 --depth 3 --workers 1 8 16
+
+	The fixture site has --pages pages, each linking to --links random
+	others (relative, absolute, with #fragments, plus a mailto: and an
+	external link) and showing --images images. Every crawl is checked
+	against the pages and images a breadth-first walk of the site graph
+	reaches within the depth and page budgets, and against the server's
+	request log: every page fetched exactly once.
+"""
+import argparse
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+from urllib.parse import urljoin
+import requests
+from bs4 import BeautifulSoup
+import crawler
+import downloader
+
+class FixtureSite(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, pages, links, images, latency, seed):
+		super().__init__(('127.0.0.1', 0), FixtureHandler)
+		rng = random.Random(seed)
+		self.latency = latency
+		self.graph = {page: rng.sample(range(pages), min(links, pages)) for page in range(pages)}
+		self.images = {page: [f"/img/{page}-{i}.jpg" for i in range(images)] for page in range(pages)}
+		self.requests = Counter()
+		self.lock = threading.Lock()
+
+	@property
+	def base_url(self):
+		return f"http://127.0.0.1:{self.server_address[1]}"
+
+	def url(self, page):
+		return f"{self.base_url}/page/{page}"
+
+	def html(self, page):
+		# the same page written a few different ways, the crawler has to dedupe them
+		anchors = []
+		for i, other in enumerate(self.graph[page]):
+			href = (f"/page/{other}", f"{self.base_url}/page/{other}", f"{other}#top")[i % 3]
+			anchors.append(f'<li><a href="{href}">meme {other}</a></li>')
+		anchors.append('<li><a href="mailto:memes@example.com">mail</a></li>')
+		anchors.append('<li><a href="https://example.com/elsewhere">elsewhere</a></li>')
+		images = ''.join(f'<img src="{src}" alt="meme">' for src in self.images[page])
+		return (f"<!DOCTYPE html><html><head><title>page {page}</title></head><body>"
+			f"<h1>page {page}</h1><ul>{''.join(anchors)}</ul><div>{images}</div></body></html>").encode()
+
+	def expected(self, max_depth, max_pages):
+		"""
+		Pages and images a breadth-first crawl from page 0 has to find
+		"""
+		depth = {0: 0}
+		queue = deque([0])
+		while queue:
+			page = queue.popleft()
+			if depth[page] == max_depth:
+				continue
+			for other in self.graph[page]:
+				if other not in depth and len(depth) < max_pages:
+					depth[other] = depth[page] + 1
+					queue.append(other)
+		pages = {self.url(page) for page in depth}
+		images = {self.base_url + src for page in depth for src in self.images[page]}
+		return pages, images
+
+class FixtureHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# headers and body go out as separate writes, don't let Nagle hold the body back
+	disable_nagle_algorithm = True
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		site = self.server
+		with site.lock:
+			site.requests[self.path] += 1
+		time.sleep(site.latency)
+		parts = self.path.strip('/').split('/')
+		if parts[0] == 'page' and int(parts[1]) in site.graph:
+			body = site.html(int(parts[1]))
+			self.send_response(200)
+		else:
+			body = b'not found'
+			self.send_response(404)
+		self.send_header('Content-Type', 'text/html')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+def old_links(url):
+	# MemeScraper.get_all_links before crawler.py (with urljoin, the old
+	# f"{url}{href}" doesn't resolve links on a page that isn't the root)
+	soup = BeautifulSoup(requests.get(url).text, 'html.parser')
+	links = []
+	for link in soup.find_all('a'):
+		href = link.get('href')
+		if type(href) == str:
+			links.append(urljoin(url, href))
+	return links
+
+def old_images(url):
+	soup = BeautifulSoup(requests.get(url).text, 'html.parser')
+	return [urljoin(url, img.get('src')) for img in soup.find_all('img')]
+
+def old_crawl(start, max_depth, max_pages, base_url):
+	visited_urls = []
+	images = []
+	queue = deque([(start, 0)])
+	while queue and len(visited_urls) < max_pages:
+		url, depth = queue.popleft()
+		url = url.split('#')[0]
+		if url in visited_urls or not url.startswith(base_url):
+			continue
+		visited_urls.append(url)
+		images += old_images(url)
+		if depth < max_depth:
+			queue.extend((link, depth + 1) for link in old_links(url))
+	return visited_urls, images
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--pages', type=int, default=500)
+	parser.add_argument('--links', type=int, default=8)
+	parser.add_argument('--images', type=int, default=4)
+	parser.add_argument('--depth', type=int, default=3)
+	parser.add_argument('--max-pages', type=int, default=10000)
+	parser.add_argument('--latency', type=float, default=0.02, help='seconds before each response')
+	parser.add_argument('--rate', type=float, default=None, help='pages/sec limit for crawler.Crawler')
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 16])
+	parser.add_argument('--skip-old', action='store_true')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	site = FixtureSite(args.pages, args.links, args.images, args.latency, args.seed)
+	threading.Thread(target=site.serve_forever, daemon=True).start()
+	start_url = site.url(0)
+	expected_pages, expected_images = site.expected(args.depth, args.max_pages)
+	print(f"fixture site: {args.pages} pages, {len(expected_pages)} within depth {args.depth}, "
+		f"{args.latency * 1000:.0f} ms latency")
+
+	old_rate = None
+	if not args.skip_old:
+		start = time.perf_counter()
+		visited, images = old_crawl(start_url, args.depth, args.max_pages, site.base_url)
+		elapsed = time.perf_counter() - start
+		old_rate = len(visited) / elapsed
+		print(f"  {'old MemeScraper':22} {elapsed:8.2f} s {old_rate:8.1f} pages/sec "
+			f"{sum(site.requests.values())} requests for {len(visited)} pages")
+
+	for workers in args.workers:
+		site.requests.clear()
+		engine = crawler.Crawler(downloader.Downloader(workers=workers, per_host=workers), workers=workers,
+			rate=args.rate, max_depth=args.depth, max_pages=args.max_pages)
+		start = time.perf_counter()
+		pages = engine.crawl(start_url)
+		elapsed = time.perf_counter() - start
+		rate = len(pages) / elapsed
+		found_images = {image for page in pages.values() for image in page.images}
+		correct = set(pages) == expected_pages and found_images == expected_images
+		once = all(count == 1 for count in site.requests.values()) and len(site.requests) == len(pages)
+		speedup = f"{rate / old_rate:6.1f}x" if old_rate else ''
+		print(f"  {f'Crawler, {workers} workers':22} {elapsed:8.2f} s {rate:8.1f} pages/sec {speedup} "
+			f"{'same pages and images' if correct else 'RESULTS DIFFER'}, "
+			f"{'each page fetched once' if once else 'PAGES REFETCHED'}")
+
+	site.shutdown()
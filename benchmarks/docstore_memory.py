@@ -0,0 +1,109 @@
+"""
+	What documents cost once an index is loaded: a dict of search.Abstract
+	(how snapshot.load_index used to load them) against docstore's
+	DocumentStore over the snapshot's mmap.
+
+	Run from the repo root:
+		python3 -m benchmarks.docstore_memory --docs 1000000
+
+	Only the documents are measured, the snapshot is written with no
+	postings so the terms don't drown them out. Each layout loads in its
+	own spawned interpreter; RSS is taken before and after loading, and
+	again after --pages result pages (10 random documents each, url and
+	filename read the way main_site.py does) and after reading the
+	abstract of each of those. RSS counts the snapshot pages the mmap
+	has read in, which the kernel can drop again; private is the memory
+	that only this process's heap holds.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import search
+import snapshot
+from benchmarks import synthetic
+from benchmarks.suite import rss_mib
+
+def private_mib():
+	# RssAnon, the part of RSS that isn't file backed
+	with open('/proc/self/status') as f:
+		for line in f:
+			if line.startswith('RssAnon:'):
+				return int(line.split()[1]) / 2**10
+
+def write_documents(path, count, seed):
+	index = search.Index()
+	for document in synthetic.generate_documents(count, seed=seed):
+		index.documents[document.ID] = document
+	index.doc_lengths = np.zeros(count + 1, dtype=np.uint32)
+	snapshot.write_snapshot(index, b'\0' * 32, path)
+
+def load_abstracts(path):
+	# load_index before docstore.py
+	loaded = snapshot.Snapshot(path)
+	doc_ids = loaded.array('doc_ids').tolist()
+	missing = loaded.array('doc_missing').tolist()
+	abstracts = loaded.strings('abstracts', 'abstract_offsets')
+	filenames = loaded.strings('filenames', 'filename_offsets')
+	urls = loaded.strings('urls', 'url_offsets')
+	documents = {}
+	for i, doc_id in enumerate(doc_ids):
+		documents[doc_id] = search.Abstract(
+			ID=doc_id,
+			abstract=None if missing[i] & snapshot.MISSING_ABSTRACT else abstracts[i],
+			_filename=None if missing[i] & snapshot.MISSING_FILENAME else filenames[i],
+			_url=None if missing[i] & snapshot.MISSING_URL else urls[i])
+	return documents
+
+def load_store(path):
+	return snapshot.load_index(snapshot.Snapshot(path)).documents
+
+LAYOUTS = {'dict of Abstract': load_abstracts, 'DocumentStore': load_store}
+
+def measure(layout, path, count, pages, seed):
+	before, private_before = rss_mib(), private_mib()
+	start = time.perf_counter()
+	documents = LAYOUTS[layout](path)
+	load = time.perf_counter() - start
+	loaded, private_loaded = rss_mib(), private_mib()
+
+	rng = random.Random(seed)
+	results = [[rng.randint(1, count) for _ in range(10)] for _ in range(pages)]
+	start = time.perf_counter_ns()
+	for page in results:
+		[(documents[doc_id].url, documents[doc_id].filename) for doc_id in page]
+	page_us = (time.perf_counter_ns() - start) / pages / 1e3
+	paged = rss_mib()
+
+	start = time.perf_counter_ns()
+	for page in results:
+		[documents[doc_id].abstract for doc_id in page]
+	abstract_us = (time.perf_counter_ns() - start) / pages / 1e3
+	return {'load_s': load, 'loaded_mib': loaded - before, 'private_mib': private_loaded - private_before,
+		'paged_mib': paged - before, 'read_mib': rss_mib() - before, 'page_us': page_us, 'abstract_us': abstract_us}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--docs', type=int, default=1000000)
+	parser.add_argument('--pages', type=int, default=1000)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'documents.idx')
+		start = time.perf_counter()
+		write_documents(path, args.docs, args.seed)
+		print(f"{args.docs} documents, {os.path.getsize(path) / 2**20:.0f} MiB snapshot "
+			f"written in {time.perf_counter() - start:.0f} s")
+
+		context = multiprocessing.get_context('spawn')
+		with context.Pool(1, maxtasksperchild=1) as pool:
+			for layout in LAYOUTS:
+				result = pool.apply(measure, (layout, path, args.docs, args.pages, args.seed))
+				print(f"  {layout:17} load {result['load_s']:6.2f} s  RSS +{result['loaded_mib']:7.1f} MiB loaded "
+					f"({result['private_mib']:.1f} private), +{result['paged_mib']:.1f} after {args.pages} result pages, "
+					f"+{result['read_mib']:.1f} after their abstracts  "
+					f"{result['page_us']:5.1f} us/page, {result['abstract_us']:5.1f} us/10 abstracts")
@@ -0,0 +1,163 @@
+"""
+	Meme downloads against local stub servers: the old serial path (a
+	fresh requests.get per url, body fetched before the existence check)
+	against downloader.Downloader at several thread counts.
+
+	Run from the repo root:
+		python3 -m benchmarks.downloader --memes 400 --latency 0.05 --workers 4 16 32
+
+	Each stub server stands in for one image host (its own port, so its
+	own per-host limit) and serves --size KiB per image after --latency
+	seconds. One of them also serves the meme api, so
+	GenerateMemes.generate_memes runs unchanged against it. With --flaky
+	the first request for that fraction of the images gets a 503, to
+	exercise the retries. Every run is checked for complete files, and a
+	second run over the same folder has to skip everything without a
+	single request reaching the servers.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import requests
+import downloader
+from memeHandles import GenerateMemes, get_filename
+
+class StubServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, size, latency, flaky, seed):
+		super().__init__(('127.0.0.1', 0), StubHandler)
+		self.body = random.Random(seed).randbytes(size)
+		self.latency = latency
+		self.flaky = flaky
+		self.seed = seed
+		self.hosts = [self]
+		self.requests = 0
+		self.failed_once = set()
+		self.lock = threading.Lock()
+
+	@property
+	def base_url(self):
+		return f"http://127.0.0.1:{self.server_address[1]}"
+
+class StubHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# headers and body go out as separate writes, don't let Nagle hold the body back
+	disable_nagle_algorithm = True
+
+	def log_message(self, *args):
+		pass
+
+	def _send(self, status, body, content_type):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		server = self.server
+		with server.lock:
+			server.requests += 1
+		parts = self.path.strip('/').split('/')
+		if parts[0] == 'gimme':
+			# /gimme/<subreddit>/<amount>, images spread over every host
+			subreddit, amount = parts[1], int(parts[2])
+			memes = [{'url': f"{server.hosts[i % len(server.hosts)].base_url}/img/{subreddit}-{i}.jpg"} for i in range(amount)]
+			self._send(200, json.dumps({'memes': memes}).encode(), 'application/json')
+			return
+		time.sleep(server.latency)
+		with server.lock:
+			fail = (random.Random(f"{server.seed}{self.path}").random() < server.flaky
+				and self.path not in server.failed_once)
+			if fail:
+				server.failed_once.add(self.path)
+		if fail:
+			self._send(503, b'try again', 'text/plain')
+		else:
+			self._send(200, server.body, 'image/jpeg')
+
+def start_servers(count, size, latency, flaky, seed):
+	servers = [StubServer(size, latency, flaky, seed) for _ in range(count)]
+	for server in servers:
+		server.hosts = servers
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+	return servers
+
+def serial_download(urls, folder):
+	# save_from_url before downloader.py
+	os.makedirs(folder, exist_ok=True)
+	downloaded = []
+	for url in urls:
+		img_data = requests.get(url).content
+		path = f'{folder}/{get_filename(url)}'
+		if not os.path.isfile(path):
+			with open(path, 'wb') as handler:
+				handler.write(img_data)
+			downloaded.append(url)
+	return downloaded
+
+def check_folder(folder, urls, size):
+	for url in urls:
+		path = os.path.join(folder, get_filename(url))
+		if not os.path.isfile(path) or os.path.getsize(path) != size:
+			return False
+	return not any(name.endswith('.tmp') for name in os.listdir(folder))
+
+def total_requests(servers):
+	return sum(server.requests for server in servers)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--memes', type=int, default=400)
+	parser.add_argument('--hosts', type=int, default=4)
+	parser.add_argument('--size', type=int, default=100, help='KiB per image')
+	parser.add_argument('--latency', type=float, default=0.05, help='seconds before each image response')
+	parser.add_argument('--flaky', type=float, default=0.0, help='fraction of images whose first request fails')
+	parser.add_argument('--workers', type=int, nargs='+', default=[4, 16, 32])
+	parser.add_argument('--per-host', type=int, default=downloader.PER_HOST * 2)
+	parser.add_argument('--skip-serial', action='store_true')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	servers = start_servers(args.hosts, args.size * 1024, args.latency, args.flaky, args.seed)
+	memes = GenerateMemes(downloader.Downloader(backoff=0.05), api_url=f"{servers[0].base_url}/gimme")
+	per_subreddit = -(-args.memes // len(memes.subreddits))
+	urls = memes.generate_memes(per_subreddit)[:args.memes]
+	print(f"{len(urls)} memes of {args.size} KiB over {args.hosts} hosts, {args.latency * 1000:.0f} ms latency, "
+		f"{args.flaky:.0%} flaky")
+
+	with tempfile.TemporaryDirectory() as directory:
+		serial_rate = None
+		if not args.skip_serial:
+			if args.flaky:
+				print("  serial path has no retries, skipping it with --flaky")
+			else:
+				start = time.perf_counter()
+				serial_download(urls, os.path.join(directory, 'serial'))
+				elapsed = time.perf_counter() - start
+				serial_rate = len(urls) / elapsed
+				print(f"  {'serial requests.get':24} {elapsed:8.2f} s {serial_rate:8.1f} memes/sec")
+
+		for workers in args.workers:
+			folder = os.path.join(directory, f"workers-{workers}")
+			with downloader.Downloader(workers=workers, per_host=args.per_host, backoff=0.05) as pool:
+				report = pool.download_all(urls, folder)
+				before = total_requests(servers)
+				again = pool.download_all(urls, folder)
+				repeat_requests = total_requests(servers) - before
+			rate = len(report.downloaded) / report.seconds
+			speedup = f"{rate / serial_rate:6.1f}x" if serial_rate else ''
+			complete = check_folder(folder, urls, args.size * 1024) and not report.failed
+			skipped_all = len(again.skipped) == len(urls) and repeat_requests == 0
+			print(f"  {f'Downloader, {workers} threads':24} {report.seconds:8.2f} s {rate:8.1f} memes/sec {speedup} "
+				f"{'complete' if complete else 'INCOMPLETE'}, "
+				f"rerun {'skipped all' if skipped_all else f'made {repeat_requests} requests'}")
+
+	for server in servers:
+		server.shutdown()
@@ -0,0 +1,107 @@
+"""
+	Fuzzy term expansion on a synthetic corpus (see synthetic.py): how
+	long fuzzy.TermIndex takes to build and how big it is, lookup latency
+	against comparing the query term with every term of the vocabulary,
+	and search latency with and without fuzzy=True.
+
+	Run from the repo root:
+		python3 -m benchmarks.fuzzy_terms --docs 100000
+
+	Probes are vocabulary terms with one or two random edits (as many as
+	fuzzy.max_distance allows), the way OCR misreads them; every lookup
+	has to find the term the probe was made from, and give the same
+	terms as the scan.
+"""
+import argparse
+import random
+import string
+import time
+import numpy as np
+import fuzzy
+import search
+from benchmarks import synthetic
+
+def misread(term, edits, rng):
+	for _ in range(edits):
+		position = rng.randrange(len(term) + 1)
+		kind = rng.choice(('insert', 'delete', 'replace') if position < len(term) else ('insert',))
+		character = rng.choice(string.ascii_lowercase)
+		if kind == 'insert':
+			term = term[:position] + character + term[position:]
+		elif kind == 'delete':
+			term = term[:position] + term[position + 1:]
+		else:
+			term = term[:position] + character + term[position + 1:]
+	return term
+
+def make_probes(vocabulary, count, rng):
+	probes = []
+	while len(probes) < count:
+		term = rng.choice(vocabulary)
+		if fuzzy.max_distance(term):
+			probe = misread(term, rng.randint(1, fuzzy.max_distance(term)), rng)
+			if fuzzy.max_distance(probe) >= fuzzy.edit_distance(probe, term, 2):
+				probes.append((probe, term))
+	return probes
+
+def scan(vocabulary, term, distance):
+	found = []
+	for candidate in vocabulary:
+		edits = fuzzy.edit_distance(term, candidate, distance)
+		if edits <= distance:
+			found.append((edits, candidate))
+	return found
+
+def percentiles_ms(samples_ns):
+	samples = np.array(samples_ns) / 1e6
+	return np.percentile(samples, 50), np.percentile(samples, 99)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--docs', type=int, default=100000)
+	parser.add_argument('--probes', type=int, default=1000)
+	parser.add_argument('--scan-probes', type=int, default=20, help='probes also looked up with a linear scan')
+	parser.add_argument('--queries', type=int, default=300)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	index = search.index_documents(synthetic.generate_documents(args.docs, seed=args.seed), search.Index())
+	vocabulary = list(index.index)
+
+	start = time.perf_counter()
+	terms = fuzzy.TermIndex(vocabulary)
+	build = time.perf_counter() - start
+	array_bytes = terms.term_ids.nbytes + terms.offsets.nbytes
+	print(f"{args.docs} documents, {len(vocabulary)} terms, {len(terms.gram_ids)} trigrams")
+	print(f"  TermIndex built in {build:.2f} s, {array_bytes / 2**20:.1f} MiB of arrays")
+
+	probes = make_probes(vocabulary, args.probes, rng)
+	samples, found = [], 0
+	for probe, term in probes:
+		start = time.perf_counter_ns()
+		similar = terms.similar(probe, fuzzy.max_distance(probe))
+		samples.append(time.perf_counter_ns() - start)
+		found += term in {candidate for _, candidate in similar}
+	p50, p99 = percentiles_ms(samples)
+	print(f"  lookup  p50 {p50:7.3f} ms  p99 {p99:7.3f} ms  source term found for {found}/{len(probes)} probes")
+
+	scan_samples, same = [], True
+	for probe, _ in probes[:args.scan_probes]:
+		start = time.perf_counter_ns()
+		expected = scan(vocabulary, probe, fuzzy.max_distance(probe))
+		scan_samples.append(time.perf_counter_ns() - start)
+		same &= sorted(expected) == sorted(terms.similar(probe, fuzzy.max_distance(probe)))
+	p50, _ = percentiles_ms(scan_samples)
+	print(f"  scan    p50 {p50:7.3f} ms over the whole vocabulary, {'same terms' if same else 'TERMS DIFFER'}")
+
+	# queries of misread terms, searched both ways
+	queries = [' '.join(rng.choice(probes)[0] for _ in range(rng.randint(1, 3))) for _ in range(args.queries)]
+	for name, fuzzy_terms in (('exact', False), ('fuzzy=True', True)):
+		samples, hits = [], 0
+		for query in queries:
+			start = time.perf_counter_ns()
+			hits += index.search_top_k(query, 10, fuzzy=fuzzy_terms).total_hits > 0
+			samples.append(time.perf_counter_ns() - start)
+		p50, p99 = percentiles_ms(samples)
+		print(f"  search_top_k {name:10}  p50 {p50:7.3f} ms  p99 {p99:7.3f} ms  {hits}/{len(queries)} queries with hits")
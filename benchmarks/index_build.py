@@ -0,0 +1,59 @@
+"""
+	Index build time: search.index_documents (one process) against
+	parallel_index.index_documents at 1/2/4/8 workers, on data.xml.gz
+	repeated --copies times under fresh doc IDs. Each parallel index is
+	checked against the single process one.
+
+	Run from the repo root:
+		python3 -m benchmarks.index_build --copies 20 --workers 1 2 4 8
+
+	Documents are loaded before timing starts, so only analysis and
+	indexing are measured.
+"""
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import parallel_index
+import search
+
+def scaled_documents(copies: int):
+	documents = list(search.load_documents())
+	doc_id = 1
+	scaled = []
+	for _ in range(copies):
+		for document in documents:
+			scaled.append(search.Abstract(ID=doc_id, abstract=document.abstract, _filename=document.filename, _url=document.url))
+			doc_id += 1
+	return scaled
+
+def same_index(a, b) -> bool:
+	if a.index.keys() != b.index.keys() or a.documents.keys() != b.documents.keys():
+		return False
+	if not np.array_equal(a.all_document_lengths(), b.all_document_lengths()):
+		return False
+	return all(np.array_equal(a.index[t].ids(), b.index[t].ids())
+		and np.array_equal(a.index[t].frequencies(), b.index[t].frequencies()) for t in a.index)
+
+def timed(build):
+	start = time.perf_counter()
+	index = build()
+	return index, time.perf_counter() - start
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--copies', type=int, default=20)
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+	parser.add_argument('--shard-size', type=int, default=parallel_index.SHARD_SIZE)
+	args = parser.parse_args()
+
+	documents = scaled_documents(args.copies)
+	print(f"{len(documents)} documents, {multiprocessing.cpu_count()} CPUs")
+
+	baseline, baseline_time = timed(lambda: search.index_documents(documents, search.Index()))
+	print(f"{'index_documents':22} {baseline_time:8.2f} s {len(documents) / baseline_time:10,.0f} docs/sec")
+
+	for workers in args.workers:
+		index, elapsed = timed(lambda: parallel_index.index_documents(documents, workers=workers, shard_size=args.shard_size))
+		print(f"{f'parallel, {workers} workers':22} {elapsed:8.2f} s {len(documents) / elapsed:10,.0f} docs/sec "
+			f"{baseline_time / elapsed:5.2f}x {'same index' if same_index(baseline, index) else 'INDEX DIFFERS'}")
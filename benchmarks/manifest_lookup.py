@@ -0,0 +1,76 @@
+"""
+	Timing of the ingestion lookups: the old per-file re-read of
+	already_downloaded.txt and linear scan of filename_url.csv against
+	manifest.Manifest, on a synthetic directory of --files images.
+
+	Run from the repo root:
+		python3 -m benchmarks.manifest_lookup --files 100000
+
+	The old path is quadratic, so it is timed on --sample files and
+	extrapolated to the whole directory.
+"""
+import argparse
+import csv
+import os
+import random
+import string
+import tempfile
+import time
+from manifest import Manifest
+
+def legacy_is_downloaded(filename, path):
+	# what main.if_filename_in_already_downloaded_txt_file did
+	with open(path) as f:
+		return filename in f.read()
+
+def legacy_url_for(filename, path):
+	# what main.search_csv did
+	for row in csv.reader(open(path, 'r'), delimiter=','):
+		if filename == row[0]:
+			return row[1]
+
+def make_corpus(directory, files):
+	random.seed(0)
+	names = [''.join(random.choices(string.ascii_lowercase + string.digits, k=13)) + '.jpg' for _ in range(files)]
+	images = os.path.join(directory, 'memeImages')
+	os.mkdir(images)
+	for name in names:
+		open(os.path.join(images, name), 'w').close()
+	downloaded = os.path.join(directory, 'already_downloaded.txt')
+	with open(downloaded, 'w') as f:
+		f.writelines(f"{name}\n" for name in names[::2])
+	urls = os.path.join(directory, 'filename_url.csv')
+	with open(urls, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(['filename', 'url'])
+		writer.writerows([name, f"https://i.redd.it/{name}"] for name in names)
+	return images, downloaded, urls
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--files', type=int, default=100000)
+	parser.add_argument('--sample', type=int, default=200)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		images, downloaded, urls = make_corpus(directory, args.files)
+		listing = os.listdir(images)
+		sample = listing[:args.sample]
+
+		start = time.perf_counter()
+		new = [f for f in sample if not legacy_is_downloaded(f, downloaded)]
+		for f in new:
+			legacy_url_for(f, urls)
+		legacy = (time.perf_counter() - start) * len(listing) / len(sample)
+
+		start = time.perf_counter()
+		manifest = Manifest(downloaded, urls)
+		loaded = time.perf_counter() - start
+		new = [f for f in listing if not manifest.is_downloaded(f)]
+		resolved = [manifest.url_for(f) for f in new]
+		total = time.perf_counter() - start
+
+		print(f"{len(listing)} files, {len(new)} new, {sum(url is not None for url in resolved)} urls resolved")
+		print(f"old per-file scans: {legacy:10.2f} s (extrapolated from {len(sample)} files)")
+		print(f"Manifest:           {total:10.2f} s ({loaded:.2f} s loading the two files)")
+		print(f"{legacy / total:.0f}x faster")
@@ -0,0 +1,194 @@
+"""
+	Near-duplicate detection on synthetic memes: how well phash/dhash
+	separate reposts from different memes, how fast images hash, and
+	lookups in a MultiIndexHash against a linear scan over every hash.
+
+	Run from the repo root:
+		python3 -m benchmarks.near_duplicates --memes 300 --reposts 4 --table-size 100000
+
+	Every synthetic meme (shapes and caption text on a background) gets
+	--reposts copies the way subreddits repost them: rescaled, JPEG
+	recompressed, a little brighter or darker, a few pixels cropped.
+	A repost counts as found if it's within MAX_DISTANCE bits of its
+	original; a false match is any two different memes that close. Each
+	meme also gets a twin on the same template with another caption,
+	which is a different meme that the hash alone can't tell apart.
+	The last part clusters all the images with a HashIndex the way
+	main.py does, with each meme's caption standing in for its OCR text
+	(a word of it lost now and then on reposts, like OCR does), and
+	counts clusters that mix memes and memes split over clusters.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import cv2
+import numpy as np
+import near_duplicates
+
+WORDS = ['when', 'code', 'compiles', 'first', 'try', 'nobody', 'absolutely', 'stonks', 'monday', 'coffee',
+	'deadline', 'boss', 'weekend', 'cat', 'dog', 'teacher', 'exam', 'pizza', 'gym', 'sleep']
+
+def template(rng):
+	height, width = rng.randint(300, 700), rng.randint(300, 700)
+	top = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+	bottom = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+	fade = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+	img = np.broadcast_to(top * (1 - fade) + bottom * fade, (height, width, 3)).astype(np.uint8).copy()
+	for _ in range(rng.randint(2, 6)):
+		color = tuple(rng.randint(0, 255) for _ in range(3))
+		x, y = rng.randrange(width), rng.randrange(height)
+		if rng.random() < 0.5:
+			cv2.rectangle(img, (x, y), (x + rng.randint(20, 200), y + rng.randint(20, 200)), color, -1)
+		else:
+			cv2.circle(img, (x, y), rng.randint(10, 120), color, -1)
+	return img
+
+def random_caption(rng):
+	return [' '.join(rng.sample(WORDS, rng.randint(2, 4))) for _ in range(rng.randint(1, 3))]
+
+def captioned(img, caption):
+	img = img.copy()
+	height, width = img.shape[:2]
+	for line, text in enumerate(caption):
+		y = int(height * (0.15 + 0.35 * line))
+		cv2.putText(img, text.upper(), (10, y), cv2.FONT_HERSHEY_SIMPLEX, width / 600, (255, 255, 255), 3)
+	return img
+
+def synthetic_meme(rng):
+	"""
+	(template, caption, image), caption being a list of lines
+	"""
+	background = template(rng)
+	caption = random_caption(rng)
+	return background, caption, captioned(background, caption)
+
+def repost(img, rng):
+	height, width = img.shape[:2]
+	crop = rng.randint(0, 3) / 100
+	dy, dx = int(height * crop), int(width * crop)
+	img = img[dy:height - dy or height, dx:width - dx or width]
+	scale = rng.uniform(0.5, 1.5)
+	img = cv2.resize(img, (max(32, int(img.shape[1] * scale)), max(32, int(img.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+	img = cv2.convertScaleAbs(img, alpha=1.0, beta=rng.randint(-20, 20))
+	return encode(img, rng.randint(30, 95))
+
+def encode(img, quality) -> bytes:
+	return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+def gray(jpeg: bytes):
+	return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+def separation(originals, reposts, twins, hash_function, max_distance):
+	hashes = [hash_function(gray(jpeg)) for jpeg in originals]
+	found = total = 0
+	for meme, copies in enumerate(reposts):
+		for jpeg in copies:
+			total += 1
+			found += near_duplicates.hamming(hashes[meme], hash_function(gray(jpeg))) <= max_distance
+	false_matches = sum(near_duplicates.hamming(a, b) <= max_distance
+		for i, a in enumerate(hashes) for b in hashes[i + 1:])
+	pairs = len(hashes) * (len(hashes) - 1) // 2
+	twin_matches = sum(near_duplicates.hamming(hashes[meme], hash_function(gray(jpeg))) <= max_distance
+		for meme, jpeg in enumerate(twins))
+	return found / total, false_matches, pairs, twin_matches / len(twins)
+
+def images_per_second(jpegs, hash_function):
+	start = time.perf_counter()
+	for jpeg in jpegs:
+		hash_function(gray(jpeg))
+	return len(jpegs) / (time.perf_counter() - start)
+
+def table_against_scan(size, queries, max_distance, seed):
+	rng = random.Random(seed)
+	values = [rng.getrandbits(64) for _ in range(size)]
+	table = near_duplicates.MultiIndexHash(max_distance)
+	start = time.perf_counter()
+	for i, value in enumerate(values):
+		table.add(value, i)
+	build = time.perf_counter() - start
+	# half the queries a few bits off a stored hash, half random
+	probes = []
+	for i in range(queries):
+		value = rng.choice(values)
+		for _ in range(rng.randint(0, max_distance)):
+			value ^= 1 << rng.randrange(64)
+		probes.append(value if i % 2 else rng.getrandbits(64))
+
+	start = time.perf_counter()
+	table_results = [table.search(value) for value in probes]
+	table_time = (time.perf_counter() - start) / queries
+	start = time.perf_counter()
+	scan_results = [sorted((near_duplicates.hamming(value, other), i) for i, other in enumerate(values)
+		if near_duplicates.hamming(value, other) <= max_distance) for value in probes]
+	scan_time = (time.perf_counter() - start) / queries
+	same = [sorted(r) for r in table_results] == scan_results
+	return build, table_time, scan_time, same
+
+def ocr_misread(caption, rng):
+	words = ' '.join(caption).split()
+	if len(words) > 2 and rng.random() < 0.3:
+		words.pop(rng.randrange(len(words)))
+	return ' '.join(words)
+
+def clustering(originals, reposts, twins, captions, twin_captions, seed):
+	rng = random.Random(seed)
+	images = []
+	for meme, (original, copies) in enumerate(zip(originals, reposts)):
+		images.append((original, meme, ' '.join(captions[meme])))
+		images += [(jpeg, meme, ocr_misread(captions[meme], rng)) for jpeg in copies]
+		# the twin is a meme of its own
+		images.append((twins[meme], len(originals) + meme, ' '.join(twin_captions[meme])))
+	rng.shuffle(images)
+	with tempfile.TemporaryDirectory() as directory:
+		hashes = near_duplicates.HashIndex(os.path.join(directory, 'image_hashes.csv'))
+		items = [(f"{i}.jpg", near_duplicates.phash(gray(jpeg)), text) for i, (jpeg, _, text) in enumerate(images)]
+		start = time.perf_counter()
+		representatives = hashes.add(items)
+		elapsed = time.perf_counter() - start
+	memes = {}
+	for representative, (_, meme, _) in zip(representatives, images):
+		memes.setdefault(representative, set()).add(meme)
+	mixed = sum(len(cluster) > 1 for cluster in memes.values())
+	clusters_per_meme = {}
+	for representative, cluster in memes.items():
+		for meme in cluster:
+			clusters_per_meme[meme] = clusters_per_meme.get(meme, 0) + 1
+	split = sum(count > 1 for count in clusters_per_meme.values())
+	return len(images), len(memes), mixed, split, elapsed
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--memes', type=int, default=300)
+	parser.add_argument('--reposts', type=int, default=4)
+	parser.add_argument('--max-distance', type=int, default=near_duplicates.MAX_DISTANCE)
+	parser.add_argument('--table-size', type=int, default=100000)
+	parser.add_argument('--table-queries', type=int, default=200)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	memes = [synthetic_meme(rng) for _ in range(args.memes)]
+	originals = [encode(img, 90) for _, _, img in memes]
+	reposts = [[repost(img, rng) for _ in range(args.reposts)] for _, _, img in memes]
+	captions = [caption for _, caption, _ in memes]
+	# same template, another caption
+	twin_captions = [random_caption(rng) for _ in memes]
+	twins = [encode(captioned(background, caption), 90) for (background, _, _), caption in zip(memes, twin_captions)]
+	print(f"{args.memes} memes, {args.reposts} reposts each, max distance {args.max_distance}")
+
+	for name, hash_function in (('phash', near_duplicates.phash), ('dhash', near_duplicates.dhash)):
+		recall, false_matches, pairs, twin_rate = separation(originals, reposts, twins, hash_function, args.max_distance)
+		rate = images_per_second(originals, hash_function)
+		print(f"  {name}  reposts found {recall:7.1%}  false matches {false_matches}/{pairs} pairs  "
+			f"same template, other caption matched {twin_rate:6.1%}  {rate:8.0f} images/sec (decode + hash)")
+
+	build, table_time, scan_time, same = table_against_scan(args.table_size, args.table_queries, args.max_distance, args.seed)
+	print(f"  MultiIndexHash of {args.table_size} hashes: built in {build:.2f} s, {table_time * 1000:.3f} ms/query "
+		f"against {scan_time * 1000:.3f} ms/query linear scan ({scan_time / table_time:.0f}x), "
+		f"{'same matches' if same else 'MATCHES DIFFER'}")
+
+	total, clusters, mixed, split, elapsed = clustering(originals, reposts, twins, captions, twin_captions, args.seed)
+	print(f"  HashIndex with captions: {total} images of {2 * args.memes} memes -> {clusters} clusters in {elapsed:.2f} s, "
+		f"{mixed} mixing memes, {split} memes split over clusters")
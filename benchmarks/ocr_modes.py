@@ -0,0 +1,49 @@
+"""
+	Compare main.get_text OCR modes: one tesseract call per text region
+	(contours) against one call per image (composite).
+
+	Run from the repo root:
+		python3 -m benchmarks.ocr_modes --limit 50
+
+	Reports images/sec for each mode and how close the composite text
+	is to the per-region text, as the overlap of the analyzed tokens
+	(what the search index actually sees).
+"""
+import argparse
+import os
+import time
+import main
+import search
+
+def run(paths, mode):
+	texts = []
+	start = time.perf_counter()
+	for path in paths:
+		texts.append(main.get_text(path, mode, use_cache=False))
+	return texts, time.perf_counter() - start
+
+def token_overlap(a, b):
+	a = set(search.analyze(a or ''))
+	b = set(search.analyze(b or ''))
+	if not a and not b:
+		return 1.0
+	return len(a & b) / len(a | b)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--images', default='static/memeImages')
+	parser.add_argument('--limit', type=int, default=50)
+	args = parser.parse_args()
+
+	paths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images) if f.endswith(('.jpg', '.png')))[:args.limit]
+
+	results = {}
+	for mode in main.OCR_MODES:
+		texts, seconds = run(paths, mode)
+		results[mode] = texts
+		print(f"{mode:10} {len(paths) / seconds:8.2f} images/sec  ({seconds:.2f}s for {len(paths)} images)")
+
+	overlaps = [token_overlap(a, b) for a, b in zip(results['contours'], results['composite'])]
+	identical = sum(a == b for a, b in zip(results['contours'], results['composite']))
+	print(f"token overlap (jaccard) mean {sum(overlaps) / max(len(overlaps), 1):.3f}, min {min(overlaps, default=1.0):.3f}")
+	print(f"identical text for {identical}/{len(paths)} images")
@@ -0,0 +1,71 @@
+"""
+	What positions cost: postings bytes against positions bytes, index
+	build time with and without positions, and query latency for plain,
+	"phrase" and NEAR queries on a synthetic corpus (see synthetic.py).
+
+	Run from the repo root:
+		python3 -m benchmarks.positions_memory --docs 100000
+
+	Phrase and NEAR queries are cut out of the generated abstracts, so
+	every one of them matches at least one document.
+"""
+import argparse
+import random
+import time
+import numpy as np
+import search
+from benchmarks import synthetic
+
+def build(documents, positions):
+	start = time.perf_counter()
+	index = search.index_documents(documents, search.Index(positions=positions))
+	return index, time.perf_counter() - start
+
+def sample_queries(documents, count, seed):
+	rng = random.Random(seed)
+	phrases, nears = [], []
+	while len(phrases) < count:
+		tokens = rng.choice(documents).fulltext.split()
+		if len(tokens) < 4:
+			continue
+		start = rng.randrange(len(tokens) - 3)
+		phrases.append('"' + ' '.join(tokens[start:start + rng.randint(2, 3)]) + '"')
+		nears.append(f"{tokens[start]} NEAR/3 {tokens[start + 3]}")
+	return phrases, nears
+
+def latency_ms(index, queries):
+	samples = []
+	for query in queries:
+		start = time.perf_counter_ns()
+		index.search(query, search_type='AND', rank=True)
+		samples.append(time.perf_counter_ns() - start)
+	samples = np.array(samples) / 1e6
+	return np.percentile(samples, 50), np.percentile(samples, 99)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--docs', type=int, default=100000)
+	parser.add_argument('--queries', type=int, default=300)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	documents = list(synthetic.generate_documents(args.docs, seed=args.seed))
+	plain, plain_time = build(documents, False)
+	positional, positional_time = build(documents, True)
+
+	postings_bytes = sum(p.nbytes for p in positional.index.values())
+	positions_bytes = sum(p.nbytes for p in positional.positions.values())
+	print(f"{args.docs} documents, {len(positional.index)} terms")
+	print(f"  postings  {postings_bytes / 2**20:8.1f} MiB")
+	print(f"  positions {positions_bytes / 2**20:8.1f} MiB  ({positions_bytes / postings_bytes:.2f}x postings)")
+	print(f"  build     {plain_time:8.2f} s without positions, {positional_time:.2f} s with ({positional_time / plain_time:.2f}x)")
+
+	phrases, nears = sample_queries(documents, args.queries, args.seed)
+	plain_queries = [query.replace('"', '') for query in phrases]
+	for name, index, queries in (
+			('plain, no positions', plain, plain_queries),
+			('plain, positions', positional, plain_queries),
+			('"phrase"', positional, phrases),
+			('NEAR/3', positional, nears)):
+		p50, p99 = latency_ms(index, queries)
+		print(f"  {name:20} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms")
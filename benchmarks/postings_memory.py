@@ -0,0 +1,69 @@
+"""
+	Memory report: postings as Python sets + per-document Counters
+	(the old layout) against array-backed PostingsList.
+
+	Run from the repo root:
+		python3 -m benchmarks.postings_memory --copies 10
+
+	--copies repeats the corpus under fresh doc IDs to see how each
+	layout scales.
+"""
+import argparse
+import tracemalloc
+from collections import Counter
+import search
+from postings import PostingsList
+
+def analyzed_corpus(copies: int):
+	documents = list(search.load_documents())
+	analyzed = [Counter(search.analyze(document.fulltext)) for document in documents]
+	doc_id = 1
+	for _ in range(copies):
+		for term_frequencies in analyzed:
+			yield doc_id, term_frequencies
+			doc_id += 1
+
+def set_layout(corpus):
+	index = {}
+	term_frequencies = {}
+	for doc_id, tfs in corpus:
+		term_frequencies[doc_id] = Counter(tfs)
+		for token in tfs:
+			if token not in index:
+				index[token] = set()
+			index[token].add(doc_id)
+	return index, term_frequencies
+
+def array_layout(corpus):
+	index = {}
+	for doc_id, tfs in corpus:
+		for token, tf in tfs.items():
+			if token not in index:
+				index[token] = PostingsList()
+			index[token].add(doc_id, tf)
+	return index
+
+def measure(build, corpus):
+	tracemalloc.start()
+	result = build(corpus)
+	size, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, size
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--copies', type=int, default=1)
+	args = parser.parse_args()
+
+	corpus = list(analyzed_corpus(args.copies))
+	postings_count = sum(len(tfs) for _, tfs in corpus)
+
+	(sets, _), set_bytes = measure(set_layout, corpus)
+	arrays, array_bytes = measure(array_layout, corpus)
+	payload = sum(postings.nbytes for postings in arrays.values())
+
+	print(f"{len(corpus)} documents, {len(arrays)} tokens, {postings_count} postings")
+	print(f"sets + Counters: {set_bytes / 1e6:8.2f} MB  {set_bytes / postings_count:6.1f} bytes/posting")
+	print(f"PostingsList:    {array_bytes / 1e6:8.2f} MB  {array_bytes / postings_count:6.1f} bytes/posting")
+	print(f"  of which doc ID + tf arrays: {payload / 1e6:.2f} MB")
+	print(f"{set_bytes / array_bytes:.1f}x smaller")
@@ -0,0 +1,234 @@
+"""
+	Benchmark suite: loading, indexing and search on synthetic corpora
+	(see synthetic.py) at several sizes, written out as json so runs on
+	different commits can be compared.
+
+	Run from the repo root:
+		python3 -m benchmarks.suite --sizes 10000 100000 1000000
+		python3 -m benchmarks.suite --query-log queries.txt --output after.json
+		python3 -m benchmarks.suite --compare before.json after.json
+
+	Each size runs in its own process, so peak memory is per size. For
+	every size the suite measures:
+		load_documents   seconds, docs/sec
+		index_documents  seconds, docs/sec, postings MiB, RSS and peak RSS
+		Index.search     AND/OR, ranked and unranked, plus search_top_k:
+		                 latency percentiles and queries/sec over the query log
+	The query log is one query per line (--query-log), or --queries
+	generated ones. Results go to benchmarks/results/<commit>.json by default.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import search
+from benchmarks import synthetic
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# (name, search_type, rank), top_k is Index.search_top_k with k=TOP_K
+SEARCH_MODES = (
+	('and_ranked', 'AND', True),
+	('and_unranked', 'AND', False),
+	('or_ranked', 'OR', True),
+	('or_unranked', 'OR', False),
+	('or_top_k', 'OR', None))
+TOP_K = 50
+
+DEFAULT_QUERIES = 500
+
+PERCENTILES = (50, 90, 99)
+
+# a change bigger than this is flagged by --compare
+REGRESSION_THRESHOLD = 0.10
+
+def rss_mib():
+	"""
+	Current resident set size in MiB, None where /proc isn't available
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+	except (OSError, ValueError):
+		return None
+
+def peak_rss_mib():
+	# ru_maxrss is KiB on Linux, bytes on macOS
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def latency_summary(samples_ns):
+	samples = np.array(samples_ns, dtype=np.float64) / 1e6
+	summary = {f"p{p}_ms": float(np.percentile(samples, p)) for p in PERCENTILES}
+	summary['max_ms'] = float(samples.max())
+	summary['mean_ms'] = float(samples.mean())
+	summary['queries_per_sec'] = float(len(samples) / (samples.sum() / 1000))
+	return summary
+
+def time_queries(index, queries, search_type, rank):
+	samples = []
+	results = 0
+	for query in queries:
+		start = time.perf_counter_ns()
+		if rank is None:
+			found = len(index.search_top_k(query, TOP_K, search_type=search_type).hits)
+		else:
+			found = len(index.search(query, search_type=search_type, rank=rank) or ())
+		samples.append(time.perf_counter_ns() - start)
+		results += found
+	summary = latency_summary(samples)
+	summary['mean_results'] = results / len(queries)
+	return summary
+
+def run_size(size, queries, seed):
+	"""
+	Everything measured for one corpus size, run in a fresh process
+	"""
+	result = {'docs': size}
+	shape = synthetic.CorpusShape()
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'data.xml.gz')
+		synthetic.write_corpus(path, size, shape, seed)
+		result['corpus_mib'] = os.path.getsize(path) / 2**20
+		rss_before = rss_mib()
+
+		start = time.perf_counter()
+		documents = list(search.load_documents(path))
+		elapsed = time.perf_counter() - start
+		result['load_documents'] = {'seconds': elapsed, 'docs_per_sec': size / elapsed}
+
+	rss_loaded = rss_mib()
+	start = time.perf_counter()
+	index = search.index_documents(documents, search.Index())
+	elapsed = time.perf_counter() - start
+	rss_indexed = rss_mib()
+	result['index_documents'] = {
+		'seconds': elapsed,
+		'docs_per_sec': size / elapsed,
+		'terms': len(index.index),
+		'postings_mib': sum(p.nbytes for p in index.index.values()) / 2**20,
+		'documents_rss_mib': None if rss_before is None else rss_loaded - rss_before,
+		'index_rss_mib': None if rss_loaded is None else rss_indexed - rss_loaded,
+		'peak_rss_mib': peak_rss_mib()}
+
+	result['search'] = {'queries': len(queries)}
+	for name, search_type, rank in SEARCH_MODES:
+		result['search'][name] = time_queries(index, queries, search_type, rank)
+	return result
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+			check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def metadata(args, query_source):
+	return {
+		'commit': git_commit(),
+		'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+		'seed': args.seed,
+		'queries': query_source}
+
+def flatten(results):
+	"""
+	{(docs, 'phase.metric'): value} for every number in a results file
+	"""
+	flat = {}
+	def walk(prefix, value, docs):
+		if isinstance(value, dict):
+			for key, item in value.items():
+				walk(f"{prefix}.{key}" if prefix else key, item, docs)
+		elif isinstance(value, (int, float)) and not isinstance(value, bool):
+			flat[(docs, prefix)] = value
+	for result in results['results']:
+		walk('', result, result['docs'])
+	return flat
+
+def compare(base_path, new_path, threshold=REGRESSION_THRESHOLD):
+	"""
+	Print every metric of two results files side by side, returns
+	how many got worse by more than threshold
+	"""
+	with open(base_path) as f:
+		base = json.load(f)
+	with open(new_path) as f:
+		new = json.load(f)
+	print(f"base {base['meta']['commit']} ({base_path})  new {new['meta']['commit']} ({new_path})")
+	base_flat, new_flat = flatten(base), flatten(new)
+	regressions = 0
+	for key in sorted(base_flat.keys() & new_flat.keys()):
+		docs, metric = key
+		if metric in ('docs', 'search.queries') or metric.endswith(('.terms', 'mean_results')):
+			continue
+		old, current = base_flat[key], new_flat[key]
+		change = (current - old) / old if old else 0.0
+		# throughput is better higher, times and memory lower
+		worse = -change if metric.endswith('per_sec') else change
+		flag = ''
+		if worse > threshold:
+			flag = '  REGRESSION'
+			regressions += 1
+		elif worse < -threshold:
+			flag = '  improved'
+		print(f"{docs:>9} {metric:44} {old:14.3f} {current:14.3f} {change:+8.1%}{flag}")
+	return regressions
+
+def print_summary(result):
+	print(f"{result['docs']} docs, {result['corpus_mib']:.1f} MiB corpus")
+	load, build = result['load_documents'], result['index_documents']
+	print(f"  load_documents  {load['seconds']:8.2f} s {load['docs_per_sec']:10,.0f} docs/sec")
+	print(f"  index_documents {build['seconds']:8.2f} s {build['docs_per_sec']:10,.0f} docs/sec "
+		f"{build['terms']} terms, {build['postings_mib']:.1f} MiB postings, peak RSS {build['peak_rss_mib']:.0f} MiB")
+	for name, _, _ in SEARCH_MODES:
+		latency = result['search'][name]
+		print(f"  {name:14}  p50 {latency['p50_ms']:8.3f} ms  p90 {latency['p90_ms']:8.3f} ms  "
+			f"p99 {latency['p99_ms']:8.3f} ms  {latency['queries_per_sec']:10,.0f} q/s")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+	parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES, help='generated queries, ignored with --query-log')
+	parser.add_argument('--query-log', help='file with one query per line to replay')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', help='results file (default benchmarks/results/<commit>.json)')
+	parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two results files and exit')
+	args = parser.parse_args()
+
+	if args.compare:
+		sys.exit(1 if compare(*args.compare) else 0)
+
+	if args.query_log:
+		with open(args.query_log, encoding='utf-8') as f:
+			queries = [line.strip() for line in f if line.strip()]
+		query_source = {'log': args.query_log, 'count': len(queries)}
+	else:
+		queries = synthetic.generate_queries(args.queries, seed=args.seed)
+		query_source = {'generated': len(queries)}
+
+	results = {'meta': metadata(args, query_source), 'results': []}
+	# spawn, so every size starts from a fresh interpreter and its own peak RSS
+	context = multiprocessing.get_context('spawn')
+	for size in args.sizes:
+		with context.Pool(1) as pool:
+			result = pool.apply(run_size, (size, queries, args.seed))
+		print_summary(result)
+		results['results'].append(result)
+
+	output = args.output or os.path.join(RESULTS_DIR, f"{results['meta']['commit'] or 'results'}.json")
+	os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+	with open(output, 'w') as f:
+		json.dump(results, f, indent=2)
+	print(f"Wrote {output}")
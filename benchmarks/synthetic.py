@@ -0,0 +1,125 @@
+"""
+	Synthetic corpora shaped like our OCR abstracts, for benchmarks.
+
+	Document lengths are drawn from the lengths of the docs in data.xml.gz
+	and tokens from its raw token frequencies. OCR output keeps producing
+	tokens nobody has seen before (misread words, junk), so with the
+	probability a token occurs only once in the real corpus a token is
+	replaced by a misread copy instead, which grows the vocabulary with
+	the corpus like the real thing. Everything is seeded, the same
+	arguments give the same corpus.
+
+	Write a corpus in the data.xml.gz format:
+		python3 -m benchmarks.synthetic --docs 100000 --output synthetic.xml.gz
+"""
+import argparse
+import gzip
+import string
+from collections import Counter
+import numpy as np
+import corpus_writer
+import search
+
+SOURCE_PATH = 'data.xml.gz'
+
+# what OCR puts between tokens, with how often
+SEPARATORS = (' ', '\n', '\n\n \n\n')
+SEPARATOR_WEIGHTS = (0.6, 0.3, 0.1)
+
+MISREAD_CHARACTERS = string.ascii_letters + string.digits + string.punctuation
+
+class CorpusShape:
+	"""
+	Token frequencies and document lengths of a real corpus
+	"""
+	def __init__(self, path=SOURCE_PATH):
+		counts = Counter()
+		lengths = []
+		for document in search.load_documents(path):
+			tokens = (document.abstract or '').split()
+			counts.update(tokens)
+			lengths.append(len(tokens))
+		if not counts:
+			raise ValueError(f"{path} has no text to take the corpus shape from")
+		self.tokens = list(counts)
+		frequencies = np.array([counts[token] for token in self.tokens], dtype=np.float64)
+		self.probabilities = frequencies / frequencies.sum()
+		self.lengths = np.array(lengths)
+		# share of tokens that only occur once
+		self.novelty = sum(1 for count in counts.values() if count == 1) / sum(counts.values())
+
+def _misread(token, rng):
+	position = rng.integers(len(token))
+	return token[:position] + MISREAD_CHARACTERS[rng.integers(len(MISREAD_CHARACTERS))] + token[position + 1:]
+
+def generate_abstracts(count, shape=None, seed=0):
+	"""
+	Yield count OCR-like abstracts
+	"""
+	shape = shape or CorpusShape()
+	rng = np.random.default_rng(seed)
+	# generated in blocks so 1M docs don't need every token in memory at once
+	block = 10000
+	for start in range(0, count, block):
+		size = min(block, count - start)
+		lengths = rng.choice(shape.lengths, size=size)
+		picks = rng.choice(len(shape.tokens), size=int(lengths.sum()), p=shape.probabilities)
+		novel = rng.random(len(picks)) < shape.novelty
+		separators = rng.choice(len(SEPARATORS), size=len(picks), p=SEPARATOR_WEIGHTS)
+		position = 0
+		for length in lengths.tolist():
+			parts = []
+			for i in range(position, position + length):
+				token = shape.tokens[picks[i]]
+				parts.append(_misread(token, rng) if novel[i] else token)
+				parts.append(SEPARATORS[separators[i]])
+			position += length
+			yield ''.join(parts)
+
+def generate_documents(count, shape=None, seed=0):
+	"""
+	Yield count Abstracts with doc IDs 1..count
+	"""
+	for doc_id, abstract in enumerate(generate_abstracts(count, shape, seed), start=1):
+		filename = f"synthetic{doc_id:07d}.jpg"
+		yield search.Abstract(ID=doc_id, abstract=abstract, _filename=filename, _url=f"https://i.redd.it/{filename}")
+
+def write_corpus(path, count, shape=None, seed=0):
+	"""
+	Write count synthetic documents to path in the data.xml.gz format
+	"""
+	with gzip.open(path, 'wb', compresslevel=6) as f:
+		f.write(corpus_writer.HEADER)
+		for document in generate_documents(count, shape, seed):
+			f.write(corpus_writer.format_document(document).encode('utf-8'))
+		f.write(b'</div>\n')
+
+def generate_queries(count, shape=None, seed=0, max_terms=4):
+	"""
+	Query log of count queries of 1 to max_terms tokens. Tokens are picked
+	in proportion to the square root of their frequency, so there's a mix
+	of common and rare terms rather than mostly the most common ones.
+	"""
+	shape = shape or CorpusShape()
+	rng = np.random.default_rng(seed + 1)
+	weights = np.sqrt(shape.probabilities)
+	weights /= weights.sum()
+	queries = []
+	while len(queries) < count:
+		terms = [shape.tokens[i] for i in rng.choice(len(shape.tokens), size=rng.integers(1, max_terms + 1), p=weights)]
+		query = ' '.join(terms)
+		# skip queries that analyze to nothing (stopwords, punctuation)
+		if search.analyze(query):
+			queries.append(query)
+	return queries
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--docs', type=int, default=100000)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--source', default=SOURCE_PATH, help='corpus to take the shape from')
+	parser.add_argument('--output', default='synthetic.xml.gz')
+	args = parser.parse_args()
+
+	write_corpus(args.output, args.docs, CorpusShape(args.source), args.seed)
+	print(f"Wrote {args.docs} documents to {args.output}")
@@ -0,0 +1,136 @@
+"""
+	Length-prefixed record format for the corpus.
+
+	Loading data.xml.gz means gunzipping it and running lxml's iterparse
+	plus three findtext() lookups per <doc>. A record file stores the same
+	documents as a magic number and format version followed by one record
+	per doc:
+
+		doc ID, abstract length, filename length, url length   (<Iiii)
+		abstract, filename, url                                 (utf-8)
+
+	A length of -1 means the field was missing (findtext() returned None).
+	The file can be gzip framed, load_records() checks the first bytes.
+
+	Convert the xml corpus with:
+		python3 corpus_records.py data.xml.gz data.docs.gz
+	then build the snapshot from it:
+		python3 snapshot.py --corpus data.docs.gz
+"""
+import argparse
+import gzip
+import struct
+import time
+import search
+
+MAGIC = b'MEMEDOCS'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sI')
+RECORD = struct.Struct('<Iiii')
+GZIP_MAGIC = b'\x1f\x8b'
+
+# bytes read from the file at a time
+READ_SIZE = 1 << 22
+
+class RecordFormatError(Exception):
+	"""
+	Raised for a truncated record file or one from another format version
+	"""
+
+def _open(path):
+	with open(path, 'rb') as f:
+		start = f.read(2)
+	return gzip.open(path, 'rb') if start == GZIP_MAGIC else open(path, 'rb')
+
+def is_record_file(path) -> bool:
+	with _open(path) as f:
+		return f.read(len(MAGIC)) == MAGIC
+
+def _encode(value) -> bytes:
+	return b'' if value is None else value.encode('utf-8')
+
+def _length(value, encoded) -> int:
+	return -1 if value is None else len(encoded)
+
+def write_records(documents, path, compress=True):
+	"""
+	Write Abstracts to path, gzip framed unless compress=False,
+	returns how many were written
+	"""
+	count = 0
+	with (gzip.open(path, 'wb', compresslevel=6) if compress else open(path, 'wb')) as f:
+		f.write(FILE_HEADER.pack(MAGIC, VERSION))
+		for document in documents:
+			abstract, filename, url = _encode(document.abstract), _encode(document.filename), _encode(document.url)
+			f.write(RECORD.pack(document.ID,
+				_length(document.abstract, abstract),
+				_length(document.filename, filename),
+				_length(document.url, url)))
+			f.write(abstract + filename + url)
+			count += 1
+	return count
+
+def load_records(path):
+	"""
+	Yield the Abstracts in a record file, the same ones
+	search.load_documents yields for the xml it was converted from
+	"""
+	with _open(path) as f:
+		header = f.read(FILE_HEADER.size)
+		if len(header) < FILE_HEADER.size:
+			raise RecordFormatError(f"{path} is truncated")
+		magic, version = FILE_HEADER.unpack(header)
+		if magic != MAGIC:
+			raise RecordFormatError(f"{path} is not a record file")
+		if version != VERSION:
+			raise RecordFormatError(f"{path} is format version {version}, expected {VERSION}")
+
+		buffer = b''
+		for chunk in iter(lambda: f.read(READ_SIZE), b''):
+			buffer += chunk
+			position = 0
+			end = len(buffer)
+			while position + RECORD.size <= end:
+				doc_id, abstract_length, filename_length, url_length = RECORD.unpack_from(buffer, position)
+				start = position + RECORD.size
+				record_end = start + max(abstract_length, 0) + max(filename_length, 0) + max(url_length, 0)
+				if record_end > end:
+					break
+				fields = []
+				for length in (abstract_length, filename_length, url_length):
+					if length < 0:
+						fields.append(None)
+					else:
+						fields.append(buffer[start:start + length].decode('utf-8'))
+						start += length
+				yield search.Abstract(ID=doc_id, abstract=fields[0], _filename=fields[1], _url=fields[2])
+				position = record_end
+			buffer = buffer[position:]
+		if buffer:
+			raise RecordFormatError(f"{path} is truncated")
+
+def load_corpus(path='data.xml.gz'):
+	"""
+	Documents in path, read with load_records() for a record file
+	and search.load_documents() for xml
+	"""
+	if is_record_file(path):
+		return load_records(path)
+	return search.load_documents(path)
+
+def convert(xml_path, records_path, compress=True) -> int:
+	"""
+	Rewrite the xml corpus at xml_path as a record file
+	"""
+	return write_records(search.load_documents(xml_path), records_path, compress)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Convert data.xml.gz to the length-prefixed record format')
+	parser.add_argument('input', nargs='?', default='data.xml.gz')
+	parser.add_argument('output', nargs='?', default='data.docs.gz')
+	parser.add_argument('--no-compress', action='store_true', help="don't gzip the output")
+	args = parser.parse_args()
+
+	start_time = time.time()
+	count = convert(args.input, args.output, not args.no_compress)
+	print(f"Wrote {count} documents to {args.output} in {round(time.time() - start_time, 2)} seconds")
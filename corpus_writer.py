@@ -0,0 +1,146 @@
+"""
+	Streaming writer for the corpus (data.xml.gz).
+
+	main.py used to append raw XML to data_uncleaned.xml, copy the whole
+	file to data.xml to strip form feeds, and leave the gzip step to
+	whoever ran it. CorpusWriter appends each batch of docs straight to
+	data.xml.gz instead, escaping the text and dropping characters XML
+	doesn't allow as it goes.
+
+	The file is a series of gzip members (gzip readers see them as one
+	stream): the xml declaration and <div>, one member per batch, and a
+	small fixed member holding </div>. Appending a batch overwrites the
+	closing member with the batch followed by a new closing member, then
+	fsyncs, so after every batch the file is a complete document that
+	search.load_documents can read.
+"""
+from xml.sax.saxutils import escape
+import fcntl
+import gzip
+import os
+import re
+import zlib
+
+CORPUS_PATH = 'data.xml.gz'
+
+HEADER = b'<?xml version = "1.0" encoding = "UTF-8" standalone = "no" ?>\n<div>\n'
+# mtime=0 keeps the compressed bytes the same every time, so the
+# writer can recognise the closing member at the end of the file
+CLOSING_MEMBER = gzip.compress(b'</div>\n', mtime=0)
+
+# characters XML 1.0 doesn't allow, \f from tesseract page breaks among them
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# <doc> or <doc id="123">
+DOC_TAG = re.compile(r'<doc(?: id="(\d+)")?>')
+
+def clean(value) -> str:
+	return escape(INVALID_XML_CHARS.sub('', f"{value}"))
+
+def format_document(document) -> str:
+	return (f'<doc id="{document.ID}"><abstract>{clean(document.abstract)}</abstract>'
+		f'<filename>{clean(document.filename)}</filename><url>{clean(document.url)}</url></doc>\n')
+
+def _scan_members(path):
+	"""
+	End offset of every complete gzip member in path, and the
+	decompressed content of the last complete one
+	"""
+	ends = []
+	last = b''
+	current = []
+	decompressor = zlib.decompressobj(wbits=31)
+	offset = 0
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			offset += len(chunk)
+			data = chunk
+			while data:
+				current.append(decompressor.decompress(data))
+				if not decompressor.eof:
+					break
+				ends.append(offset - len(decompressor.unused_data))
+				last = b''.join(current)
+				current = []
+				data = decompressor.unused_data
+				decompressor = zlib.decompressobj(wbits=31)
+	return ends, last
+
+def _write_and_sync(f, data):
+	f.write(data)
+	f.truncate()
+	f.flush()
+	os.fsync(f.fileno())
+
+class CorpusWriter:
+	def __init__(self, path=CORPUS_PATH):
+		self.path = path
+		self._prepare()
+		self.next_doc_id = self._next_doc_id()
+
+	def _prepare(self):
+		"""
+		Make sure the file ends in CLOSING_MEMBER: create it if missing,
+		move </div> out of a file gzipped in one go (the old pipeline),
+		or drop a batch that was cut off half way through writing
+		"""
+		if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+			with open(self.path, 'wb') as f:
+				_write_and_sync(f, gzip.compress(HEADER, mtime=0) + CLOSING_MEMBER)
+			return
+
+		with open(self.path, 'rb') as f:
+			f.seek(max(0, os.path.getsize(self.path) - len(CLOSING_MEMBER)))
+			if f.read() == CLOSING_MEMBER:
+				return
+
+		ends, last = _scan_members(self.path)
+		if not ends:
+			raise ValueError(f"{self.path} is not a gzip file")
+
+		if last.rstrip().endswith(b'</div>'):
+			# the closing tag is inside the last member, recompress that
+			# member without it, through a temp file so a crash can't lose docs
+			start = ends[-2] if len(ends) > 1 else 0
+			content = last.rstrip()[:-len(b'</div>')] + b'\n'
+			tmp_path = f"{self.path}.{os.getpid()}.tmp"
+			with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+				remaining = start
+				while remaining:
+					chunk = src.read(min(remaining, 1 << 20))
+					dst.write(chunk)
+					remaining -= len(chunk)
+				_write_and_sync(dst, gzip.compress(content, mtime=0) + CLOSING_MEMBER)
+			os.replace(tmp_path, self.path)
+			return
+
+		# a batch was cut off by a crash, keep everything up to it
+		with open(self.path, 'r+b') as f:
+			f.seek(ends[-1])
+			_write_and_sync(f, CLOSING_MEMBER)
+
+	def _next_doc_id(self) -> int:
+		"""
+		One more than the last doc ID in the corpus, docs without an id
+		attribute count by position like in search.load_documents
+		"""
+		last = 0
+		with gzip.open(self.path, 'rt', encoding='utf-8', errors='replace') as f:
+			for line in f:
+				for match in DOC_TAG.finditer(line):
+					last = int(match.group(1)) if match.group(1) else last + 1
+		return last + 1
+
+	def write(self, documents):
+		"""
+		Append a batch of Abstracts and fsync, returns how many were written
+		"""
+		if not documents:
+			return 0
+		member = gzip.compress(''.join(format_document(d) for d in documents).encode('utf-8'), mtime=0)
+		with open(self.path, 'r+b') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			f.seek(os.fstat(f.fileno()).st_size - len(CLOSING_MEMBER))
+			_write_and_sync(f, member + CLOSING_MEMBER)
+		self.next_doc_id = max(self.next_doc_id, max(d.ID for d in documents) + 1)
+		return len(documents)
@@ -0,0 +1,185 @@
+"""
+	Crawl engine for memeHandles.MemeScraper.
+
+	Pages come off a Frontier: a FIFO queue plus a set of every url ever
+	queued, so a page is fetched at most once however many pages link to
+	it. The frontier enforces the budgets, nothing deeper than max_depth
+	links from the start and no more than max_pages pages in total.
+
+	Worker threads fetch pages through a downloader.Downloader (pooled
+	session, per-host limits, retries) behind one RateLimiter shared by
+	all of them. Every page is fetched and parsed once, with lxml, and
+	gives both its links and its images.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import threading
+import time
+from urllib.parse import urldefrag, urljoin, urlsplit
+import lxml.etree
+import lxml.html
+import requests
+import metrics
+from downloader import Downloader, DownloadError
+
+WORKERS = 8
+# pages per second over all workers, None for no limit
+RATE = 10.0
+MAX_DEPTH = 2
+MAX_PAGES = 1000
+
+class RateLimiter:
+	"""
+	At most rate acquire()s per second over every thread, spaced evenly
+	"""
+	def __init__(self, rate):
+		self.interval = 1 / rate if rate else 0.0
+		self._next = time.monotonic()
+		self._lock = threading.Lock()
+
+	def acquire(self):
+		if not self.interval:
+			return
+		with self._lock:
+			now = time.monotonic()
+			wait = self._next - now
+			self._next = max(self._next, now) + self.interval
+		if wait > 0:
+			time.sleep(wait)
+
+class Frontier:
+	"""
+	Urls waiting to be crawled, each with its depth. add() ignores urls
+	seen before and anything over the depth or page budget. pop() blocks
+	while other workers may still add pages, and returns None once the
+	queue is empty and nothing is in flight.
+	"""
+	def __init__(self, max_depth=MAX_DEPTH, max_pages=MAX_PAGES):
+		self.max_depth = max_depth
+		self.max_pages = max_pages
+		self.seen = set()
+		self._queue = deque()
+		self._in_flight = 0
+		self._condition = threading.Condition()
+
+	def add(self, url, depth) -> bool:
+		with self._condition:
+			if depth > self.max_depth or url in self.seen or len(self.seen) >= self.max_pages:
+				return False
+			self.seen.add(url)
+			self._queue.append((url, depth))
+			self._condition.notify()
+			return True
+
+	def pop(self):
+		with self._condition:
+			while not self._queue and self._in_flight:
+				self._condition.wait()
+			if not self._queue:
+				return None
+			self._in_flight += 1
+			return self._queue.popleft()
+
+	def done(self):
+		"""
+		Called once a popped url's links have been added
+		"""
+		with self._condition:
+			self._in_flight -= 1
+			if not self._in_flight:
+				self._condition.notify_all()
+
+@dataclass
+class Page:
+	url: str
+	depth: int
+	links: list = field(default_factory=list)
+	images: list = field(default_factory=list)
+
+def normalize(base, href):
+	"""
+	Absolute http(s) url for href as found on page base, without the
+	#fragment. None for mailto:, javascript: and the like.
+	"""
+	url = urldefrag(urljoin(base, href.strip()))[0]
+	return url if urlsplit(url).scheme in ('http', 'https') else None
+
+def parse_page(html, url):
+	"""
+	(links, images) of a page, absolute urls in document order, each once
+	"""
+	try:
+		tree = lxml.html.fromstring(html)
+	except (lxml.etree.ParserError, ValueError):
+		# empty page, or a str page with an encoding declaration
+		if isinstance(html, str):
+			return parse_page(html.encode('utf-8'), url)
+		return [], []
+	links = {}
+	for href in tree.xpath('//a/@href'):
+		link = normalize(url, href)
+		if link is not None:
+			links[link] = None
+	images = {}
+	for src in tree.xpath('//img/@src'):
+		image = normalize(url, src)
+		if image is not None:
+			images[image] = None
+	return list(links), list(images)
+
+class Crawler:
+	def __init__(self, downloader=None, workers=WORKERS, rate=RATE, max_depth=MAX_DEPTH, max_pages=MAX_PAGES, same_host=True):
+		self.downloader = downloader or Downloader(workers=workers)
+		self.workers = workers
+		self.rate_limiter = RateLimiter(rate)
+		self.max_depth = max_depth
+		self.max_pages = max_pages
+		self.same_host = same_host
+		# url -> repr of the error, for pages that couldn't be fetched
+		self.failed = {}
+
+	def fetch(self, url):
+		self.rate_limiter.acquire()
+		with metrics.span('crawl.fetch'):
+			return self.downloader.get(url).content
+
+	def crawl(self, starting_url) -> dict:
+		"""
+		Breadth-first crawl from starting_url, returns {url: Page} for every
+		page fetched. With same_host only links on the starting url's host
+		are followed.
+		"""
+		frontier = Frontier(self.max_depth, self.max_pages)
+		frontier.add(starting_url, 0)
+		host = urlsplit(starting_url).netloc
+		pages = {}
+		lock = threading.Lock()
+
+		def work():
+			while True:
+				item = frontier.pop()
+				if item is None:
+					return
+				url, depth = item
+				try:
+					try:
+						links, images = parse_page(self.fetch(url), url)
+					except (DownloadError, requests.RequestException) as e:
+						with lock:
+							self.failed[url] = repr(e)
+						continue
+					with lock:
+						pages[url] = Page(url, depth, links, images)
+					metrics.increment('crawl.pages')
+					for link in links:
+						if not self.same_host or urlsplit(link).netloc == host:
+							frontier.add(link, depth + 1)
+				finally:
+					# even if this page blew up, so the other workers don't wait forever
+					frontier.done()
+
+		with ThreadPoolExecutor(self.workers) as pool:
+			for result in [pool.submit(work) for _ in range(self.workers)]:
+				result.result()
+		return pages
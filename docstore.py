@@ -0,0 +1,203 @@
+"""
+	Compact, read-only document store for indexes loaded from a snapshot.
+
+	A dict of search.Abstract objects costs a Python object, a __dict__
+	and three strings per meme, most of it the OCR abstract that no
+	result page shows. DocumentStore keeps documents as columns instead:
+	filenames, urls and abstracts each one utf-8 buffer plus an offsets
+	array, all of them views into the snapshot's mmap. The only thing
+	built in memory is a doc ID -> row array, so a document costs a few
+	bytes of RAM and its abstract is only paged in from disk when it's
+	read.
+
+	Looking a doc ID up hands back a StoredDocument, a two-slot view
+	with the same ID/filename/url/abstract/fulltext attributes as
+	search.Abstract. Documents added after loading (the incremental
+	journal) sit in a small dict on top, see with_documents().
+"""
+from collections.abc import Mapping
+import numpy as np
+
+# bits in the missing column, set when findtext() returned None
+MISSING_ABSTRACT = 1
+MISSING_FILENAME = 2
+MISSING_URL = 4
+
+# rows of filenames gathered at a time by filename_array(), a block
+# takes rows * longest filename * 8 bytes of positions
+FILENAME_BLOCK = 1 << 14
+
+class StoredDocument:
+	__slots__ = ('_store', '_row')
+
+	def __init__(self, store, row):
+		self._store = store
+		self._row = row
+
+	@property
+	def ID(self):
+		return self._store._doc_ids[self._row]
+
+	@property
+	def abstract(self):
+		return self._store._string(2, self._row, MISSING_ABSTRACT)
+
+	@property
+	def fulltext(self):
+		return self.abstract
+
+	@property
+	def filename(self):
+		return self._store._string(0, self._row, MISSING_FILENAME)
+
+	@property
+	def url(self):
+		return self._store._string(1, self._row, MISSING_URL)
+
+	def __eq__(self, other):
+		return (isinstance(other, StoredDocument) and other._store is self._store and other._row == self._row)
+
+	def __hash__(self):
+		return hash((id(self._store), self._row))
+
+	def __repr__(self):
+		return f"StoredDocument(ID={self.ID}, filename={self.filename!r}, url={self.url!r})"
+
+class DocumentStore(Mapping):
+	"""
+	doc ID -> document over columns of a snapshot, see the module docstring.
+	doc_ids must be sorted; string columns are (utf-8 blob, offsets) pairs
+	where row i is blob[offsets[i]:offsets[i + 1]].
+	"""
+	def __init__(self, doc_ids, missing, filenames, filename_offsets, urls, url_offsets, abstracts, abstract_offsets,
+			extra=None):
+		self.doc_ids = doc_ids
+		self.missing = missing
+		self.filenames, self.filename_offsets = filenames, filename_offsets
+		self.urls, self.url_offsets = urls, url_offsets
+		self.abstracts, self.abstract_offsets = abstracts, abstract_offsets
+		# memoryviews for single lookups, indexing them gives plain ints
+		# and slices several times faster than numpy scalars
+		self._doc_ids = memoryview(doc_ids)
+		self._missing = memoryview(missing)
+		self._columns = [(memoryview(filenames), memoryview(filename_offsets)), (memoryview(urls), memoryview(url_offsets)),
+			(memoryview(abstracts), memoryview(abstract_offsets))]
+		self._rows = None
+		self._row_view = None
+		# doc ID -> search.Abstract, documents added since the snapshot
+		self._extra = extra or {}
+
+	def _share(self, extra):
+		store = DocumentStore(self.doc_ids, self.missing, self.filenames, self.filename_offsets, self.urls,
+			self.url_offsets, self.abstracts, self.abstract_offsets, extra)
+		store._rows, store._row_view = self._rows, self._row_view
+		return store
+
+	@property
+	def rows(self) -> np.ndarray:
+		"""
+		Row of each doc ID in the columns, -1 for IDs that aren't in them
+		"""
+		if self._rows is None:
+			rows = np.full(int(self.doc_ids[-1]) + 1 if len(self.doc_ids) else 0, -1, dtype=np.int32)
+			rows[self.doc_ids] = np.arange(len(self.doc_ids), dtype=np.int32)
+			self._rows = rows
+			self._row_view = memoryview(rows)
+		return self._rows
+
+	def _row(self, doc_id):
+		if self._row_view is None:
+			self.rows
+		rows = self._row_view
+		if isinstance(doc_id, (int, np.integer)) and 0 <= doc_id < len(rows):
+			row = rows[doc_id]
+			if row >= 0:
+				return row
+		return None
+
+	def _string(self, column, row, missing_bit):
+		if self._missing[row] & missing_bit:
+			return None
+		blob, offsets = self._columns[column]
+		return str(blob[offsets[row]:offsets[row + 1]], 'utf-8')
+
+	def __getitem__(self, doc_id):
+		document = self._extra.get(doc_id)
+		if document is not None:
+			return document
+		row = self._row(doc_id)
+		if row is None:
+			raise KeyError(doc_id)
+		return StoredDocument(self, row)
+
+	def __contains__(self, doc_id):
+		return doc_id in self._extra or self._row(doc_id) is not None
+
+	def __iter__(self):
+		yield from self.doc_ids.tolist()
+		for doc_id in self._extra:
+			if self._row(doc_id) is None:
+				yield doc_id
+
+	def __len__(self):
+		return len(self.doc_ids) + sum(self._row(doc_id) is None for doc_id in self._extra)
+
+	def __setitem__(self, doc_id, document):
+		# Index.index_document on a loaded index, the columns stay as they are
+		self._extra[doc_id] = document
+
+	def with_documents(self, documents: dict):
+		"""
+		New store with documents on top, sharing the columns with this one
+		"""
+		return self._share({**self._extra, **documents})
+
+	def url_mask(self) -> np.ndarray:
+		"""
+		Index.url_mask() without decoding every url: the missing bit, and
+		main.py's 'None' placeholder compared as bytes
+		"""
+		mask = np.zeros(max(len(self.rows), max(self._extra, default=0) + 1), dtype=bool)
+		lengths = np.diff(self.url_offsets.astype(np.int64))
+		has_url = (self.missing & MISSING_URL) == 0
+		# only urls four bytes long can be 'None'
+		for row in np.flatnonzero(has_url & (lengths == 4)).tolist():
+			has_url[row] = self.urls[int(self.url_offsets[row]):int(self.url_offsets[row + 1])].tobytes() != b'None'
+		mask[self.doc_ids] = has_url
+		for doc_id, document in self._extra.items():
+			mask[doc_id] = document.url is not None and document.url != 'None'
+		return mask
+
+	def filename_array(self, min_id=0) -> tuple:
+		"""
+		(doc IDs, filenames as a numpy bytes array, b'' when missing) of
+		the documents with a doc ID of at least min_id. The filenames are
+		gathered out of the column a block of rows at a time, none of
+		them is decoded.
+		"""
+		first = int(np.searchsorted(self.doc_ids, min_id))
+		offsets = self.filename_offsets[first:].astype(np.int64)
+		lengths = np.diff(offsets)
+		lengths[(self.missing[first:] & MISSING_FILENAME) != 0] = 0
+		width = max(int(lengths.max(initial=0)), 1)
+		columns = np.arange(width)
+		blocks = [np.zeros(0, dtype=f'S{width}')]
+		for start in range(0, len(lengths), FILENAME_BLOCK):
+			block = slice(start, start + FILENAME_BLOCK)
+			positions = np.minimum(offsets[:-1][block, None] + columns, len(self.filenames) - 1)
+			characters = np.where(columns < lengths[block, None], self.filenames[positions], 0).astype(np.uint8)
+			blocks.append(characters.view(f'S{width}').ravel())
+		extra = [(doc_id, document.filename) for doc_id, document in self._extra.items()
+			if doc_id >= min_id and self._row(doc_id) is None]
+		doc_ids = np.concatenate([self.doc_ids[first:].astype(np.intp), np.array([doc_id for doc_id, _ in extra], dtype=np.intp)])
+		names = np.concatenate(blocks + [np.array([(filename or '').encode('utf-8') for _, filename in extra], dtype=bytes)])
+		return doc_ids, names
+
+def merged(documents, new: dict):
+	"""
+	documents (a dict or a DocumentStore) with new on top, without
+	changing documents
+	"""
+	if isinstance(documents, DocumentStore):
+		return documents.with_documents(new)
+	return {**documents, **new}
@@ -0,0 +1,214 @@
+"""
+	Concurrent HTTP downloads for memeHandles.py.
+
+	One requests.Session (keep-alive, a connection pool sized to the
+	number of threads) is shared by a thread pool. At most per_host
+	requests go to the same host at once, so a page full of i.redd.it
+	links doesn't hammer one server while the others sit idle.
+
+	Requests that fail with a connection error, a timeout or a 429/5xx
+	are retried with exponential backoff (honouring Retry-After). Images
+	are checked on disk before anything is fetched and streamed to a
+	temporary file that is renamed into place once complete, so an
+	interrupted download never leaves a truncated image behind.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+WORKERS = 16
+PER_HOST = 4
+RETRIES = 3
+# seconds before the first retry, doubled for every retry after that
+BACKOFF = 0.5
+TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+def get_filename(url):
+	"""
+	if url == 'https://reddit.com/ambifj129.jpg'
+	--> return 'ambifj129.jpg'
+	"""
+	return url.rsplit('/', 1)[1]
+
+def _read_body(response):
+	# .content reads the whole body, it stays cached after the response is closed
+	response.content
+	return response
+
+def _save(response, path) -> int:
+	"""
+	Stream the body to a temporary file next to path, renamed into place
+	once it's complete. Returns the number of bytes written.
+	"""
+	tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	written = 0
+	try:
+		with open(tmp_path, 'wb') as f:
+			for chunk in response.iter_content(CHUNK_SIZE):
+				f.write(chunk)
+				written += len(chunk)
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	return written
+
+class DownloadError(Exception):
+	"""
+	Raised when a request still fails after every retry
+	"""
+
+@dataclass
+class DownloadReport:
+	downloaded: list = field(default_factory=list)
+	# urls whose file was already in the folder, never fetched
+	skipped: list = field(default_factory=list)
+	# url -> repr of the error
+	failed: dict = field(default_factory=dict)
+	bytes: int = 0
+	seconds: float = 0.0
+
+class Downloader:
+	def __init__(self, workers=WORKERS, per_host=PER_HOST, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT, session=None):
+		self.workers = workers
+		self.per_host = per_host
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.session = session or self._session()
+		self._hosts = {}
+		self._hosts_lock = threading.Lock()
+
+	def _session(self):
+		session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+		session.mount('http://', adapter)
+		session.mount('https://', adapter)
+		return session
+
+	def close(self):
+		self.session.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+		return False
+
+	def _host_slot(self, url):
+		host = urlsplit(url).netloc
+		with self._hosts_lock:
+			slot = self._hosts.get(host)
+			if slot is None:
+				slot = self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+		return slot
+
+	def _delay(self, attempt, retry_after=None):
+		if retry_after is not None and retry_after.isdigit():
+			return int(retry_after)
+		return self.backoff * 2 ** attempt
+
+	def fetch(self, url, read):
+		"""
+		GET url and return read(response), with the per-host limit held
+		for the whole transfer. A connection error, timeout or 429/5xx,
+		also one halfway through read, is retried; DownloadError once the
+		retries are used up or for any other error status.
+		"""
+		for attempt in range(self.retries + 1):
+			retry_after = None
+			try:
+				with self._host_slot(url):
+					with self.session.get(url, timeout=self.timeout, stream=True) as response:
+						if response.status_code in RETRY_STATUSES:
+							retry_after = response.headers.get('Retry-After')
+							error = DownloadError(f"{url}: HTTP {response.status_code}")
+						elif response.status_code >= 400:
+							# 404 and friends won't get better by asking again
+							raise DownloadError(f"{url}: HTTP {response.status_code}")
+						else:
+							return read(response)
+			except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+				error = DownloadError(f"{url}: {e!r}")
+			if attempt < self.retries:
+				metrics.increment('download.retries')
+				time.sleep(self._delay(attempt, retry_after))
+		raise error
+
+	def get(self, url) -> requests.Response:
+		"""
+		fetch() for small bodies, the response comes back fully read
+		"""
+		return self.fetch(url, _read_body)
+
+	def download(self, url, folder) -> int:
+		"""
+		Save url to folder/<filename> unless it's already there. Returns
+		the number of bytes written, None if the file existed.
+		"""
+		path = os.path.join(folder, get_filename(url))
+		if os.path.isfile(path):
+			return None
+		with metrics.span('download.image'):
+			written = self.fetch(url, lambda response: _save(response, path))
+		metrics.increment('download.bytes', written)
+		return written
+
+	def download_all(self, urls, folder) -> DownloadReport:
+		"""
+		Download every url into folder with the thread pool, a url that
+		fails ends up in report.failed instead of stopping the others
+		"""
+		start = time.perf_counter()
+		os.makedirs(folder, exist_ok=True)
+		report = DownloadReport()
+		# one download per filename, the first url wins
+		unique = {}
+		for url in urls:
+			unique.setdefault(get_filename(url), url)
+
+		def fetch(url):
+			try:
+				return url, self.download(url, folder), None
+			except (DownloadError, requests.RequestException, OSError) as e:
+				return url, None, e
+
+		with ThreadPoolExecutor(self.workers) as pool:
+			for url, written, error in pool.map(fetch, unique.values()):
+				if error is not None:
+					report.failed[url] = repr(error)
+				elif written is None:
+					report.skipped.append(url)
+				else:
+					report.downloaded.append(url)
+					report.bytes += written
+		metrics.increment('download.images', len(report.downloaded))
+		metrics.increment('download.skipped', len(report.skipped))
+		metrics.increment('download.failed', len(report.failed))
+		report.seconds = time.perf_counter() - start
+		return report
+
+	def get_json_all(self, urls) -> list:
+		"""
+		json body of every url, None where the request failed
+		"""
+		def fetch(url):
+			try:
+				return self.get(url).json()
+			except (DownloadError, requests.RequestException, ValueError) as e:
+				print(f"Failed to get {url}: {e!r}")
+				return None
+
+		with ThreadPoolExecutor(self.workers) as pool:
+			return list(pool.map(fetch, urls))
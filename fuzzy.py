@@ -0,0 +1,188 @@
+"""
+	Typo-tolerant term expansion.
+
+	OCR misreads letters ("copsule", "Flucoting"), so an exact lookup of
+	the query's stems misses memes whose text came out slightly wrong.
+	TermIndex finds the terms of an index's vocabulary within a few
+	edits (Levenshtein distance) of a query term, and Index.search(...,
+	fuzzy=True) adds them to the query with a lower weight.
+
+	Lookups go through a character trigram index of the vocabulary. A
+	term padded with two markers on each side has len + 2 trigrams, and
+	one edit changes at most three of them, so a term within d edits of
+	the query shares at least (query trigrams - 3 * d) of them. Terms are
+	numbered shortest first, which makes the terms of a usable length a
+	contiguous range of IDs: only that window of each trigram's postings
+	is looked at. A term in fewer than (windows - needed + 1) of them
+	can't reach the count, so candidates come from that many of the
+	shortest windows and are counted in the others by binary search.
+	The few with enough shared trigrams are checked with a bounded edit
+	distance.
+	https://nlp.stanford.edu/IR-book/html/htmledition/k-gram-indexes-for-spelling-correction-1.html
+"""
+from array import array
+import numpy as np
+
+GRAM = 3
+# analyze() strips punctuation, so no term contains the marker
+PAD = '$' * (GRAM - 1)
+
+# edits allowed for a query term of up to this many characters, longer terms get 2
+SHORT_TERM = 3
+MEDIUM_TERM = 7
+
+# score multiplier per edit, an expansion 2 edits away counts a quarter
+FUZZY_WEIGHT = 0.5
+# expansions kept per query term, closest and most common first
+MAX_EXPANSIONS = 5
+
+def max_distance(term) -> int:
+	"""
+	Edits allowed for term: none for short terms, where one edit makes a
+	different word more often than not
+	"""
+	if len(term) <= SHORT_TERM:
+		return 0
+	return 1 if len(term) <= MEDIUM_TERM else 2
+
+def grams(term) -> set:
+	padded = PAD + term + PAD
+	return {padded[i:i + GRAM] for i in range(len(padded) - GRAM + 1)}
+
+def edit_distances(a, others, limit) -> list:
+	"""
+	Levenshtein distance between a and each of others, limit + 1 for
+	anything above limit. Bit-parallel (Myers/Hyyrö): a column of the DP
+	table is a pair of bit vectors, updated with a handful of integer
+	operations per character instead of a loop over a.
+	https://doi.org/10.1145/316542.316550
+	"""
+	# bit i of peq[c] is set when a[i] == c
+	peq = {}
+	for i, c in enumerate(a):
+		peq[c] = peq.get(c, 0) | (1 << i)
+	mask = (1 << len(a)) - 1
+	last = 1 << (len(a) - 1) if a else 0
+	distances = []
+	for b in others:
+		if abs(len(a) - len(b)) > limit:
+			distances.append(limit + 1)
+			continue
+		if not a:
+			distances.append(len(b))
+			continue
+		pv, mv, score = mask, 0, len(a)
+		for c in b:
+			eq = peq.get(c, 0)
+			xv = eq | mv
+			xh = (((eq & pv) + pv) ^ pv) | eq
+			ph = mv | ~(xh | pv)
+			mh = pv & xh
+			if ph & last:
+				score += 1
+			elif mh & last:
+				score -= 1
+			ph = (ph << 1) | 1
+			pv = ((mh << 1) | ~(xv | ph)) & mask
+			mv = ph & xv
+		distances.append(score if score <= limit else limit + 1)
+	return distances
+
+def edit_distance(a, b, limit) -> int:
+	return edit_distances(a, (b,), limit)[0]
+
+class TermIndex:
+	"""
+	Trigram index of a vocabulary, see the module docstring. Built once
+	per index; terms added later (the incremental journal) go in a small
+	TermIndex of their own, see with_terms().
+	"""
+	def __init__(self, terms=()):
+		self.terms = sorted(set(terms), key=lambda term: (len(term), term))
+		lengths = np.array([len(term) for term in self.terms], dtype=np.int32)
+		# starts[n] is the first term ID of length n or more
+		self.starts = np.searchsorted(lengths, np.arange(int(lengths.max(initial=0)) + 2)).tolist()
+		# gram -> row in offsets, the term IDs containing it are
+		# term_ids[offsets[row]:offsets[row + 1]], ascending
+		self.gram_ids = {}
+		gram_column = array('i')
+		term_column = array('i')
+		for term_id, term in enumerate(self.terms):
+			for gram in grams(term):
+				gram_column.append(self.gram_ids.setdefault(gram, len(self.gram_ids)))
+				term_column.append(term_id)
+		gram_column = np.frombuffer(gram_column, dtype=np.int32)
+		self.term_ids = np.frombuffer(term_column, dtype=np.int32)[np.argsort(gram_column, kind='stable')]
+		self.offsets = np.zeros(len(self.gram_ids) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(gram_column, minlength=len(self.gram_ids)), out=self.offsets[1:])
+		self._extra = None
+
+	def __len__(self):
+		return len(self.terms) + (len(self._extra) if self._extra is not None else 0)
+
+	def with_terms(self, terms):
+		"""
+		New TermIndex with terms added, sharing the arrays of this one
+		"""
+		extra = list(self._extra.terms) if self._extra is not None else []
+		added = TermIndex.__new__(TermIndex)
+		added.__dict__.update(self.__dict__)
+		added._extra = TermIndex(extra + list(terms))
+		return added
+
+	def _candidates(self, term, distance) -> np.ndarray:
+		longest = len(self.starts) - 1
+		lo = self.starts[min(max(len(term) - distance, 0), longest)]
+		hi = self.starts[min(len(term) + distance + 1, longest)]
+		query_grams = grams(term)
+		needed = len(query_grams) - GRAM * distance
+		if needed <= 0:
+			return np.arange(lo, hi)
+		# int32 like term_ids, searchsorted would convert the whole window to match anything else
+		bounds = np.array([lo, hi], dtype=np.int32)
+		windows = []
+		for gram in query_grams:
+			row = self.gram_ids.get(gram)
+			if row is None:
+				continue
+			ids = self.term_ids[self.offsets[row]:self.offsets[row + 1]]
+			start, end = ids.searchsorted(bounds).tolist()
+			if end > start:
+				windows.append(ids[start:end])
+		if len(windows) < needed:
+			return np.zeros(0, dtype=np.int32)
+		windows.sort(key=len)
+		prefix = len(windows) - needed + 1
+		candidates = np.unique(np.concatenate(windows[:prefix]))
+		counts = np.zeros(len(candidates), dtype=np.int32)
+		for ids in windows:
+			positions = ids.searchsorted(candidates)
+			positions[positions == len(ids)] = 0
+			counts += ids[positions] == candidates
+		return candidates[counts >= needed]
+
+	def similar(self, term, distance) -> list:
+		"""
+		(edits, term) for the terms within distance edits of term, term
+		itself included if it's in the vocabulary
+		"""
+		candidates = [self.terms[term_id] for term_id in self._candidates(term, distance).tolist()]
+		found = [(edits, candidate) for edits, candidate in zip(edit_distances(term, candidates, distance), candidates)
+			if edits <= distance]
+		if self._extra is not None:
+			found += self._extra.similar(term, distance)
+		return found
+
+def expand(index, term, limit=MAX_EXPANSIONS) -> list:
+	"""
+	(expansion, weight) for up to limit terms of index within
+	max_distance(term) of term, not counting term itself; the closest
+	first, ties going to the term in more documents
+	"""
+	distance = max_distance(term)
+	if not distance:
+		return []
+	similar = [(edits, candidate) for edits, candidate in index.fuzzy_terms().similar(term, distance)
+		if candidate != term]
+	similar.sort(key=lambda match: (match[0], -index.document_frequency(match[1]), match[1]))
+	return [(candidate, FUZZY_WEIGHT ** edits) for edits, candidate in similar[:limit]]
@@ -0,0 +1,256 @@
+"""
+	Incremental index updates.
+
+	main.py appends every batch of freshly OCR'd memes to a journal
+	(data_delta.jsonl, one json document per line, with the doc ID main.py
+	gave it). Each web worker tails the journal and folds new documents
+	into its index as a delta segment: only the new documents are
+	analyzed, and the postings of the tokens they contain get the delta
+	appended as an extra part (postings.SegmentedPostings) instead of
+	being rebuilt. Every other token's postings are shared with the
+	previous index.
+
+	Updates are copy-on-write: with_documents() and merge_segments()
+	return a new Index and the old one is left untouched, so searches
+	already running on it are never affected. merge_segments() is run in
+	the background every so often to collapse the segmented postings.
+
+	Once a worker has loaded an index that covers documents in the
+	journal, compact_journal() drops them from it, so the journal only
+	holds what the corpus snapshot doesn't have yet.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import numpy as np
+import docstore
+import positions as positions_engine
+import postings
+import search
+
+JOURNAL_PATH = 'data_delta.jsonl'
+
+# seconds between checks of the journal for new documents
+POLL_INTERVAL = 2
+# seconds between merges of delta segments into the main postings
+MERGE_INTERVAL = 60
+
+def _locked(path):
+	"""
+	Exclusive lock on path's lock file, held while the journal is
+	appended to or compacted (compaction replaces the file, so the
+	journal itself can't be what's locked)
+	"""
+	lock = open(f"{path}.lock", 'w')
+	fcntl.flock(lock, fcntl.LOCK_EX)
+	return lock
+
+def append_to_journal(documents, path=JOURNAL_PATH):
+	"""
+	Append Abstracts to the journal, flushed to disk before returning
+	"""
+	with _locked(path), open(path, 'a', encoding='utf-8') as f:
+		for document in documents:
+			f.write(json.dumps({
+				'id': document.ID,
+				'abstract': document.abstract,
+				'filename': document.filename,
+				'url': document.url}) + '\n')
+		f.flush()
+		os.fsync(f.fileno())
+
+def compact_journal(covered, path=JOURNAL_PATH) -> int:
+	"""
+	Drop the records whose doc ID is in covered (e.g. the documents of an
+	index loaded from a snapshot) from the journal. The rest is written
+	to a new file that replaces the journal, readers notice and start
+	over on it. Returns how many records were dropped.
+	"""
+	if not os.path.isfile(path):
+		return 0
+	with _locked(path):
+		kept = []
+		dropped = 0
+		with open(path, 'rb') as f:
+			for line in f:
+				if line.endswith(b'\n') and json.loads(line)['id'] in covered:
+					dropped += 1
+				else:
+					kept.append(line)
+		if dropped:
+			tmp_path = f"{path}.{os.getpid()}.tmp"
+			with open(tmp_path, 'wb') as f:
+				f.writelines(kept)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_path, path)
+	return dropped
+
+class JournalReader:
+	"""
+	Reads the documents appended to the journal since the last call
+	"""
+	def __init__(self, path=JOURNAL_PATH):
+		self.path = path
+		self.offset = 0
+		self._inode = None
+
+	def read_new(self) -> list:
+		if not os.path.isfile(self.path):
+			return []
+
+		documents = []
+		with open(self.path, 'rb') as f:
+			stat = os.fstat(f.fileno())
+			if stat.st_ino != self._inode or stat.st_size < self.offset:
+				# journal was truncated or replaced (compact_journal), start over
+				self._inode = stat.st_ino
+				self.offset = 0
+			f.seek(self.offset)
+			for line in f:
+				if not line.endswith(b'\n'):
+					# main.py is halfway through writing this one
+					break
+				self.offset += len(line)
+				record = json.loads(line)
+				documents.append(search.Abstract(
+					ID=record['id'],
+					abstract=record['abstract'],
+					_filename=record['filename'],
+					_url=record['url']))
+		return documents
+
+def with_documents(index, documents):
+	"""
+	New Index with documents added as a delta segment. Documents whose
+	doc ID is already in the index are skipped.
+	"""
+	delta = search.Index(positions=index.positions is not None)
+	for document in documents:
+		if document.ID not in index.documents:
+			delta.index_document(document)
+	if not delta.documents:
+		return index
+
+	updated = search.Index()
+	updated.documents = docstore.merged(index.documents, delta.documents)
+
+	lengths = index.all_document_lengths()
+	delta_lengths = delta.all_document_lengths()
+	doc_lengths = np.zeros(max(len(lengths), len(delta_lengths)), dtype=np.uint32)
+	doc_lengths[:len(lengths)] = lengths
+	new_ids = np.fromiter(delta.documents, dtype=np.intp, count=len(delta.documents))
+	doc_lengths[new_ids] = delta_lengths[new_ids]
+	updated.doc_lengths = doc_lengths
+
+	updated.index = dict(index.index)
+	if delta.positions is not None:
+		updated.positions = dict(index.positions)
+	for token, delta_postings in delta.index.items():
+		existing = index.index.get(token)
+		if delta.positions is not None:
+			updated.positions[token] = positions_engine.extend(index.positions.get(token), delta.positions[token],
+				postings.EMPTY if existing is None else existing.ids(), delta_postings.ids())
+		updated.index[token] = postings.extend(existing, delta_postings)
+
+	updated.update_statistics()
+	if index._fuzzy_terms is not None:
+		# only the new terms get indexed, the rest is shared
+		updated._fuzzy_terms = index._fuzzy_terms.with_terms(token for token in delta.index if token not in index.index)
+	return updated
+
+def merge_segments(index):
+	"""
+	New Index with every segmented postings list collapsed into one,
+	or index itself if there is nothing to merge
+	"""
+	segmented = [token for token, p in index.index.items() if isinstance(p, postings.SegmentedPostings)]
+	if not segmented:
+		return index
+
+	merged = search.Index()
+	merged.documents = index.documents
+	merged.doc_lengths = index.doc_lengths
+	merged.index = dict(index.index)
+	if index.positions is not None:
+		merged.positions = dict(index.positions)
+	for token in segmented:
+		merged.index[token] = merged.index[token].merged()
+		if index.positions is not None:
+			merged.positions[token] = merged.positions[token].merged()
+	merged.update_statistics()
+	# same vocabulary
+	merged._fuzzy_terms = index._fuzzy_terms
+	return merged
+
+class IncrementalUpdater:
+	"""
+	Background thread that tails the journal into an IndexService's index
+	and merges delta segments every merge_interval seconds
+	"""
+	def __init__(self, service, journal_path=JOURNAL_PATH, poll_interval=POLL_INTERVAL, merge_interval=MERGE_INTERVAL):
+		self.service = service
+		self.journal = JournalReader(journal_path)
+		self.poll_interval = poll_interval
+		self.merge_interval = merge_interval
+		# documents the journal added on top of the last full index load
+		self.documents_added = 0
+		# held while reading the journal, reload() replays it from the watcher thread
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name='index-updater', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+
+	def poll(self):
+		"""
+		Add whatever is new in the journal, returns how many documents were read
+		"""
+		with self._lock:
+			return self._poll()
+
+	def replay(self):
+		"""
+		Read the whole journal again, after a new index was loaded
+		"""
+		with self._lock:
+			self.journal.offset = 0
+			self.documents_added = 0
+			return self._poll()
+
+	def _poll(self):
+		documents = self.journal.read_new()
+		if documents:
+			added = 0
+
+			def change(index):
+				nonlocal added
+				updated = with_documents(index, documents)
+				# documents already in the index (a replay after a reload) don't count
+				added = len(updated.documents) - len(index.documents)
+				return updated
+
+			self.service.update(change)
+			self.documents_added += added
+		return len(documents)
+
+	def merge(self):
+		self.service.update(merge_segments)
+
+	def _run(self):
+		last_merge = time.monotonic()
+		while not self._stop.wait(self.poll_interval):
+			try:
+				self.poll()
+				if time.monotonic() - last_merge >= self.merge_interval:
+					self.merge()
+					last_merge = time.monotonic()
+			except Exception as e:
+				print(f"Incremental index update failed: {e!r}")
@@ -0,0 +1,255 @@
+"""
+	Process-wide search index shared by every request.
+
+	The index is loaded once when the app starts (in a background
+	thread so the worker can come up straight away) instead of
+	re-reading data.xml.gz on every query. Requests wait on the
+	readiness event until the first build has finished.
+
+	After that a watcher thread checks data.xml.gz and the snapshot for
+	changes and loads the new index off the request path. The new index
+	is swapped in with a single assignment: searches that already picked
+	up the old one finish on it, the next ones see the new one.
+"""
+import os
+import threading
+import time
+import incremental
+import metrics
+import near_duplicates
+import search
+import snapshot
+from query_cache import QueryCache
+
+class IndexNotReady(Exception):
+	"""
+	Raised when the index is asked for before it has finished loading
+	"""
+
+def corpus_path():
+	"""
+	Corpus the snapshot is checked against and rebuilt from: data.xml.gz,
+	or whatever MEME_SEARCH_CORPUS names, e.g. the record file
+	data.docs.gz (see corpus_records.py)
+	"""
+	return os.environ.get('MEME_SEARCH_CORPUS') or snapshot.CORPUS_PATH
+
+def build_index():
+	"""
+	Default loader: open the on-disk snapshot, rebuilding it first if
+	the corpus has changed since it was written. MEME_SEARCH_POSITIONS=1
+	asks for an index with token positions (phrase and NEAR queries).
+	"""
+	return snapshot.load_or_build(corpus_path(),
+		positions=os.environ.get('MEME_SEARCH_POSITIONS', '') not in ('', '0'))
+
+# seconds between checks of the watched files for a new corpus/snapshot
+RELOAD_INTERVAL = 10
+
+class IndexService:
+	def __init__(self, loader=build_index, cache=None, journal_path=incremental.JOURNAL_PATH,
+			watch_paths=None, reload_interval=RELOAD_INTERVAL):
+		self._loader = loader
+		self._write_lock = threading.Lock()
+		# reload when any of these change, empty to never reload
+		self.watch_paths = tuple(watch_paths) if watch_paths is not None else (corpus_path(), snapshot.SNAPSHOT_PATH)
+		# written by the loader itself when the snapshot is stale, not a reason to reload
+		self.loader_outputs = (snapshot.SNAPSHOT_PATH,)
+		self.reload_interval = reload_interval
+		self._watched = None
+		self._watcher = None
+		# follows the journal main.py writes new memes to, None to disable
+		self.updater = incremental.IncrementalUpdater(self, journal_path) if journal_path else None
+		self.cache = cache if cache is not None else QueryCache()
+		self._index = None
+		self._ready = threading.Event()
+		self._lock = threading.Lock()
+		self._thread = None
+		self.error = None
+		# bumped every time a full index is loaded, 1 after startup
+		self.generation = 0
+		self.load_duration = None
+		self.loaded_at = None
+		self.hashes_path = near_duplicates.HASHES_PATH
+		# near_duplicates.Clusters of the index, for distinct searches
+		self._clusters = None
+
+	def start(self, background=True):
+		"""
+		Start loading the index, only the first call does anything
+		"""
+		with self._lock:
+			if self._thread is not None or self._ready.is_set():
+				return
+			if background:
+				self._thread = threading.Thread(target=self._load, name='index-loader', daemon=True)
+				self._thread.start()
+				return
+		self._load()
+
+	def _signature(self):
+		signature = []
+		for path in self.watch_paths:
+			try:
+				stat = os.stat(path)
+				signature.append((path, stat.st_mtime_ns, stat.st_size))
+			except FileNotFoundError:
+				signature.append((path, None, None))
+		return tuple(signature)
+
+	def _load(self):
+		self.reload()
+		# started even if that failed: the watcher retries once the files
+		# have settled, so a corpus that was missing at startup still gets loaded
+		if self.watch_paths and self.reload_interval:
+			self._watcher = threading.Thread(target=self._watch, name='index-watcher', daemon=True)
+			self._watcher.start()
+
+	def reload(self) -> bool:
+		"""
+		Load a fresh index and swap it in, returns False (keeping the
+		current index) if loading fails
+		"""
+		signature = self._signature()
+		start_time = time.perf_counter()
+		try:
+			with metrics.span('index.load'):
+				index = self._loader()
+		except Exception as e:
+			metrics.increment('index.load_failures')
+			self.error = e
+			print(f"Failed to load index: {e!r}")
+			return False
+		load_duration = time.perf_counter() - start_time
+		# the loader may have rebuilt the snapshot, what it wrote is what was loaded
+		written = {entry[0]: entry for entry in self._signature() if entry[0] in self.loader_outputs}
+		signature = tuple(written.get(entry[0], entry) for entry in signature)
+		with metrics.span('index.clusters'):
+			clusters = near_duplicates.Clusters(index.documents, self.hashes_path)
+
+		with self._write_lock:
+			self._index = index
+			self._clusters = clusters
+			self.generation += 1
+			self.load_duration = load_duration
+			self.loaded_at = time.time()
+			self.error = None
+			# the corpus's taken before loading, so a change made while we
+			# were loading still triggers another reload
+			self._watched = signature
+		print(f"Index generation {self.generation}: {len(index.documents)} documents in {load_duration:.2f} seconds")
+
+		if self.updater is not None:
+			# what the new index already has can go from the journal, the
+			# rest the new corpus may not have yet
+			incremental.compact_journal(index.documents, self.updater.journal.path)
+			self.updater.replay()
+		if not self._ready.is_set():
+			self._ready.set()
+			if self.updater is not None:
+				self.updater.start()
+		return True
+
+	def _watch(self):
+		previous = None
+		while True:
+			time.sleep(self.reload_interval)
+			try:
+				signature = self._signature()
+				# main.py appends to data.xml.gz every batch, wait until the
+				# files have stopped changing for a whole interval (new memes
+				# reach the index through the journal in the meantime)
+				if signature != self._watched and signature == previous:
+					self.reload()
+				previous = signature
+				# near_duplicates.py can add hashes without the index changing
+				self.update(lambda index: index)
+			except Exception as e:
+				print(f"Index reload failed: {e!r}")
+
+	def update(self, change):
+		"""
+		Replace the index with change(index). change must return a new
+		Index rather than modify the one it's given, searches that
+		already picked up the old index keep using it. The near-duplicate
+		clusters are extended with whatever documents (and hashes) are new.
+		"""
+		with self._write_lock:
+			self._index = change(self._index)
+			if self._clusters is not None:
+				self._clusters = self._clusters.extended(self._index.documents)
+
+	def status(self) -> dict:
+		"""
+		Numbers for monitoring, served by /stats
+		"""
+		index = self._index
+		return {
+			'ready': self.is_ready(),
+			'generation': self.generation,
+			'index_generation': index.generation if index is not None else None,
+			'documents': len(index.documents) if index is not None else 0,
+			'load_duration': self.load_duration,
+			'loaded_at': self.loaded_at,
+			'last_error': repr(self.error) if self.error is not None else None,
+			'documents_added': self.updater.documents_added if self.updater is not None else 0,
+		}
+
+	def is_ready(self) -> bool:
+		return self._ready.is_set()
+
+	def wait(self, timeout=None) -> bool:
+		"""
+		Block until the index is loaded, returns False on timeout
+		"""
+		return self._ready.wait(timeout)
+
+	@property
+	def index(self):
+		if not self._ready.is_set():
+			raise IndexNotReady('search index is still loading')
+		return self._index
+
+	def _cached(self, index, key, compute):
+		"""
+		Results for key from the cache, computed and stored on a miss
+		"""
+		results = self.cache.get(key, index.generation)
+		if results is None:
+			metrics.increment('query_cache.misses')
+			results = compute()
+			self.cache.put(key, index.generation, results)
+		else:
+			metrics.increment('query_cache.hits')
+		return results
+
+	def search(self, query, search_type='AND', rank=True, scoring='tfidf', fuzzy=False):
+		index = self.index
+		if query == "":
+			return index.search(query)
+		key = ('search', search.parse_query(query), search_type, rank, scoring, fuzzy)
+		return self._cached(index, key, lambda: index.search(query, search_type=search_type, rank=rank, scoring=scoring,
+			fuzzy=fuzzy))
+
+	def search_top_k(self, query, k, search_type='OR', scoring='tfidf', urls_only=False, exact_total=False, after=None,
+			distinct=False, fuzzy=False):
+		"""
+		Index.search_top_k through the cache, urls_only skips memes without
+		a url, distinct returns one meme per near-duplicate cluster, fuzzy
+		lets misspelled/misread terms match (see fuzzy.py)
+		"""
+		index = self.index
+		doc_filter = index.url_mask() if urls_only else None
+		# built off the request path, see update(); the hashes can change
+		# without the index changing, so the version is part of the key
+		clusters = self._clusters if distinct else None
+		if clusters is not None:
+			mask = clusters.resized(len(doc_filter) if doc_filter is not None else len(index.all_document_lengths()))
+			doc_filter = mask if doc_filter is None else doc_filter & mask
+		version = clusters.version if clusters is not None else None
+		key = ('top_k', search.parse_query(query), search_type, k, scoring, urls_only, exact_total, after, version, fuzzy)
+		return self._cached(index, key, lambda: index.search_top_k(query, k, search_type=search_type, scoring=scoring,
+			doc_filter=doc_filter, exact_total=exact_total, after=after, fuzzy=fuzzy))
+
+# one per worker process
+service = IndexService()
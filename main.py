@@ -1,53 +1,79 @@
 # Import required packages
 import cv2
+import numpy as np
 import pytesseract
 import time
 from xml.etree import ElementTree as ET
 import os
 import gzip
 import multiprocessing
-import csv
+import argparse
+import metrics
+import ocr_cache
+import incremental
+import near_duplicates
+import search
+from manifest import Manifest
+from corpus_writer import CorpusWriter
 """
 	This script loops through jpgs, pngs in static/memeImages/
 	using pytesseract on each images. 
 	the text output from the pytesseract orc is saved in
-	a data.xml file and the filename is written to already
+	data.xml.gz (see corpus_writer.py) and the filename is written to already
 	downloaded.txt
+	Each image's perceptual hash and OCR terms go in image_hashes.csv, so
+	searches can show one meme per near-duplicate cluster, see
+	near_duplicates.py
+
+	python3 main.py --workers 4   # OCR with 4 processes
 """
-def timing(method):
-    """
-    Quick and dirty decorator to time functions: it will record the time when
-    it's calling a function, record the time when it returns and compute the
-    difference. There'll be some overhead, so it's not very precise, but'll
-    suffice to illustrate the examples in the accompanying blog post.
-    @timing
-    def snore():
-        print('zzzzz')
-        time.sleep(5)
-    snore()
-    zzzzz
-    snore took 5.0011749267578125 seconds
-    """
-    def timed(*args, **kwargs):
-        start = time.time()
-        result = method(*args, **kwargs)
-        end = time.time()
-
-        execution_time = end - start
-        if execution_time < 0.001:
-            print(f'{method.__name__} took {execution_time*1000} milliseconds')
-        else:
-            print(f'{method.__name__} took {execution_time} seconds')
-
-        return result
-    return timed
-
-@timing
-def get_text(path_to_img: str):
+
+# seconds before a single tesseract call is killed
+OCR_TIMEOUT = 30
+
+# contours: one tesseract call per text region
+# composite: all regions of an image pasted together, one tesseract call
+OCR_MODES = ('contours', 'composite')
+
+# white pixels around each region in composite mode, keeps
+# tesseract from reading neighbouring regions as one line
+COMPOSITE_GAP = 20
+
+def composite_regions(img, boxes, gap=COMPOSITE_GAP):
+	"""
+	Stack the text regions of img on one white canvas, in the order
+	of boxes (x, y, w, h), with gap pixels of padding between them
+	"""
+	width = max(w for x, y, w, h in boxes) + 2 * gap
+	height = sum(h for x, y, w, h in boxes) + gap * (len(boxes) + 1)
+	canvas = np.full((height, width) + img.shape[2:], 255, dtype=img.dtype)
+	top = gap
+	for x, y, w, h in boxes:
+		canvas[top:top + h, gap:gap + w] = img[y:y + h, x:x + w]
+		top += h + gap
+	return canvas
+
+@metrics.timed('ocr.get_text')
+def get_text(path_to_img: str, mode='contours', use_cache=True):
 	"""
 	Takes path to an image and returns text in that image Using pytesseract and opencv
+	mode='contours' runs tesseract once per text region,
+	mode='composite' stacks every region into one image and runs it once.
+	Results are cached by image content (see ocr_cache.py) unless use_cache=False
 	"""
-	img = cv2.imread(path_to_img)
+	if mode not in OCR_MODES:
+		raise ValueError(f"unknown OCR mode {mode!r}, expected one of {OCR_MODES}")
+
+	with open(path_to_img, 'rb') as f:
+		image_bytes = f.read()
+
+	if use_cache:
+		key = ocr_cache.cache_key(image_bytes, mode)
+		cached_text = ocr_cache.get_cache().get(key)
+		if cached_text is not None:
+			return cached_text
+
+	img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
 	# Convert the image to gray scale
 	gray = 0
 
@@ -79,85 +105,40 @@ def get_text(path_to_img: str):
 		# Finding contours
 		contours, hierarchy = cv2.findContours(dilation, cv2.RETR_EXTERNAL,
 	                                                 cv2.CHAIN_APPROX_NONE)
-		# Creating a copy of image
-		im2 = img.copy()
-		# Looping through the identified contours
-		# Then rectangular part is cropped and passed on
-		# to pytesseract for extracting text from it
-		# Extracted text is then written into the text file
+		boxes = [cv2.boundingRect(cnt) for cnt in contours]
 		_text = ""
-		for cnt in contours:
-			x, y, w, h = cv2.boundingRect(cnt)
-			# Drawing a rectangle on copied image
-			rect = cv2.rectangle(im2, (x, y), (x + w, y + h), (0, 255, 0), 2)
-			# Cropping the text block for giving input to OCR
-			cropped = im2[y:y + h, x:x + w]
-			# Apply OCR on the cropped image
-			text = pytesseract.image_to_string(cropped)
-
-			_text += text
-		"""
-		Get rid of illeal characters for xml file
-		"""
-		delete = [">", "<", "&" , "'", "\""]
-		for illegal_char in range(len(delete)):
-			_text = _text.replace(delete[illegal_char], "")
-
+		if mode == 'composite' and boxes:
+			# one tesseract process for the whole image instead of one per region
+			_text = pytesseract.image_to_string(composite_regions(img, boxes), timeout=OCR_TIMEOUT)
+		elif mode == 'contours':
+			# Looping through the identified contours
+			# Then rectangular part is cropped and passed on
+			# to pytesseract for extracting text from it
+			for x, y, w, h in boxes:
+				# Cropping the text block for giving input to OCR (a view, not a copy)
+				cropped = img[y:y + h, x:x + w]
+				# Apply OCR on the cropped image
+				text = pytesseract.image_to_string(cropped, timeout=OCR_TIMEOUT)
+
+				_text += text
+		# escaping for the xml file is left to CorpusWriter
+		if use_cache:
+			ocr_cache.get_cache().put(key, _text)
 		return _text
 	print("print false")
 	return False
 
-@timing
-def add_encoding_to_xml_file():
-	"""
-	Add enconding to xml file and opening Div tag
-	"""
-	file = open("data_uncleaned.xml", "a")
-	file.write("<?xml version = \"1.0\" encoding = \"UTF-8\" standalone = \"no\" ?>\n")
-	file.write("<div>\n")
-	file.close()
-
-@timing
-def add_closing_div_to_xml_file():
-	file = open("data_uncleaned.xml", "a")
-	file.write("</div>")
-	file.close()
-
-@timing
-def add_to_xml_file(text: list, filename: list, url: list):
-	"""
-	Append 	
-			<doc>
-				<abstract>text</abstract>
-				<filename>filename</filename>
-			</doc> 
-	to data.xml
-	"""
-	file = open("data_uncleaned.xml", "a")
-	
-	for i in range(len(text)):
-		file.write(f"<doc><abstract>{text[i]}</abstract><filename>{filename[i]}</filename><url>{url[i]}</url></doc>\n")
-
-	print(f"Successfully added {len(text)} image data to data.xml")
-	file.close()
-
-@timing
-def if_filename_in_already_downloaded_txt_file(filename: str):
+@metrics.timed('ingest.list_images')
+def get_all_imgs_from_memeImages(extension=".jpg", manifest=None) -> list:
 	"""
-	Returns True if filename in already_downloaded_txt_file
+	Images in static/memeImages that aren't in already_downloaded.txt yet
 	"""
-	with open('already_downloaded.txt') as f:
-		if filename in f.read():
-			return True
-		else:
-			return False
-
-@timing
-def get_all_imgs_from_memeImages(extension=".jpg") -> list:
+	if manifest is None:
+		manifest = Manifest()
 	files = []
 
 	for file in os.listdir("static/memeImages"):
-		if file.endswith(extension) and not if_filename_in_already_downloaded_txt_file(file):
+		if file.endswith(extension) and not manifest.is_downloaded(file):
 			files.append(file)
 			print(f"Added {file}")
 
@@ -165,98 +146,168 @@ def get_all_imgs_from_memeImages(extension=".jpg") -> list:
 
 	return files
 
-@timing
-def get_rid_of_0x0c():
-	delete = ["\f"]
-	with open("data_uncleaned.xml") as fin, open("data.xml", "w") as fout:
-		
-		for line in fin:
-			for word in delete:
-				line = line.replace(word, "")
-			fout.write(line)
-
-@timing
-def add_to_already_downloaded_txt_file(filenames: list):
-	file = open("already_downloaded.txt", "a")
-	for i in filenames:
-		file.write(f"{i}\n")
+def ocr_image(job):
+	"""
+	Pool worker: OCR one image, returns (filename, url, text, error, cached,
+	image hash) where error is None on success, cached is True if the text
+	came from the OCR cache and the hash (see near_duplicates.py) is None
+	unless dedupe
+	"""
+	filename, url, mode, use_cache, dedupe = job
+	hits = ocr_cache.get_cache().hits if use_cache else 0
+	try:
+		text = get_text(f"static/memeImages/{filename}", mode, use_cache)
+	except RuntimeError as e:
+		# pytesseract raises RuntimeError when tesseract hits OCR_TIMEOUT
+		return filename, url, None, f"timeout: {e}", False, None
+	except Exception as e:
+		return filename, url, None, repr(e), False, None
+	if text == False:
+		return filename, url, None, "could not read image", False, None
+	cached = use_cache and ocr_cache.get_cache().hits > hits
+	value = near_duplicates.image_hash(f"static/memeImages/{filename}") if dedupe else None
+	return filename, url, text, None, cached, value
+
+@metrics.timed('ingest.write_failures')
+def add_to_failed_txt_file(failures: list):
+	"""
+	Append filename<TAB>reason for images that couldn't be OCR'd
+	"""
+	file = open("failed_images.txt", "a")
+	for filename, reason in failures:
+		file.write(f"{filename}\t{reason}\n")
 	file.close()
 
-@timing
-def handle_download(array, urls, batch_size):
+@metrics.timed('ingest.handle_download')
+def handle_download(array, urls, batch_size, workers=1, ocr_mode='contours', use_cache=True, manifest=None,
+		journal_path=incremental.JOURNAL_PATH, writer=None, hashes=None):
 	"""
-	This function downloads text and filename to data.xml
-	in batches of size batch_size 
+	This function writes text, filename and url to data.xml.gz
+	in batches of size batch_size, see corpus_writer.py.
+	With workers > 1 images are OCR'd by a pool of processes and
+	written in the order they finish. Images that fail are still
+	marked as downloaded and listed in failed_images.txt with the reason.
+	Each batch is also appended to the journal at journal_path, which
+	the running web app tails to make new memes searchable straight away.
+	With hashes (a near_duplicates.HashIndex) each image OCR'd is
+	clustered with its near-duplicates too.
+	Returns (number of images OCR'd, number that failed, number served
+	from the OCR cache)
 	"""
-	current_batch = []	# len(current_batch) = batch_size
-	current_batch_urls = []
-	length = len(array)
-	break_points = length // batch_size
-
-	list_of_break_points = []
-	for i in range(0, break_points):
-		list_of_break_points.append(batch_size * i + batch_size)
-	list_of_break_points.append(length)
-
-	for i in range(length):
-		if i in list_of_break_points:
-			"""
-			Run Download Code here
-			"""
-			converted_text = []
-			for i in range(len(current_batch)):
-				text = get_text(f"static/memeImages/{current_batch[i]}")
-				if text == False:
-					continue
-				else:
-					converted_text.append(text)
-				print(f"getting text from {current_batch[i]}")
-			add_to_xml_file(converted_text, current_batch, current_batch_urls)
-			add_to_already_downloaded_txt_file(current_batch)
-
-			current_batch = []
-			current_batch_urls = []
-
-			current_batch_urls.append(urls[i])
-			current_batch.append(array[i])
-		else:
-			current_batch.append(array[i])
-			current_batch_urls.append(urls[i])
+	if manifest is None:
+		manifest = Manifest()
+	if writer is None:
+		writer = CorpusWriter()
+	jobs = [(filename, url, ocr_mode, use_cache, hashes is not None) for filename, url in zip(array, urls)]
+	documents, failures, processed, hashed = [], [], [], []
+	doc_id = writer.next_doc_id
+	done = 0
+	failed = 0
+	cache_hits = 0
+
+	def write_batch():
+		# docs are fsynced before the images are marked as downloaded,
+		# so a crash in between means OCRing them again, never losing them
+		with metrics.span('ingest.write_batch'):
+			writer.write(documents)
+		print(f"Successfully added {len(documents)} image data to {writer.path}")
+		# hashed before the web app sees the documents in the journal, so
+		# it can cluster them as they come in
+		if hashed:
+			hashes.add(hashed)
+		if journal_path and documents:
+			incremental.append_to_journal(documents, journal_path)
+		if failures:
+			add_to_failed_txt_file(failures)
+		manifest.mark_downloaded(processed)
+		for batch in (documents, failures, processed, hashed):
+			batch.clear()
+
+	pool = multiprocessing.Pool(workers) if workers > 1 else None
+	try:
+		results = pool.imap_unordered(ocr_image, jobs) if pool else map(ocr_image, jobs)
+		for filename, url, text, error, cached, value in results:
+			processed.append(filename)
+			cache_hits += cached
+			metrics.increment('ingest.images')
+			if error is None:
+				documents.append(search.Abstract(ID=doc_id, abstract=text, _filename=filename, _url=f"{url}"))
+				doc_id += 1
+				done += 1
+				if value is not None:
+					hashed.append((filename, value, text))
+				print(f"getting text from {filename}")
+			else:
+				failures.append((filename, error))
+				failed += 1
+				print(f"failed to get text from {filename}: {error}")
+			if len(processed) >= batch_size:
+				write_batch()
+		if processed:
+			write_batch()
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+	return done, failed, cache_hits
 
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-def search_csv(filename):
-	# given filename -- return url
-	csv_file = csv.reader(open('filename_url.csv', 'r'), delimiter=',')
-
-	for row in csv_file:
-		if filename == row[0]:
-			return row[1]
+@metrics.timed('ingest.main')
+def main(workers=1, batch_size=10, ocr_mode='contours', use_cache=True, dedupe=True):
 
-@timing
-def main():
+	# already_downloaded.txt and filename_url.csv are read once here
+	manifest = Manifest()
 
-	jpegs = get_all_imgs_from_memeImages('.jpg')
+	jpegs = get_all_imgs_from_memeImages('.jpg', manifest)
 
 	list_of_urls = []
 	
 	start_time = time.time()
 	
 	for i in range(len(jpegs)):
-		list_of_urls.append(search_csv(jpegs[i]))
+		list_of_urls.append(manifest.url_for(jpegs[i]))
 	print(len(list_of_urls))
+
+	hashes = near_duplicates.HashIndex() if dedupe else None
+	hashed, clusters = (len(hashes.entries), len(hashes.table)) if dedupe else (0, 0)
 	
-	handle_download(jpegs, list_of_urls, 10)
+	ocr_start_time = time.time()
+
+	done, failed, cache_hits = handle_download(jpegs, list_of_urls, batch_size, workers, ocr_mode, use_cache, manifest,
+		hashes=hashes)
+	# memes hashed into a cluster that was already there
+	duplicates = (len(hashes.entries) - hashed) - (len(hashes.table) - clusters) if dedupe else 0
 
-	get_rid_of_0x0c()
+	ocr_time = time.time() - ocr_start_time
 
 	end_time = time.time()
 
-	print(f"Ran in {round(end_time - start_time, 2)} seconds | Added {len(jpegs)} memes")
+	print(f"Ran in {round(end_time - start_time, 2)} seconds | Added {done} memes | {failed} failed | {duplicates} near-duplicates")
+	if ocr_time > 0:
+		print(f"OCR: {round((done + failed) / ocr_time, 2)} images/sec with {workers} worker(s)")
+	if use_cache and done + failed:
+		print(f"OCR cache: {cache_hits} hits, {round(100 * cache_hits / (done + failed), 1)}% hit rate")
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	parser = argparse.ArgumentParser(description='OCR new memes in static/memeImages into data.xml.gz')
+	parser.add_argument('--workers', type=int, default=1, help='number of OCR processes (default 1)')
+	parser.add_argument('--batch-size', type=int, default=10, help='images written to data.xml.gz at a time')
+	parser.add_argument('--ocr-mode', choices=OCR_MODES, default='contours', help='composite runs tesseract once per image')
+	parser.add_argument('--no-ocr-cache', action='store_true', help='always run tesseract, ignore ocr_cache.sqlite')
+	parser.add_argument('--no-dedupe', action='store_true', help='don\'t hash images for near_duplicates.py')
+	parser.add_argument('--metrics', action='store_true', help='print where the time went at the end')
+	args = parser.parse_args()
+
+	if args.metrics:
+		metrics.enable()
+	main(workers=max(1, args.workers), batch_size=args.batch_size, ocr_mode=args.ocr_mode, use_cache=not args.no_ocr_cache,
+		dedupe=not args.no_dedupe)
+	if args.metrics:
+		# with --workers > 1, get_text runs in the pool processes and isn't in here
+		print(metrics.summary())
\ No newline at end of file
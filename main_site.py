@@ -2,12 +2,33 @@
 	CODE FOR THE MAIN SITE
 	ANYTHING WITH A / endpoint
 """
-from flask import Blueprint, request, render_template, redirect
-import search
+from flask import Blueprint, request, render_template, redirect, abort, jsonify, Response
+import index_service
+import metrics
 import time
 
 bp = Blueprint('site', __name__, url_prefix='/')
 
+# seconds a search waits for the index to finish loading before giving up
+SEARCH_READY_TIMEOUT = 30
+
+RESULTS_PER_PAGE = 50
+
+# results per /api/search request, unless the client asks for a different limit
+API_DEFAULT_LIMIT = 20
+API_MAX_LIMIT = 100
+
+def encode_cursor(score, doc_id) -> str:
+	# repr() of a float round-trips exactly
+	return f"{score!r}:{doc_id}"
+
+def decode_cursor(cursor):
+	"""
+	(score, doc ID) from encode_cursor(), ValueError if it isn't one
+	"""
+	score, doc_id = cursor.split(':')
+	return float(score), int(doc_id)
+
 @bp.route('/', methods=['GET','POST'])
 def home_page():
 	if request.form.get('search_query'):
@@ -16,6 +37,89 @@ def home_page():
 
 	return render_template('home.html')
 
+@bp.route('/ready', methods=['GET'])
+def ready():
+	"""
+	Readiness probe: 200 once this worker's index is loaded
+	"""
+	if index_service.service.is_ready():
+		return 'ready', 200
+	return 'loading', 503
+
+@bp.route('/stats', methods=['GET'])
+def stats():
+	"""
+	Index generation, load duration and query cache counters
+	"""
+	return jsonify(
+		index = index_service.service.status(),
+		cache = index_service.service.cache.stats())
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+	"""
+	This worker's counters and timings in the Prometheus text format,
+	404 unless metrics are enabled (MEME_SEARCH_METRICS=1)
+	"""
+	if not metrics.is_enabled():
+		abort(404)
+	return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/search', methods=['GET'])
+def api_search():
+	"""
+	JSON search:
+		?q=...&limit=20&cursor=...&type=OR&scoring=tfidf&distinct=1&fuzzy=0
+	distinct=0 includes near-duplicates of memes already in the results
+	(see near_duplicates.py), fuzzy=1 also matches terms an edit or two
+	off the query's, for OCR misreads (see fuzzy.py). next_cursor is
+	passed back as cursor for the following page, it's null on the last
+	one. Pages are worked out against the index at the time of each
+	request, so they can shift if new memes come in between.
+	"""
+	start_time = time.perf_counter()
+	query = request.args.get('q', '')
+	search_type = request.args.get('type', 'OR').upper()
+	scoring = request.args.get('scoring', 'tfidf')
+	distinct = request.args.get('distinct', '1') not in ('0', 'false')
+	fuzzy = request.args.get('fuzzy', '0') not in ('0', 'false')
+	try:
+		limit = int(request.args.get('limit', API_DEFAULT_LIMIT))
+	except ValueError:
+		return jsonify(error='limit must be an integer'), 400
+	if not 1 <= limit <= API_MAX_LIMIT:
+		return jsonify(error=f"limit must be between 1 and {API_MAX_LIMIT}"), 400
+	after = None
+	if request.args.get('cursor'):
+		try:
+			after = decode_cursor(request.args['cursor'])
+		except ValueError:
+			return jsonify(error='invalid cursor'), 400
+
+	if not index_service.service.wait(timeout=SEARCH_READY_TIMEOUT):
+		return jsonify(error='index is still loading'), 503
+
+	try:
+		with metrics.span('api.search'):
+			results = index_service.service.search_top_k(query, limit, search_type=search_type, scoring=scoring,
+				urls_only=True, after=after, distinct=distinct, fuzzy=fuzzy)
+	except ValueError as e:
+		return jsonify(error=str(e)), 400
+
+	next_cursor = None
+	if len(results.hits) == limit:
+		document, score = results.hits[-1]
+		next_cursor = encode_cursor(score, document.ID)
+
+	return jsonify(
+		query = query,
+		hits = [{'id': document.ID, 'url': document.url, 'filename': document.filename, 'score': score}
+			for document, score in results.hits],
+		total_hits = int(results.total_hits),
+		total_is_estimate = results.total_is_estimate,
+		next_cursor = next_cursor,
+		took_ms = round((time.perf_counter() - start_time) * 1000, 3))
+
 @bp.route('/search_query=<search_query>', methods=['POST','GET'])
 def search_query(search_query):
 
@@ -25,30 +129,30 @@ def search_query(search_query):
 
 	start_time = time.time()
 
-	index = search.index_documents(search.load_documents(), search.Index())
+	# the index is built once per worker at startup, see index_service.py
+	if not index_service.service.wait(timeout=SEARCH_READY_TIMEOUT):
+		abort(503)
 
-	search_results = index.search(f"{search_query}", search_type='OR')
+	# only the first page is scored in full, memes without a url are skipped,
+	# and only one meme of each near-duplicate cluster is shown
+	with metrics.span('site.search'):
+		results = index_service.service.search_top_k(f"{search_query}", RESULTS_PER_PAGE, search_type='OR', urls_only=True,
+			distinct=True)
 
-	image_names = []
-	for i in range(len(search_results)):
-		if search_results[i][0].url == 'None':
-			continue
-		image_names.append(f"{search_results[i][0].url}")
-
-	number_of_results = len(image_names)
+	image_names = [f"{document.url}" for document, score in results.hits]
 
 	end_time = time.time()
 
 	run_time = str(end_time - start_time)
 
-	image_names = image_names[:50]
-
-	return render_template(
-		'home.html',
-		image_names = image_names,
-		run_time = run_time,
-		search_query = search_query,
-		results_length = number_of_results)
+	with metrics.span('site.render'):
+		return render_template(
+			'home.html',
+			image_names = image_names,
+			run_time = run_time,
+			search_query = search_query,
+			results_length = results.total_hits,
+			results_estimated = results.total_is_estimate)
 
 
 
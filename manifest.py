@@ -0,0 +1,56 @@
+"""
+	In-memory view of already_downloaded.txt and filename_url.csv.
+
+	Both files are read once into a set / dict, so checking whether a
+	meme was already OCR'd or finding its url is a hash lookup instead
+	of re-reading a file per image. Appends go to the file and the
+	in-memory copy together.
+"""
+import csv
+import os
+
+DOWNLOADED_PATH = 'already_downloaded.txt'
+URLS_PATH = 'filename_url.csv'
+
+class Manifest:
+	def __init__(self, downloaded_path=DOWNLOADED_PATH, urls_path=URLS_PATH):
+		self.downloaded_path = downloaded_path
+		self.urls_path = urls_path
+		self.downloaded = set()
+		self.urls = {}
+
+		if os.path.isfile(downloaded_path):
+			with open(downloaded_path) as f:
+				self.downloaded = {line.strip() for line in f if line.strip()}
+
+		if os.path.isfile(urls_path):
+			with open(urls_path, newline='', encoding='UTF8') as f:
+				for row in csv.reader(f):
+					if len(row) >= 2:
+						# the first row for a filename wins, like the old linear scan
+						self.urls.setdefault(row[0], row[1])
+
+	def is_downloaded(self, filename: str) -> bool:
+		return filename in self.downloaded
+
+	def url_for(self, filename: str):
+		"""
+		url the meme was downloaded from, None if it isn't in the csv
+		"""
+		return self.urls.get(filename)
+
+	def mark_downloaded(self, filenames: list):
+		with open(self.downloaded_path, 'a') as f:
+			for filename in filenames:
+				f.write(f"{filename}\n")
+			# after the batch's docs are on disk, see CorpusWriter.write
+			f.flush()
+			os.fsync(f.fileno())
+		self.downloaded.update(filenames)
+
+	def add_urls(self, filenames: list, urls: list):
+		with open(self.urls_path, 'a', newline='', encoding='UTF8') as f:
+			writer = csv.writer(f)
+			for filename, url in zip(filenames, urls):
+				writer.writerow([filename, url])
+				self.urls.setdefault(filename, url)
@@ -1,25 +1,21 @@
-import os
-import requests
-from bs4 import BeautifulSoup
 import time
 import PIL.Image
 import datetime
 import multiprocessing
-import csv
-
-def get_filename(url):
-	"""
-	if url == 'https://reddit.com/ambifj129.jpg'
-	--> return 'ambifj129.jpg'
-	"""
-	return url.rsplit('/', 1)[1]
+from crawler import Crawler, Page, normalize, parse_page
+from downloader import Downloader, get_filename
+from manifest import Manifest
 
 class GenerateMemes:
 	"""
 	Uses Meme_Api: https://github.com/D3vd/Meme_Api
-	to scrape subreddits for Memes & download them as images
+	to scrape subreddits for Memes & download them as images.
+	Requests go through a downloader.Downloader (pooled session,
+	thread pool, per-host limits and retries).
 	"""
-	def __init__(self):
+	api_url = "https://meme-api.herokuapp.com/gimme"
+
+	def __init__(self, downloader=None, api_url=None):
 		self.subreddits = [	"memes",
 							"dankmemes",
 							"me_irl",
@@ -40,20 +36,23 @@ class GenerateMemes:
 							"shitposting",
 							]
 		self.downloaded_memes = 0
-		
+		self.downloader = downloader or Downloader()
+		if api_url is not None:
+			self.api_url = api_url
+
 	def generate_memes(self, amount=4) -> list: # max for amount is 50
 		"""
 		RETURN LIST OF IMAGE URLS OF
 		RANDOM MEMES FROM SUBREDDITS
 		"""
+		print(f"Getting {amount} memes from each of {len(self.subreddits)} subreddits")
+		urls = [f"{self.api_url}/{subreddit}/{amount}" for subreddit in self.subreddits]
 		lists_of_url_imgs = []
-		for subreddit in range(len(self.subreddits)):
-			print(f"Getting {amount} memes from {self.subreddits[subreddit]}")
-			url = f"https://meme-api.herokuapp.com/gimme/{self.subreddits[subreddit]}/{amount}"
-			data = requests.get(url)
-			data_dict = data.json()
-			for memes in range(len(data_dict["memes"])):
-				lists_of_url_imgs.append(data_dict["memes"][memes]["url"])			
+		for data_dict in self.downloader.get_json_all(urls):
+			if data_dict is None:
+				continue
+			for meme in data_dict.get("memes", []):
+				lists_of_url_imgs.append(meme["url"])
 		return lists_of_url_imgs
 
 	def save_from_url(self, url, folder="static/memeImages") -> None:
@@ -64,108 +63,78 @@ class GenerateMemes:
 		returns a list of urls that were saved
 		list<urls>	
 		"""
-		start_time = time.time()
-
-		skipped_download = 0
-
-		if not os.path.isdir(f"{folder}"):
-			os.mkdir('memeImages')
-			print(f"Created folder {folder}/")
-		else:
-			print(f"/{folder} already exists")
-		''' 
-		Loops through list of url
-		images and downloads them
-		if they aren't already downloaded
-		'''
-		downloaded_urls = []
-
-		if type(url) == list:
-			for i in range(len(url)):
-				filename= get_filename(url[i])
-				img_data = requests.get(url[i]).content
-				if os.path.isfile(f'{folder}/{filename}'):
-					print(f'Skipping Download, {folder}/{filename} already exists')
-					skipped_download += 1
-				else:
-					with open(f'{folder}/{filename}', 'wb') as handler:
-						handler.write(img_data)
-						print(f"Dowloading {filename} to {folder}/")
-						self.downloaded_memes += 1
-						downloaded_urls.append(url[i])
-
-		else:
-			filename = get_filename(url)
-			img_data = requests.get(url).content
-			if os.path.isfile(f'{folder}/{filename}'):
-				print(f'Skipping Download, {folder}/{filename} already exists')
-			else:
-				with open(f'{folder}/{filename}', 'wb') as handler:
-					handler.write(img_data)
-					print(f"Dowloading {filename} to {folder}/")
-					self.downloaded_memes += 1
-					downloaded_urls.append(url)
-
-		end_time = time.time()
-
-		run_time = end_time - start_time
-
-		print(f"Downloaded {self.downloaded_memes} memes to {folder}/ in {run_time} seconds\n{run_time / self.downloaded_memes} seconds per meme download")
-
-		return downloaded_urls
+		urls = url if type(url) == list else [url]
+		report = self.downloader.download_all(urls, folder)
+		for failed_url, error in report.failed.items():
+			print(f"Failed to download {failed_url}: {error}")
+		self.downloaded_memes += len(report.downloaded)
+
+		print(f"Downloaded {len(report.downloaded)} memes to {folder}/ in {report.seconds:.2f} seconds, "
+			f"skipped {len(report.skipped)} already downloaded, {len(report.failed)} failed")
+		if report.downloaded:
+			print(f"{len(report.downloaded) / report.seconds:.1f} memes/sec, {report.bytes / 2**20 / report.seconds:.1f} MiB/sec")
+
+		return report.downloaded
 
 class MemeScraper:
 	"""
-	Scrapes the internet for memes
+	Scrapes the internet for memes, see crawler.py for the crawl engine
 	"""
-	def __init__(self, starting_url):
+	def __init__(self, starting_url, crawler=None):
 		self.starting_url = starting_url
-		self.visited_urls = []
+		self.crawler = crawler or Crawler()
+		self.visited_urls = set()
 		self.indexed_urls = []
+		# url -> crawler.Page, every page is fetched and parsed once
+		self.pages = {}
+
+	def get_page(self, url):
+		if url not in self.pages:
+			links, images = parse_page(self.crawler.fetch(url), url)
+			self.pages[url] = Page(url, 0, links, images)
+			self.visited_urls.add(url)
+		return self.pages[url]
 
 	def get_img_urls(self, url):
 		"""
 		Return a list of url images given url
 		"""
-		html_page = requests.get(url).text
-		soup = BeautifulSoup(html_page, 'html.parser')
-		image_urls = []
-
-		for img in soup.findAll('img'):
-			image_urls.append(img.get('src'))
-		return image_urls
+		return self.get_page(url).images
 
 	def get_all_links(self, url):
 		"""
 		Returns list of hrefs given a url
 		"""
-		links = []
-		html_page = requests.get(url).text
-		soup = BeautifulSoup(html_page, 'html.parser')
-		for link in soup.find_all('a'):
-			href = link.get('href')
-			if type(href) == str:
-				if href[0] == '/':
-					href = self.clean_up_url(url, href)
-				links.append(href)
-		return links
-
-	def crawl(self, starting_url: str) -> list:
+		return self.get_page(url).links
+
+	def crawl(self, starting_url: str = None) -> dict:
 		'''
-		Adds dictionary to list
-		self.indexed_urls in the form -> 
-		starting_url : ['urls1, url2, ...']
+		Crawls from starting_url (self.starting_url by default) within the
+		crawler's depth and page budgets, adds a dictionary per page to
+		self.indexed_urls in the form ->
+		page_url : ['urls1, url2, ...']
+		and returns {page_url: crawler.Page}
 		'''
-		_dict = {f"{starting_url}" : self.get_all_links(starting_url)}
-		self.indexed_urls.append(_dict)
+		pages = self.crawler.crawl(starting_url or self.starting_url)
+		for url, page in pages.items():
+			self.pages.setdefault(url, page)
+			self.visited_urls.add(url)
+			self.indexed_urls.append({url: page.links})
+		return pages
+
+	def img_urls(self) -> list:
+		"""
+		Every image url found on the crawled pages, each once
+		"""
+		return list(dict.fromkeys(image for page in self.pages.values() for image in page.images))
 
 	def clean_up_url(self, url: str, href: str):
 		"""
 		Renames hrefs to appropriate url
-		ie. href = '/view' & url = 'youtube.com'
-		-> 'youtube.com/view'
+		ie. href = '/view' & url = 'https://youtube.com/'
+		-> 'https://youtube.com/view'
 		"""
-		return f"{url}{href}"
+		return normalize(url, href)
 
 def view_size_img(path_to_file):
 	image = PIL.Image.open(path_to_file)
@@ -182,14 +151,8 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 def write_to_csv(filenames: list, urls: list):
-	import csv
-
-	with open('filename_url.csv','a',encoding='UTF8') as f:
-		writer = csv.writer(f)
-
-		for i in range(len(filenames)):
-			data = [filenames[i],urls[i]]
-			writer.writerow(data)
+	# filename_url.csv is only written through the manifest, see manifest.py
+	Manifest().add_urls(filenames, urls)
 
 if __name__ == "__main__":
 	start_time = time.time()
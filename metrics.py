@@ -0,0 +1,174 @@
+"""
+	Low-overhead instrumentation: spans, counters and histograms.
+
+	Off by default. Turn it on per process with MEME_SEARCH_METRICS=1 in
+	the environment or metrics.enable(). While it's off span() hands back
+	one shared do-nothing context manager and increment()/observe()
+	return straight away, so instrumented code pays a function call.
+
+		with metrics.span('search.rank'):
+			...
+		metrics.increment('search.queries')
+
+	Spans are timed with perf_counter_ns and recorded in a histogram of
+	the same name. Everything is kept per process (each gunicorn worker
+	has its own), main_site serves it at /metrics in the Prometheus text
+	format.
+"""
+from bisect import bisect_left
+import functools
+import os
+import threading
+import time
+
+# histogram bucket upper bounds in nanoseconds, 10µs to 10s
+BUCKETS_NS = tuple(int(base * 10 ** exponent) for exponent in range(4, 10) for base in (1, 2.5, 5)) + (10 ** 10,)
+
+PREFIX = 'meme_search_'
+
+_enabled = os.environ.get('MEME_SEARCH_METRICS', '') not in ('', '0')
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+class Histogram:
+	__slots__ = ('counts', 'count', 'total')
+
+	def __init__(self):
+		# one count per bucket, plus one for values above the last bound
+		self.counts = [0] * (len(BUCKETS_NS) + 1)
+		self.count = 0
+		self.total = 0
+
+	def observe(self, value_ns):
+		self.counts[bisect_left(BUCKETS_NS, value_ns)] += 1
+		self.count += 1
+		self.total += value_ns
+
+class _NullSpan:
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+class _Span:
+	__slots__ = ('name', 'start')
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, *exc):
+		observe(self.name, time.perf_counter_ns() - self.start)
+		return False
+
+_NULL_SPAN = _NullSpan()
+
+def enable():
+	global _enabled
+	_enabled = True
+
+def disable():
+	global _enabled
+	_enabled = False
+
+def is_enabled() -> bool:
+	return _enabled
+
+def reset():
+	with _lock:
+		_counters.clear()
+		_histograms.clear()
+
+def span(name):
+	"""
+	Context manager timing its block into the histogram name
+	"""
+	if not _enabled:
+		return _NULL_SPAN
+	return _Span(name)
+
+def timed(name):
+	"""
+	Decorator, a span around every call of the function
+	"""
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not _enabled:
+				return function(*args, **kwargs)
+			with _Span(name):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def increment(name, amount=1):
+	if not _enabled:
+		return
+	with _lock:
+		_counters[name] = _counters.get(name, 0) + amount
+
+def observe(name, value_ns):
+	if not _enabled:
+		return
+	with _lock:
+		histogram = _histograms.get(name)
+		if histogram is None:
+			histogram = _histograms[name] = Histogram()
+		histogram.observe(value_ns)
+
+def snapshot() -> dict:
+	"""
+	Copy of every counter and histogram, {'counters': {name: value},
+	'histograms': {name: {'count', 'total_ns', 'buckets'}}}
+	"""
+	with _lock:
+		return {
+			'counters': dict(_counters),
+			'histograms': {name: {'count': h.count, 'total_ns': h.total, 'buckets': list(h.counts)}
+				for name, h in _histograms.items()}}
+
+def _metric_name(name):
+	return PREFIX + name.replace('.', '_').replace('-', '_')
+
+def prometheus() -> str:
+	"""
+	Everything in the Prometheus text exposition format, times in seconds
+	"""
+	current = snapshot()
+	lines = []
+	for name, value in sorted(current['counters'].items()):
+		metric = _metric_name(name) + '_total'
+		lines.append(f"# TYPE {metric} counter")
+		lines.append(f"{metric} {value}")
+	for name, histogram in sorted(current['histograms'].items()):
+		metric = _metric_name(name) + '_seconds'
+		lines.append(f"# TYPE {metric} histogram")
+		cumulative = 0
+		for bound, count in zip(BUCKETS_NS, histogram['buckets']):
+			cumulative += count
+			lines.append(f'{metric}_bucket{{le="{bound / 1e9:g}"}} {cumulative}')
+		lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram["count"]}')
+		lines.append(f"{metric}_sum {histogram['total_ns'] / 1e9}")
+		lines.append(f"{metric}_count {histogram['count']}")
+	return '\n'.join(lines) + '\n'
+
+def summary() -> str:
+	"""
+	One line per histogram (count, mean, total) and counter, for CLI scripts
+	"""
+	current = snapshot()
+	lines = []
+	for name, histogram in sorted(current['histograms'].items()):
+		total = histogram['total_ns'] / 1e9
+		mean = total / histogram['count'] * 1000 if histogram['count'] else 0.0
+		lines.append(f"{name:32} {histogram['count']:8} calls {mean:10.3f} ms mean {total:10.3f} s total")
+	for name, value in sorted(current['counters'].items()):
+		lines.append(f"{name:32} {value:8}")
+	return '\n'.join(lines)
@@ -0,0 +1,426 @@
+"""
+	Near-duplicate memes, found by perceptual hash.
+
+	The same template gets reposted across subreddits at other sizes and
+	JPEG qualities, so the bytes (and the ocr_cache key) differ while the
+	picture doesn't. phash() boils an image down to 64 bits that barely
+	move under resizing and recompression. The picture alone isn't
+	enough though: a template with another caption is a different meme
+	and hashes within a few bits of the original. So two images are the
+	same meme when their hashes are within MAX_DISTANCE bits (Hamming
+	distance) and their OCR text shares at least CAPTION_SIMILARITY of
+	its terms.
+
+	main.py OCRs and indexes every image as before, and records each
+	one's hash and terms in image_hashes.csv as
+	filename,hash,representative,terms. The first image of a cluster is
+	its representative; searches with distinct=True (see
+	index_service.py) show one meme per cluster, distinct=False all of
+	them. Lookups go through a multi-index hash table of the
+	representatives' hashes (see MultiIndexHash), so finding a match
+	doesn't mean comparing against every hash.
+
+	For a corpus OCR'd before this existed, hash what's already there
+	with:
+		python3 near_duplicates.py
+"""
+import argparse
+import copy
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import cv2
+import numpy as np
+import corpus_records
+import docstore
+import search
+import snapshot
+
+HASHES_PATH = 'image_hashes.csv'
+IMAGES_FOLDER = 'static/memeImages'
+
+# bits out of 64 two hashes may differ by and still be the same meme
+MAX_DISTANCE = 8
+# share of their terms (Jaccard) two captions need to be the same meme,
+# below 1 so a word OCR'd differently on a repost doesn't split them
+CAPTION_SIMILARITY = 0.6
+
+_VERSIONS = itertools.count(1)
+
+def _bits_to_int(bits) -> int:
+	return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def dhash(gray) -> int:
+	"""
+	Difference hash of a grayscale image: is each pixel of a 9x8
+	thumbnail brighter than its left neighbour
+	"""
+	small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+	return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+def phash(gray) -> int:
+	"""
+	DCT hash of a grayscale image: is each of the 8x8 lowest frequencies
+	of a 32x32 thumbnail above their median (the DC term left out of
+	the median, it's just the overall brightness)
+	"""
+	small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+	low = cv2.dct(small)[:8, :8]
+	return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+def image_hash(path):
+	"""
+	phash() of the image at path, None if it can't be decoded
+	"""
+	gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+	if gray is None:
+		return None
+	return phash(gray)
+
+def hamming(a: int, b: int) -> int:
+	return bin(a ^ b).count('1')
+
+def caption_terms(text) -> frozenset:
+	return frozenset(search.analyze(text or ''))
+
+def caption_similarity(a: frozenset, b: frozenset) -> float:
+	"""
+	Jaccard similarity of two caption_terms(), 1 for two captions
+	without any terms
+	"""
+	if not a and not b:
+		return 1.0
+	return len(a & b) / len(a | b)
+
+class MultiIndexHash:
+	"""
+	Multi-index hashing: every hash is filed under each of its four
+	16-bit quarters. Two hashes within radius bits of each other differ
+	by at most radius // 4 bits in at least one quarter, so a search
+	only looks in the buckets of the quarters' near neighbours (137 per
+	quarter for radius 8) and checks the full distance of what's there,
+	instead of comparing against every hash.
+	"""
+	CHUNKS = 4
+	CHUNK_BITS = 16
+
+	def __init__(self, radius=MAX_DISTANCE):
+		self.radius = radius
+		self.values = []
+		self.items = []
+		# one {quarter: [positions in values]} per quarter
+		self.tables = [{} for _ in range(self.CHUNKS)]
+		self._flips = [flip for flip in range(1 << self.CHUNK_BITS) if bin(flip).count('1') <= radius // self.CHUNKS]
+
+	def __len__(self):
+		return len(self.values)
+
+	def _chunks(self, value):
+		mask = (1 << self.CHUNK_BITS) - 1
+		return [(value >> (self.CHUNK_BITS * c)) & mask for c in range(self.CHUNKS)]
+
+	def add(self, value: int, item):
+		position = len(self.values)
+		self.values.append(value)
+		self.items.append(item)
+		for table, chunk in zip(self.tables, self._chunks(value)):
+			table.setdefault(chunk, []).append(position)
+
+	def search(self, value: int) -> list:
+		"""
+		(distance, item) for everything within radius of value, closest first
+		"""
+		candidates = set()
+		for table, chunk in zip(self.tables, self._chunks(value)):
+			for flip in self._flips:
+				bucket = table.get(chunk ^ flip)
+				if bucket is not None:
+					candidates.update(bucket)
+		found = []
+		for position in candidates:
+			distance = hamming(value, self.values[position])
+			if distance <= self.radius:
+				found.append((distance, position))
+		found.sort()
+		return [(distance, self.items[position]) for distance, position in found]
+
+class HashIndex:
+	"""
+	image_hashes.csv in memory, with a MultiIndexHash of the cluster
+	representatives and their caption terms
+	"""
+	def __init__(self, path=HASHES_PATH, max_distance=MAX_DISTANCE, caption_similarity=CAPTION_SIMILARITY):
+		self.path = path
+		self.max_distance = max_distance
+		self.caption_similarity = caption_similarity
+		# filename -> (hash, representative filename)
+		self.entries = {}
+		# representative filename -> caption_terms()
+		self.captions = {}
+		self.table = MultiIndexHash(max_distance)
+
+		if os.path.isfile(path):
+			with open(path, newline='', encoding='UTF8') as f:
+				for row in csv.reader(f):
+					# rows without terms were clustered on the hash alone, hash those again
+					if len(row) >= 4 and row[0] not in self.entries:
+						self._remember(row[0], int(row[1], 16), row[2], frozenset(row[3].split()))
+
+	def _remember(self, filename, value, representative, terms):
+		self.entries[filename] = (value, representative)
+		if representative == filename:
+			self.captions[filename] = terms
+			self.table.add(value, filename)
+
+	def __contains__(self, filename):
+		return filename in self.entries
+
+	def representative(self, filename):
+		"""
+		Representative of filename's cluster, None for an image that wasn't hashed
+		"""
+		entry = self.entries.get(filename)
+		return entry[1] if entry is not None else None
+
+	def representatives(self) -> dict:
+		return {filename: entry[1] for filename, entry in self.entries.items()}
+
+	def find(self, value: int, terms=frozenset()):
+		"""
+		Representative closest to value within max_distance whose caption
+		is similar enough to terms (caption_terms()), or None
+		"""
+		for _, representative in self.table.search(value):
+			if caption_similarity(terms, self.captions[representative]) >= self.caption_similarity:
+				return representative
+		return None
+
+	def add(self, items) -> list:
+		"""
+		Cluster and record (filename, hash, OCR text) triples, in order, so
+		an earlier item can be the representative of a later one. Returns
+		the representative of each.
+		"""
+		representatives = []
+		rows = []
+		for filename, value, text in items:
+			if filename in self.entries:
+				representatives.append(self.entries[filename][1])
+				continue
+			terms = caption_terms(text)
+			representative = self.find(value, terms) or filename
+			self._remember(filename, value, representative, terms)
+			representatives.append(representative)
+			rows.append([filename, f"{value:016x}", representative, ' '.join(sorted(terms))])
+		if rows:
+			with open(self.path, 'a', newline='', encoding='UTF8') as f:
+				csv.writer(f).writerows(rows)
+				f.flush()
+				os.fsync(f.fileno())
+		return representatives
+
+def read_representatives(path=HASHES_PATH, offset=0) -> tuple:
+	"""
+	(filename -> representative, offset) for the rows of image_hashes.csv
+	from byte offset on, without building a MultiIndexHash. The offset
+	returned is where to read from next time; a row HashIndex is halfway
+	through writing is left for then.
+	"""
+	representatives = {}
+	if not os.path.isfile(path):
+		return representatives, offset
+	with open(path, 'rb') as f:
+		f.seek(offset)
+		data = f.read()
+	complete = data[:data.rfind(b'\n') + 1]
+	for row in csv.reader(io.StringIO(complete.decode('utf-8'), newline='')):
+		if len(row) >= 4:
+			representatives.setdefault(row[0], row[2])
+	return representatives, offset + len(complete)
+
+def hash_images(paths, workers=1) -> list:
+	"""
+	image_hash() of every path, with a process pool when workers > 1
+	"""
+	if workers > 1:
+		with multiprocessing.Pool(workers) as pool:
+			return pool.map(image_hash, paths, chunksize=64)
+	return [image_hash(path) for path in paths]
+
+def filename_array(documents, min_id=0) -> tuple:
+	"""
+	(doc IDs, filenames as a numpy bytes array) of the documents with a
+	doc ID of at least min_id, see DocumentStore.filename_array()
+	"""
+	if isinstance(documents, docstore.DocumentStore):
+		return documents.filename_array(min_id)
+	doc_ids = [doc_id for doc_id in documents if doc_id >= min_id]
+	names = [(documents[doc_id].filename or '').encode('utf-8') for doc_id in doc_ids]
+	return np.array(doc_ids, dtype=np.intp), np.array(names, dtype=bytes)
+
+def cluster_mask(doc_ids, names, filenames, representatives, size) -> tuple:
+	"""
+	Boolean array of size indexed by doc ID, like Index.url_mask(): True
+	for one document per cluster. That's the representative when it's in
+	the index, otherwise the cluster's lowest doc ID. Images that were
+	never hashed are always True. doc_ids/names are the documents (see
+	filename_array()), filenames/representatives image_hashes.csv as
+	bytes arrays sorted by filename. Returns (mask, shown) where shown is
+	(representatives, doc IDs, is the representative) arrays of the
+	document shown for each cluster, sorted by representative.
+	"""
+	mask = np.zeros(size, dtype=bool)
+	if not len(filenames):
+		mask[doc_ids] = True
+		return mask, (filenames, np.zeros(0, dtype=np.intp), np.zeros(0, dtype=bool))
+	found = np.minimum(np.searchsorted(filenames, names), len(filenames) - 1)
+	hashed = filenames[found] == names
+	mask[doc_ids[~hashed]] = True
+	doc_ids, names, groups = doc_ids[hashed], names[hashed], representatives[found[hashed]]
+	# per cluster the representative first, then the lowest doc ID
+	others = names != groups
+	order = np.lexsort((doc_ids, others, groups))
+	groups = groups[order]
+	first = np.ones(len(groups), dtype=bool)
+	first[1:] = groups[1:] != groups[:-1]
+	shown_ids = doc_ids[order][first]
+	mask[shown_ids] = True
+	return mask, (groups[first], shown_ids, ~others[order][first])
+
+class Clusters:
+	"""
+	cluster_mask() of an index and image_hashes.csv, kept up to date off
+	the request path: IndexService builds one when it loads a full index
+	and calls extended() when the journal adds documents or the hashes
+	file grows. Like the index it's copy-on-write, a search that picked
+	up a Clusters keeps a mask that doesn't change under it.
+	"""
+	def __init__(self, documents, path=HASHES_PATH):
+		self.path = path
+		self._inode = self._file_inode()
+		rows, self.offset = read_representatives(path)
+		# the hashes as bytes arrays sorted by filename, plus the rows read since
+		self.filenames, self.representatives = self._sorted(rows)
+		self.added = {}
+		doc_ids, names = filename_array(documents)
+		self.names = np.sort(names)
+		self.added_names = frozenset()
+		size = int(doc_ids.max(initial=-1)) + 1
+		self.mask, self.shown = cluster_mask(doc_ids, names, self.filenames, self.representatives, size)
+		# representative -> (doc ID, is the representative) shown since
+		self.added_shown = {}
+		self.version = next(_VERSIONS)
+
+	def _file_inode(self):
+		try:
+			return os.stat(self.path).st_ino
+		except FileNotFoundError:
+			return None
+
+	@staticmethod
+	def _sorted(rows):
+		filenames = sorted(rows)
+		return (np.array([filename.encode('utf-8') for filename in filenames], dtype=bytes),
+			np.array([rows[filename].encode('utf-8') for filename in filenames], dtype=bytes))
+
+	@staticmethod
+	def _contains(values, value):
+		position = int(np.searchsorted(values, value))
+		return position < len(values) and values[position] == value
+
+	def representative(self, name: bytes):
+		"""
+		Representative of the image called name, None if it wasn't hashed
+		"""
+		if name in self.added:
+			return self.added[name]
+		position = int(np.searchsorted(self.filenames, name))
+		if position < len(self.filenames) and self.filenames[position] == name:
+			return self.representatives[position]
+		return None
+
+	def shown_document(self, representative: bytes):
+		"""
+		(doc ID, is the representative) of the document shown for a
+		cluster, None when none of its documents is in the index
+		"""
+		if representative in self.added_shown:
+			return self.added_shown[representative]
+		representatives, doc_ids, is_representative = self.shown
+		position = int(np.searchsorted(representatives, representative))
+		if position < len(representatives) and representatives[position] == representative:
+			return int(doc_ids[position]), bool(is_representative[position])
+		return None
+
+	def extended(self, documents):
+		"""
+		Clusters for documents, which are the documents this was built for
+		plus new ones with higher doc IDs, and image_hashes.csv as it is
+		now. Only the new documents and rows are looked at, unless a new
+		row is about a document that was already here (the hashes being
+		backfilled) or the file was replaced: then it's built again. New
+		documents are shown by the same rule as cluster_mask(): one that
+		starts a cluster is, and a representative coming in after another
+		of its cluster takes its place.
+		Returns self when nothing changed.
+		"""
+		if self._file_inode() != self._inode:
+			return Clusters(documents, self.path)
+		rows, offset = read_representatives(self.path, self.offset)
+		rows = {filename.encode('utf-8'): representative.encode('utf-8') for filename, representative in rows.items()}
+		if any(name in self.added_names or self._contains(self.names, name) for name in rows):
+			return Clusters(documents, self.path)
+		doc_ids, names = filename_array(documents, len(self.mask))
+		if not rows and not len(doc_ids):
+			return self
+
+		updated = copy.copy(self)
+		updated.offset = offset
+		updated.added = {**rows, **self.added}
+		updated.added_names = self.added_names | set(names.tolist())
+		updated.mask = np.zeros(max(len(self.mask), int(doc_ids.max(initial=-1)) + 1), dtype=bool)
+		updated.mask[:len(self.mask)] = self.mask
+		updated.added_shown = dict(self.added_shown)
+		for doc_id, name in zip(doc_ids.tolist(), names.tolist()):
+			representative = updated.representative(name)
+			if representative is None:
+				updated.mask[doc_id] = True
+				continue
+			current = updated.shown_document(representative)
+			if current is None or (name == representative and not current[1]):
+				if current is not None:
+					updated.mask[current[0]] = False
+				updated.mask[doc_id] = True
+				updated.added_shown[representative] = (doc_id, name == representative)
+		updated.version = next(_VERSIONS)
+		return updated
+
+	def resized(self, size) -> np.ndarray:
+		"""
+		The mask cut or padded to size, for an index a document or so
+		ahead of or behind this; documents it doesn't know are shown
+		"""
+		if len(self.mask) == size:
+			return self.mask
+		mask = np.ones(size, dtype=bool)
+		mask[:min(size, len(self.mask))] = self.mask[:size]
+		return mask
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Hash and cluster the OCR\'d images in static/memeImages into image_hashes.csv')
+	parser.add_argument('--folder', default=IMAGES_FOLDER)
+	parser.add_argument('--corpus', default=snapshot.CORPUS_PATH, help='corpus the OCR text is read from')
+	parser.add_argument('--workers', type=int, default=1, help='hashing processes (default 1)')
+	args = parser.parse_args()
+
+	hashes = HashIndex()
+	# images that were never OCR'd get hashed when main.py gets to them
+	texts = {document.filename: document.abstract for document in corpus_records.load_corpus(args.corpus)}
+	filenames = sorted(name for name in texts if name and name not in hashes and os.path.isfile(os.path.join(args.folder, name)))
+	values = hash_images([os.path.join(args.folder, name) for name in filenames], max(1, args.workers))
+	clustered = hashes.add((name, value, texts[name]) for name, value in zip(filenames, values) if value is not None)
+	duplicates = sum(name != representative for name, representative in hashes.representatives().items())
+	print(f"Hashed {len(clustered)} images, {len(hashes.entries)} in {hashes.path}, "
+		f"{len(hashes.table)} clusters, {duplicates} near-duplicates")
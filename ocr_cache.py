@@ -0,0 +1,64 @@
+"""
+	Persistent cache of OCR results keyed by image content.
+
+	The key is the sha256 of the image bytes plus the OCR settings
+	(OCR_SETTINGS_VERSION and the get_text mode), so a meme reposted
+	under another filename, or a re-run after already_downloaded.txt
+	was lost, costs one hash instead of running tesseract again.
+	Bump OCR_SETTINGS_VERSION whenever get_text's preprocessing changes.
+
+	Stored in a sqlite file, each process opens its own connection.
+"""
+import hashlib
+import os
+import sqlite3
+
+CACHE_PATH = 'ocr_cache.sqlite'
+OCR_SETTINGS_VERSION = 2
+
+def cache_key(image_bytes: bytes, mode: str) -> str:
+	digest = hashlib.sha256(image_bytes)
+	digest.update(f"|v{OCR_SETTINGS_VERSION}|{mode}".encode())
+	return digest.hexdigest()
+
+class OCRCache:
+	def __init__(self, path=CACHE_PATH):
+		self.path = path
+		self._db = sqlite3.connect(path, timeout=30)
+		self._db.execute('PRAGMA journal_mode=WAL')
+		self._db.execute('CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL)')
+		self._db.commit()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		"""
+		Cached text for key, None on a miss
+		"""
+		row = self._db.execute('SELECT text FROM ocr WHERE key = ?', (key,)).fetchone()
+		if row is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		return row[0]
+
+	def put(self, key, text):
+		self._db.execute('INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)', (key, text))
+		self._db.commit()
+
+	def close(self):
+		self._db.close()
+
+_cache = None
+_cache_pid = None
+
+def get_cache() -> OCRCache:
+	"""
+	This process's cache, reopened after a fork since sqlite
+	connections can't be shared between processes
+	"""
+	global _cache, _cache_pid
+	if _cache is None or _cache_pid != os.getpid():
+		_cache = OCRCache()
+		_cache_pid = os.getpid()
+	return _cache
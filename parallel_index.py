@@ -0,0 +1,131 @@
+"""
+	Index build spread over a process pool.
+
+	The corpus is cut into shards of consecutive documents. Each worker
+	analyzes its shard (once per document) and sends back the shard's
+	postings packed into three flat arrays: the shard's terms, how many
+	postings each term has, and the doc IDs / term frequencies of all of
+	them one term after another. The parent maps every shard's terms to
+	one global term ID, and a single stable argsort over the term IDs
+	puts all the postings of a term next to each other, still in doc ID
+	order because shards come back in order. Each token's PostingsList
+	is then a view into those arrays, the same layout a snapshot loads.
+
+	Gives the same Index as search.index_documents, used by
+	python3 snapshot.py --workers N
+"""
+import multiprocessing
+from array import array
+from collections import Counter
+import numpy as np
+import postings
+import search
+
+# documents sent to a worker at a time
+SHARD_SIZE = 2000
+
+def _shards(documents, index, shard_size):
+	"""
+	(doc ID, text) lists of shard_size documents, adding each document
+	to index.documents on the way. Documents already in there are
+	skipped like in Index.index_document.
+	"""
+	shard = []
+	for document in documents:
+		if document.ID in index.documents:
+			continue
+		index.documents[document.ID] = document
+		shard.append((document.ID, document.fulltext))
+		if len(shard) >= shard_size:
+			yield shard
+			shard = []
+	if shard:
+		yield shard
+
+def index_shard(shard):
+	"""
+	Pool worker: postings of one shard, returns (terms, postings count
+	of each term, doc IDs, term frequencies, doc IDs of the shard, their lengths)
+	"""
+	index = {}
+	doc_ids = array('I')
+	lengths = array('I')
+	for doc_id, text in shard:
+		tokens = search.analyze(text)
+		doc_ids.append(doc_id)
+		lengths.append(len(tokens))
+		for token, tf in Counter(tokens).items():
+			if token not in index:
+				index[token] = postings.PostingsList()
+			index[token].add(doc_id, tf)
+
+	terms = list(index)
+	counts = array('I', (len(index[term]) for term in terms))
+	ids = array('I')
+	tfs = array('I')
+	for term in terms:
+		ids.extend(index[term].doc_ids)
+		tfs.extend(index[term].tfs)
+	return terms, counts, ids, tfs, doc_ids, lengths
+
+def _merge(shards, index):
+	"""
+	Fill index.index and index.doc_lengths from the index_shard() results
+	"""
+	term_ids = {}
+	posting_terms, all_ids, all_tfs = [], [], []
+	doc_ids, lengths = [], []
+	for terms, counts, ids, tfs, shard_doc_ids, shard_lengths in shards:
+		shard_term_ids = np.fromiter((term_ids.setdefault(term, len(term_ids)) for term in terms),
+			dtype=np.intp, count=len(terms))
+		posting_terms.append(np.repeat(shard_term_ids, np.frombuffer(counts, dtype=postings.DOC_ID_DTYPE)))
+		all_ids.append(np.frombuffer(ids, dtype=postings.DOC_ID_DTYPE))
+		all_tfs.append(np.frombuffer(tfs, dtype=postings.DOC_ID_DTYPE))
+		doc_ids.append(np.frombuffer(shard_doc_ids, dtype=postings.DOC_ID_DTYPE))
+		lengths.append(np.frombuffer(shard_lengths, dtype=postings.DOC_ID_DTYPE))
+	if not term_ids and not doc_ids:
+		return
+
+	posting_terms = np.concatenate(posting_terms) if posting_terms else np.zeros(0, dtype=np.intp)
+	all_ids = np.concatenate(all_ids)
+	all_tfs = np.concatenate(all_tfs)
+	# term first, then doc ID: the stable sort keeps shard order, which
+	# is doc ID order unless the corpus wasn't sorted by doc ID
+	if all(a[-1] < b[0] for a, b in zip(doc_ids, doc_ids[1:]) if len(a) and len(b)):
+		order = np.argsort(posting_terms, kind='stable')
+	else:
+		order = np.lexsort((all_ids, posting_terms))
+	all_ids = all_ids[order]
+	all_tfs = all_tfs[order]
+	offsets = np.zeros(len(term_ids) + 1, dtype=np.intp)
+	np.cumsum(np.bincount(posting_terms, minlength=len(term_ids)), out=offsets[1:])
+	for term, t in term_ids.items():
+		start, end = offsets[t], offsets[t + 1]
+		index.index[term] = postings.PostingsList(all_ids[start:end], all_tfs[start:end])
+
+	doc_ids = np.concatenate(doc_ids)
+	doc_lengths = np.zeros(int(doc_ids.max(initial=0)) + 1, dtype=postings.DOC_ID_DTYPE)
+	doc_lengths[doc_ids] = np.concatenate(lengths)
+	index.doc_lengths = doc_lengths
+
+def index_documents(documents, index=None, workers=None, shard_size=SHARD_SIZE):
+	"""
+	Index documents into a new (empty) Index with workers processes,
+	os.cpu_count() by default. workers=1 builds in this process.
+	"""
+	if index is None:
+		index = search.Index()
+	if index.documents:
+		raise ValueError("parallel_index.index_documents needs an empty Index")
+	if index.positions is not None:
+		raise ValueError("parallel_index doesn't build positions, use search.index_documents")
+	workers = workers or multiprocessing.cpu_count()
+
+	shards = _shards(documents, index, shard_size)
+	if workers == 1:
+		_merge(map(index_shard, shards), index)
+	else:
+		with multiprocessing.Pool(workers) as pool:
+			_merge(pool.imap(index_shard, shards), index)
+	index.update_statistics()
+	return index
@@ -0,0 +1,249 @@
+"""
+	Token positions, for phrase and proximity queries.
+
+	Only built when the Index is created with positions=True. For each
+	token a PositionsList runs parallel to its PostingsList: posting i's
+	positions are data[offsets[i]:offsets[i + 1]], the gaps between
+	consecutive positions varint encoded (one byte for gaps under 128,
+	which is nearly all of them in OCR captions). Positions count raw
+	tokens, stopwords and all, so a phrase like "this is fine" still
+	needs "is" and "fine" to be next to each other.
+
+	The positional merges below only decode the positions of documents
+	that already contain every term, after the doc ID merge in postings.py.
+"""
+from array import array
+from bisect import bisect_right
+import numpy as np
+
+# how much a document whose query terms are right next to each other
+# gains over one where they are far apart, see proximity()
+PROXIMITY_WEIGHT = 0.5
+
+def encode(positions) -> bytes:
+	"""
+	Ascending positions as varint encoded gaps
+	"""
+	out = bytearray()
+	previous = 0
+	for position in positions:
+		gap = position - previous
+		previous = position
+		while gap >= 0x80:
+			out.append(gap & 0x7f | 0x80)
+			gap >>= 7
+		out.append(gap)
+	return bytes(out)
+
+def decode(data) -> list:
+	positions = []
+	position = 0
+	gap = 0
+	shift = 0
+	for byte in data:
+		gap |= (byte & 0x7f) << shift
+		if byte & 0x80:
+			shift += 7
+			continue
+		position += gap
+		positions.append(position)
+		gap = 0
+		shift = 0
+	return positions
+
+class PositionsList:
+	__slots__ = ('offsets', 'data')
+
+	def __init__(self, offsets=None, data=None):
+		self.offsets = array('Q', [0]) if offsets is None else offsets
+		self.data = bytearray() if data is None else data
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def _copy(self):
+		# read-only snapshot views share one blob, copy out this token's part
+		start, end = int(self.offsets[0]), int(self.offsets[-1])
+		self.data = bytearray(self.data[start:end])
+		self.offsets = array('Q', (int(offset) - start for offset in self.offsets))
+
+	def add(self, i: int, positions):
+		"""
+		Positions for the posting that was put at index i of the PostingsList
+		"""
+		if not isinstance(self.data, bytearray):
+			self._copy()
+		encoded = encode(positions)
+		if i == len(self):
+			self.data += encoded
+			self.offsets.append(len(self.data))
+			return
+		start = self.offsets[i]
+		self.data[start:start] = encoded
+		self.offsets.insert(i, start)
+		for j in range(i + 1, len(self.offsets)):
+			self.offsets[j] += len(encoded)
+
+	def chunk(self, i: int) -> bytes:
+		data = self.data[int(self.offsets[i]):int(self.offsets[i + 1])]
+		return data.tobytes() if isinstance(data, np.ndarray) else bytes(data)
+
+	def positions(self, i: int) -> list:
+		return decode(self.chunk(i))
+
+	@property
+	def nbytes(self) -> int:
+		return len(self.offsets) * self.offsets.itemsize + int(self.offsets[-1]) - int(self.offsets[0])
+
+	def merged(self):
+		return self
+
+class SegmentedPositions:
+	"""
+	Positions for a postings.SegmentedPostings, one part per segment
+	"""
+	__slots__ = ('parts', '_starts')
+
+	def __init__(self, parts):
+		self.parts = tuple(parts)
+		self._starts = []
+		start = 0
+		for part in self.parts:
+			self._starts.append(start)
+			start += len(part)
+
+	def __len__(self):
+		return sum(len(part) for part in self.parts)
+
+	def _locate(self, i):
+		p = bisect_right(self._starts, i) - 1
+		return self.parts[p], i - self._starts[p]
+
+	def chunk(self, i: int) -> bytes:
+		part, j = self._locate(i)
+		return part.chunk(j)
+
+	def positions(self, i: int) -> list:
+		part, j = self._locate(i)
+		return part.positions(j)
+
+	@property
+	def nbytes(self) -> int:
+		return sum(part.nbytes for part in self.parts)
+
+	def merged(self) -> PositionsList:
+		return from_chunks(self.chunk(i) for i in range(len(self)))
+
+def from_chunks(chunks) -> PositionsList:
+	"""
+	PositionsList out of already encoded positions, one chunk per posting
+	"""
+	merged = PositionsList()
+	for chunk in chunks:
+		merged.data += chunk
+		merged.offsets.append(len(merged.data))
+	return merged
+
+def extend(existing, delta, existing_ids, delta_ids):
+	"""
+	Positions to go with postings.extend(existing postings, delta postings),
+	existing_ids and delta_ids are the doc IDs of those postings
+	"""
+	if existing is None or not len(existing):
+		return delta
+	if not len(delta):
+		return existing
+	if delta_ids[0] > existing_ids[-1]:
+		parts = existing.parts if isinstance(existing, SegmentedPositions) else (existing,)
+		return SegmentedPositions(parts + (delta,))
+
+	# same order postings.extend sorts the doc IDs into
+	order = np.argsort(np.concatenate([existing_ids, delta_ids]), kind='stable')
+	chunks = [existing.chunk(i) for i in range(len(existing))] + [delta.chunk(i) for i in range(len(delta))]
+	return from_chunks(chunks[i] for i in order.tolist())
+
+def _lookup(index, term, doc_ids):
+	"""
+	For every doc in doc_ids, the index of its posting in term's postings
+	list, or -1 where term isn't in the doc
+	"""
+	ids = index.index[term].ids()
+	locations = np.searchsorted(ids, doc_ids)
+	found = locations < len(ids)
+	found[found] = ids[locations[found]] == doc_ids[found]
+	return np.where(found, locations, -1)
+
+def phrase_mask(index, phrase, doc_ids) -> np.ndarray:
+	"""
+	Which of doc_ids contain the phrase, a sequence of (offset, term) with
+	offsets relative to the first term. doc_ids must already contain every term.
+	"""
+	locations = [(offset, index.positions[term], _lookup(index, term, doc_ids)) for offset, term in phrase]
+	mask = np.zeros(len(doc_ids), dtype=bool)
+	for j in range(len(doc_ids)):
+		starts = None
+		for offset, term_positions, found in locations:
+			shifted = {position - offset for position in term_positions.positions(int(found[j]))}
+			starts = shifted if starts is None else starts & shifted
+			if not starts:
+				break
+		mask[j] = bool(starts)
+	return mask
+
+def _min_distance(a, b) -> int:
+	"""
+	Smallest |x - y| for x in a, y in b, both sorted
+	"""
+	i = j = 0
+	best = None
+	while i < len(a) and j < len(b):
+		distance = abs(a[i] - b[j])
+		if best is None or distance < best:
+			best = distance
+		if a[i] < b[j]:
+			i += 1
+		else:
+			j += 1
+	return best
+
+def near_mask(index, first, second, distance, doc_ids) -> np.ndarray:
+	"""
+	Which of doc_ids have first and second at most distance tokens apart
+	"""
+	first_found = _lookup(index, first, doc_ids)
+	second_found = _lookup(index, second, doc_ids)
+	mask = np.zeros(len(doc_ids), dtype=bool)
+	for j in range(len(doc_ids)):
+		if first_found[j] < 0 or second_found[j] < 0:
+			continue
+		a = index.positions[first].positions(int(first_found[j]))
+		b = index.positions[second].positions(int(second_found[j]))
+		closest = _min_distance(a, b)
+		mask[j] = closest is not None and closest <= distance
+	return mask
+
+def proximity(index, terms, doc_ids) -> np.ndarray:
+	"""
+	Boost factor for each of doc_ids, 1 + PROXIMITY_WEIGHT * the mean of
+	1 / distance over consecutive pairs of distinct query terms, a pair
+	counting 0 unless both terms are in the doc
+	"""
+	terms = [term for term in dict.fromkeys(terms) if term in index.index]
+	boost = np.ones(len(doc_ids))
+	if len(terms) < 2 or not len(doc_ids):
+		return boost
+	found = {term: _lookup(index, term, doc_ids) for term in terms}
+	pairs = list(zip(terms, terms[1:]))
+	present = sum((found[term] >= 0).astype(np.intp) for term in terms)
+	for j in np.flatnonzero(present >= 2).tolist():
+		decoded = {}
+		closeness = 0.0
+		for first, second in pairs:
+			if found[first][j] < 0 or found[second][j] < 0:
+				continue
+			for term in (first, second):
+				if term not in decoded:
+					decoded[term] = index.positions[term].positions(int(found[term][j]))
+			closeness += 1.0 / max(_min_distance(decoded[first], decoded[second]), 1)
+		boost[j] += PROXIMITY_WEIGHT * closeness / len(pairs)
+	return boost
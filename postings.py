@@ -0,0 +1,160 @@
+"""
+	Compact postings lists.
+
+	Each token maps to a PostingsList: doc IDs in ascending order with
+	the term frequency of the token in each doc in a parallel array.
+	While indexing both are array('I') (4 bytes a posting, appends are
+	amortized O(1) since doc IDs arrive in order), lists loaded from a
+	snapshot are numpy views straight into the mmap.
+"""
+from array import array
+from bisect import bisect_left
+import numpy as np
+
+# array('I') is a C unsigned int, which numpy calls uintc
+DOC_ID_DTYPE = np.uintc
+EMPTY = np.zeros(0, dtype=DOC_ID_DTYPE)
+
+class PostingsList:
+	__slots__ = ('doc_ids', 'tfs')
+
+	def __init__(self, doc_ids=None, tfs=None):
+		self.doc_ids = array('I') if doc_ids is None else doc_ids
+		self.tfs = array('I') if tfs is None else tfs
+
+	def __len__(self):
+		return len(self.doc_ids)
+
+	def add(self, doc_id: int, tf: int):
+		if not isinstance(self.doc_ids, array):
+			# read-only snapshot view, copy before the first write
+			self.doc_ids = array('I', self.doc_ids)
+			self.tfs = array('I', self.tfs)
+
+		if not self.doc_ids or doc_id > self.doc_ids[-1]:
+			self.doc_ids.append(doc_id)
+			self.tfs.append(tf)
+			return
+
+		i = bisect_left(self.doc_ids, doc_id)
+		if self.doc_ids[i] == doc_id:
+			self.tfs[i] += tf
+		else:
+			self.doc_ids.insert(i, doc_id)
+			self.tfs.insert(i, tf)
+
+	def ids(self) -> np.ndarray:
+		return np.frombuffer(self.doc_ids, dtype=DOC_ID_DTYPE) if isinstance(self.doc_ids, array) else self.doc_ids
+
+	def frequencies(self) -> np.ndarray:
+		return np.frombuffer(self.tfs, dtype=DOC_ID_DTYPE) if isinstance(self.tfs, array) else self.tfs
+
+	def frequency(self, doc_id: int) -> int:
+		"""
+		Term frequency of this token in doc_id, 0 if it isn't in the doc
+		"""
+		i = bisect_left(self.doc_ids, doc_id)
+		if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+			return int(self.tfs[i])
+		return 0
+
+	@property
+	def nbytes(self) -> int:
+		return len(self.doc_ids) * self.doc_ids.itemsize + len(self.tfs) * self.tfs.itemsize
+
+def intersect(lists) -> np.ndarray:
+	"""
+	Doc IDs present in every sorted array. Starts from the shortest list
+	and probes each longer one with a binary search per candidate, so the
+	cost is bounded by the rarest token rather than the most common one.
+	"""
+	if not lists:
+		return EMPTY
+	lists = sorted(lists, key=len)
+	result = lists[0]
+	for other in lists[1:]:
+		if not len(result):
+			break
+		positions = np.searchsorted(other, result)
+		found = positions < len(other)
+		found[found] = other[positions[found]] == result[found]
+		result = result[found]
+	return result
+
+def union(lists) -> np.ndarray:
+	"""
+	Doc IDs present in any sorted array. A stable sort over the
+	concatenated runs is a k-way merge (timsort finds the runs), then
+	neighbouring duplicates are dropped.
+	"""
+	lists = [ids for ids in lists if len(ids)]
+	if not lists:
+		return EMPTY
+	if len(lists) == 1:
+		return lists[0]
+	merged = np.concatenate(lists)
+	merged.sort(kind='stable')
+	keep = np.empty(len(merged), dtype=bool)
+	keep[0] = True
+	np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+	return merged[keep]
+
+class SegmentedPostings:
+	"""
+	Postings for a token split over several segments (the base index
+	plus delta segments added since), each part holding higher doc IDs
+	than the one before. Reads see one concatenated list, built on first
+	use; merge_segments() in incremental.py collapses them for good.
+	"""
+	__slots__ = ('parts', '_ids', '_tfs')
+
+	def __init__(self, parts):
+		self.parts = tuple(parts)
+		self._ids = None
+		self._tfs = None
+
+	def __len__(self):
+		return sum(len(part) for part in self.parts)
+
+	def ids(self) -> np.ndarray:
+		if self._ids is None:
+			self._ids = np.concatenate([part.ids() for part in self.parts])
+		return self._ids
+
+	def frequencies(self) -> np.ndarray:
+		if self._tfs is None:
+			self._tfs = np.concatenate([part.frequencies() for part in self.parts])
+		return self._tfs
+
+	def frequency(self, doc_id: int) -> int:
+		ids = self.ids()
+		i = np.searchsorted(ids, doc_id)
+		if i < len(ids) and ids[i] == doc_id:
+			return int(self.frequencies()[i])
+		return 0
+
+	@property
+	def nbytes(self) -> int:
+		return sum(part.nbytes for part in self.parts)
+
+	def merged(self) -> PostingsList:
+		return PostingsList(self.ids(), self.frequencies())
+
+def extend(existing, delta: PostingsList):
+	"""
+	Postings for existing followed by delta, without copying existing
+	when every doc ID in delta comes after it
+	"""
+	if existing is None or not len(existing):
+		return delta
+	if not len(delta):
+		return existing
+	parts = existing.parts if isinstance(existing, SegmentedPostings) else (existing,)
+	if delta.ids()[0] > parts[-1].ids()[-1]:
+		return SegmentedPostings(parts + (delta,))
+
+	# delta overlaps existing doc IDs, fall back to a full merge
+	ids = np.concatenate([existing.ids(), delta.ids()])
+	tfs = np.concatenate([existing.frequencies(), delta.frequencies()])
+	order = np.argsort(ids, kind='stable')
+	return PostingsList(ids[order], tfs[order])
@@ -0,0 +1,92 @@
+"""
+	Bounded LRU cache of search results.
+
+	Meme searches repeat a lot, so results are kept keyed on the analyzed
+	query (stemmed, stopwords dropped) plus the search options, which
+	means "Hello girls" and "hello girl!" share an entry. Every entry is
+	tagged with the index generation it was computed on, and the whole
+	cache is dropped as soon as a lookup comes in for a newer generation.
+	Generations only go up: a slow request still on an older one misses
+	and doesn't store its results, the cache stays on the newer one.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+class QueryCache:
+	def __init__(self, max_entries=1024, ttl=None):
+		"""
+		ttl is in seconds, None keeps entries until they are evicted
+		"""
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._generation = None
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self.invalidations = 0
+
+	def _check_generation(self, generation) -> bool:
+		"""
+		Move the cache on to generation if it's newer, returns False for
+		an older one
+		"""
+		if self._generation is not None and generation < self._generation:
+			return False
+		if generation != self._generation:
+			if self._entries:
+				self.invalidations += 1
+			self._entries.clear()
+			self._generation = generation
+		return True
+
+	def get(self, key, generation):
+		"""
+		Cached value for key or None
+		"""
+		with self._lock:
+			if not self._check_generation(generation):
+				self.misses += 1
+				return None
+			entry = self._entries.get(key)
+			if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+				del self._entries[key]
+				self.expirations += 1
+				entry = None
+			if entry is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+
+	def put(self, key, generation, value):
+		with self._lock:
+			if not self._check_generation(generation):
+				return
+			self._entries[key] = (time.monotonic(), value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'entries': len(self._entries),
+				'max_entries': self.max_entries,
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+				'evictions': self.evictions,
+				'expirations': self.expirations,
+				'invalidations': self.invalidations,
+			}
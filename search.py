@@ -7,6 +7,18 @@ import string
 import time
 from collections import Counter
 import math
+import itertools
+from array import array
+from bisect import bisect_left
+import numpy as np
+import docstore
+import fuzzy
+import metrics
+import positions as positions_engine
+import postings
+import scoring as scoring_engine
+import topk
+from postings import PostingsList
 """
 ensuring that different forms
 of a word map to the same stem, 
@@ -16,12 +28,25 @@ STEMMER = Stemmer.Stemmer('english')
 
 # top 25 most common words in English and "wikipedia":
 # https://en.wikipedia.org/wiki/Most_common_words_in_English
+# 'I' never matches since tokens are lowercased first, it's left in
+# because taking 'i' out of the index means rebuilding every snapshot
 STOPWORDS = set(['the', 'be', 'to', 'of', 'and', 'a', 'in', 'that', 'have',
                  'I', 'it', 'for', 'not', 'on', 'with', 'he', 'as', 'you',
                  'do', 'at', 'this', 'but', 'his', 'by', 'from', 'wikipedia'])
 
+# every change to any index gets a new number, caches compare against it
+_GENERATIONS = itertools.count(1)
+
 PUNCTUATION = re.compile('[%s]' % re.escape(string.punctuation))
 
+# raw tokens remembered by analyze(), the memo is emptied when it fills up
+ANALYZE_CACHE_SIZE = 200000
+
+# "a phrase" and word NEAR/3 word in queries, NEAR on its own means NEAR_DISTANCE
+PHRASE = re.compile(r'"([^"]*)"')
+NEAR = re.compile(r'(\S+)\s+NEAR(?:/(\d+))?\s+(\S+)')
+NEAR_DISTANCE = 5
+
 def tokenize(text):
 	return text.split()
 
@@ -37,61 +62,310 @@ def punctuation_filter(tokens):
 def stopword_filter(tokens):
     return [token for token in tokens if token not in STOPWORDS]
 
-def analyze(text):
-    tokens = tokenize(text)
-    tokens = lowercase_filter(tokens)
-    tokens = punctuation_filter(tokens)
-    tokens = stopword_filter(tokens)
-    tokens = stem_filter(tokens)
+def analyze_token(token):
+	"""
+	What the filters above turn one raw token into, '' if it's dropped
+	"""
+	token = PUNCTUATION.sub('', token.lower())
+	if token in STOPWORDS:
+		return ''
+	return STEMMER.stemWord(token)
+
+_analyzed = {}
 
-    return [token for token in tokens if token]
+def analyze(text):
+	"""
+	tokenize, lowercase_filter, punctuation_filter, stopword_filter and
+	stem_filter in one pass. Each filter only looks at one token at a
+	time, so the result for a raw token is memoized: OCR text repeats
+	the same (junk) tokens a lot, and those skip the regex and stemmer.
+	"""
+	analyzed = _analyzed
+	terms = []
+	for token in text.split():
+		term = analyzed.get(token)
+		if term is None:
+			term = analyze_token(token)
+			if len(analyzed) >= ANALYZE_CACHE_SIZE:
+				analyzed.clear()
+			analyzed[token] = term
+		if term:
+			terms.append(term)
+	return terms
+
+def analyze_positions(text):
+	"""
+	analyze(), with the position of each term among the raw tokens:
+	[(position, term), ...]
+	"""
+	analyzed = _analyzed
+	terms = []
+	for position, token in enumerate(text.split()):
+		term = analyzed.get(token)
+		if term is None:
+			term = analyze_token(token)
+			if len(analyzed) >= ANALYZE_CACHE_SIZE:
+				analyzed.clear()
+			analyzed[token] = term
+		if term:
+			terms.append((position, term))
+	return terms
+
+def parse_query(query):
+	"""
+	Split a query into (terms, clauses). Clauses are ('phrase', ((offset,
+	term), ...)) for a quoted phrase and ('near', term, term, distance)
+	for word NEAR/distance word, terms are the rest of the query analyzed.
+	Plain queries come back as (tuple(analyze(query)), ()).
+	"""
+	clauses = []
+
+	def phrase(match):
+		positioned = analyze_positions(match.group(1))
+		if positioned:
+			first = positioned[0][0]
+			clauses.append(('phrase', tuple((position - first, term) for position, term in positioned)))
+		return ' '
+
+	def near(match):
+		first, second = analyze(match.group(1)), analyze(match.group(3))
+		if not first or not second:
+			# a stopword on one side, keep the words as plain terms
+			return f" {match.group(1)} {match.group(3)} "
+		clauses.append(('near', first[-1], second[0], int(match.group(2) or NEAR_DISTANCE)))
+		return ' '
+
+	rest = NEAR.sub(near, PHRASE.sub(phrase, query))
+	return tuple(analyze(rest)), tuple(clauses)
+
+def clause_terms(clause):
+	if clause[0] == 'phrase':
+		return [term for _, term in clause[1]]
+	return [clause[1], clause[2]]
 
 class Index:
-	def __init__(self):
+	def __init__(self, positions=False):
+		# token -> PostingsList of (doc ID, term frequency)
 		self.index = {}
+		# token -> positions.PositionsList parallel to its PostingsList, None
+		# unless positions=True (phrase and NEAR queries, proximity boost)
+		self.positions = {} if positions else None
 		self.documents = {}
+		# number of analyzed tokens in each document, indexed by doc ID
+		self.doc_lengths = array('I')
+		self.idf = {}
+		self.bm25_idf = {}
+		self.average_length = 0.0
+		self._max_scores = {}
+		self._url_mask = None
+		self._fuzzy_terms = None
+		self._statistics_stale = True
+		self.generation = next(_GENERATIONS)
 
 	def document_frequency(self, token):
-	    return len(self.index.get(token, set()))
+	    return len(self.index.get(token, ()))
+
+	def update_statistics(self):
+		"""
+		Precompute idf for every token, plus the average document length
+		for BM25, so ranking looks them up instead of calling log10 for
+		every document/token pair. Redone lazily after new documents are added.
+		"""
+		n = len(self.documents)
+		# Manning, Hinrich and Schütze use log10, so we do too, even though it
+		# doesn't really matter which log we use anyway
+		# https://nlp.stanford.edu/IR-book/html/htmledition/inverse-document-frequency-1.html
+		self.idf = {token: math.log10(n / len(p)) for token, p in self.index.items()}
+		self.bm25_idf = {token: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for token, p in self.index.items()}
+		self.average_length = int(self.all_document_lengths().sum(dtype=np.int64)) / n if n else 0.0
+		self._max_scores = {}
+		self._url_mask = None
+		self._fuzzy_terms = None
+		self._statistics_stale = False
+
+	def _ensure_statistics(self):
+		if self._statistics_stale:
+			self.update_statistics()
 
 	def inverse_document_frequency(self, token):
-	    # Manning, Hinrich and Schütze use log10, so we do too, even though it
-	    # doesn't really matter which log we use anyway
-	    # https://nlp.stanford.edu/IR-book/html/htmledition/inverse-document-frequency-1.html
-	    return math.log10(len(self.documents) / self.document_frequency(token))
+		self._ensure_statistics()
+		return self.idf[token]
+
+	def bm25_inverse_document_frequency(self, token):
+		self._ensure_statistics()
+		return self.bm25_idf[token]
 
+	def average_document_length(self):
+		self._ensure_statistics()
+		return self.average_length
+
+	def max_score(self, token, scoring='tfidf'):
+		"""
+		Upper bound on the score token contributes to any one document,
+		used by top-k pruning. Worked out on first use and kept until
+		the statistics change.
+		"""
+		self._ensure_statistics()
+		key = (token, scoring)
+		if key not in self._max_scores:
+			p = self.index[token]
+			weights = scoring_engine.term_weights(self, token, p.frequencies().astype(np.float64), p.ids(), scoring)
+			self._max_scores[key] = float(weights.max()) if len(weights) else 0.0
+		return self._max_scores[key]
+
+	def url_mask(self):
+		"""
+		Boolean array indexed by doc ID, True for documents with a url to show
+		(main.py writes 'None' when it couldn't find the url of an image)
+		"""
+		self._ensure_statistics()
+		if self._url_mask is None and isinstance(self.documents, docstore.DocumentStore):
+			self._url_mask = self.documents.url_mask()
+		if self._url_mask is None:
+			mask = np.zeros(max(self.documents, default=0) + 1, dtype=bool)
+			for doc_id, document in self.documents.items():
+				mask[doc_id] = document.url is not None and document.url != 'None'
+			self._url_mask = mask
+		return self._url_mask
+
+	def fuzzy_terms(self):
+		"""
+		fuzzy.TermIndex of the vocabulary, built on first use and kept
+		until the statistics change
+		"""
+		self._ensure_statistics()
+		if self._fuzzy_terms is None:
+			self._fuzzy_terms = fuzzy.TermIndex(self.index)
+		return self._fuzzy_terms
+
+	def all_document_lengths(self) -> np.ndarray:
+		"""
+		Document lengths as a numpy array indexed by doc ID
+		"""
+		if isinstance(self.doc_lengths, array):
+			return np.frombuffer(self.doc_lengths, dtype=postings.DOC_ID_DTYPE)
+		return self.doc_lengths
+
+	def document_lengths(self, doc_ids):
+		return self.all_document_lengths()[doc_ids]
+
+	def term_frequency(self, token, doc_id):
+		postings = self.index.get(token)
+		return postings.frequency(doc_id) if postings is not None else 0
+
+	def _set_document_length(self, doc_id, length):
+		if not isinstance(self.doc_lengths, array):
+			# read-only snapshot view, copy before the first write
+			self.doc_lengths = array('I', self.doc_lengths)
+		if doc_id >= len(self.doc_lengths):
+			missing = doc_id + 1 - len(self.doc_lengths)
+			self.doc_lengths.frombytes(bytes(missing * self.doc_lengths.itemsize))
+		self.doc_lengths[doc_id] = length
 
 	def index_document(self, document):
-		if document.ID not in self.documents:
-			self.documents[document.ID] = document
-			document.analyze()
+		if document.ID in self.documents:
+			return
+		self.documents[document.ID] = document
 
-		for token in analyze(document.fulltext):
+		if self.positions is not None:
+			self._index_positions(document)
+			return
+
+		tokens = analyze(document.fulltext)
+		self._set_document_length(document.ID, len(tokens))
+		# Counter will create a dictionary counting the unique values in an array:
+		# {'london': 12, 'beer': 3, ...}
+		for token, tf in Counter(tokens).items():
+			if token not in self.index:
+				self.index[token] = PostingsList()
+			self.index[token].add(document.ID, tf)
+		self._statistics_stale = True
+		self.generation = next(_GENERATIONS)
+
+	def _index_positions(self, document):
+		positioned = analyze_positions(document.fulltext)
+		self._set_document_length(document.ID, len(positioned))
+		token_positions = {}
+		for position, token in positioned:
+			if token not in token_positions:
+				token_positions[token] = []
+			token_positions[token].append(position)
+		for token, found in token_positions.items():
 			if token not in self.index:
-				self.index[token] = set()
-			self.index[token].add(document.ID)
+				self.index[token] = PostingsList()
+				self.positions[token] = positions_engine.PositionsList()
+			self.index[token].add(document.ID, len(found))
+			self.positions[token].add(bisect_left(self.index[token].doc_ids, document.ID), found)
+		self._statistics_stale = True
+		self.generation = next(_GENERATIONS)
+
+	def _matching_clauses(self, clauses, doc_ids=None):
+		"""
+		Doc IDs (out of doc_ids, if given) matching every phrase/NEAR clause.
+		Without positions in the index a clause only requires its terms.
+		"""
+		for clause in clauses:
+			results = self._results(clause_terms(clause))
+			doc_ids = postings.intersect(results if doc_ids is None else [doc_ids] + results)
+			if self.positions is None or not len(doc_ids):
+				continue
+			if clause[0] == 'phrase':
+				doc_ids = doc_ids[positions_engine.phrase_mask(self, clause[1], doc_ids)]
+			else:
+				doc_ids = doc_ids[positions_engine.near_mask(self, clause[1], clause[2], clause[3], doc_ids)]
+		return doc_ids
 
 	def _results(self, analyzed_query):
-		return [self.index.get(token, set()) for token in analyzed_query]
-
-	def rank(self, analyzed_query, documents):
-	    results = []
-	    if not documents:
-	        return results
-	    for document in documents:
-	        score = 0.0
-	        for token in analyzed_query:
-	            tf = document.term_frequency(token)
-	            idf = self.inverse_document_frequency(token)
-	            score += tf * idf
-	        results.append((document, score))
-	    return sorted(results, key=lambda doc: doc[1], reverse=True)
-
-	def search(self, query, search_type='AND', rank=True):
+		return [self.index[token].ids() if token in self.index else postings.EMPTY for token in analyzed_query]
+
+	def _expand(self, terms, clauses, expand=False):
+		"""
+		What a parsed query searches for: (analyzed_query, weights, groups).
+		groups has a list per plain term of the terms that can stand in
+		for it, the term itself plus, with expand, its fuzzy expansions
+		(see fuzzy.py) at a weight below 1. Clause terms come last, a
+		group each. weights is None without expand.
+		"""
+		groups = []
+		weights = []
+		for term in terms:
+			group = [(term, 1.0)]
+			if expand:
+				group += [(expansion, weight) for expansion, weight in fuzzy.expand(self, term) if expansion not in terms]
+			groups.append([expansion for expansion, _ in group])
+			weights += [weight for _, weight in group]
+		for clause in clauses:
+			groups += [[term] for term in clause_terms(clause)]
+			weights += [1.0] * len(clause_terms(clause))
+		analyzed_query = [term for group in groups for term in group]
+		return analyzed_query, weights if expand else None, groups
+
+	def rank(self, analyzed_query, doc_ids, scoring='tfidf', proximity=False, weights=None):
+		"""
+		Score all of doc_ids in one go (see scoring.py), best first. With
+		proximity (and positions in the index) docs where the query terms
+		are close together get a boost, see positions.proximity(). weights
+		scales each term's score, fuzzy expansions count for less.
+		"""
+		scores = scoring_engine.score(self, analyzed_query, doc_ids, scoring, weights)
+		if proximity and self.positions is not None:
+			# expansions stand in for a query term, they aren't one
+			exact = analyzed_query if weights is None else [term for term, weight in zip(analyzed_query, weights) if weight == 1.0]
+			scores *= positions_engine.proximity(self, exact, doc_ids)
+		order = scoring_engine.order(doc_ids, scores)
+		return [(self.documents[doc_id], score) for doc_id, score in zip(doc_ids[order].tolist(), scores[order].tolist())]
+
+	def search(self, query, search_type='AND', rank=True, scoring='tfidf', fuzzy=False):
 		"""
 		Still boolean search; this will return documents that contain either all words
 		from the query or just one of them, depending on the search_type specified.
-		We are still not ranking the results (sets are fast, but unordered).
+		Postings are sorted arrays, so AND/OR are sorted merges of the doc IDs.
+		With rank=True results are (document, score) pairs scored with tf-idf or bm25.
+		"Quoted phrases" and word NEAR/3 word clauses have to match whatever
+		the search_type. They are only checked if the index has positions,
+		otherwise just their terms are required.
+		fuzzy=True lets terms within an edit or two of a query term match
+		for it, at a lower score (see fuzzy.py). Clauses stay exact.
 		"""
 
 
@@ -99,25 +373,84 @@ class Index:
 			return "Query is empty"
 
 		if search_type not in ('AND','OR'):
-			print('parameter (search_type) is invalid')
+			metrics.increment('search.invalid_search_type')
 			return []
 
-		print(f"Query: {query}")
-
-		analyzed_query = analyze(query)
-		results = self._results(analyzed_query)
-
-		if search_type == 'AND':
-		# all tokens must be in the document
-			documents = [self.documents[doc_id] for doc_id in set.intersection(*results)]
-		if search_type == 'OR':
-		# only one token has to be in the document
-			documents = [self.documents[doc_id] for doc_id in set.union(*results)]
+		metrics.increment('search.queries')
+
+		with metrics.span('search.analyze'):
+			terms, clauses = parse_query(query)
+		if fuzzy:
+			with metrics.span('search.fuzzy'):
+				analyzed_query, weights, groups = self._expand(terms, clauses, expand=True)
+		else:
+			analyzed_query, weights, groups = self._expand(terms, clauses)
+		with metrics.span('search.fetch'):
+			results = [postings.union(self._results(group)) for group in groups]
+
+		with metrics.span('search.merge'):
+			if search_type == 'AND':
+			# all tokens (or one of their expansions) must be in the document
+				doc_ids = postings.intersect(results)
+			if search_type == 'OR':
+			# only one token has to be in the document
+				doc_ids = postings.union(results)
+		if clauses:
+			with metrics.span('search.positions'):
+				doc_ids = self._matching_clauses(clauses, doc_ids)
 		if rank:
-			return self.rank(analyzed_query, documents)
+			with metrics.span('search.rank'):
+				return self.rank(analyzed_query, doc_ids, scoring, proximity=True, weights=weights)
+
+		return [self.documents[doc_id] for doc_id in doc_ids.tolist()]
 
-		print(f"{len(documents)} results")
-		return documents
+	def search_top_k(self, query, k, search_type='OR', scoring='tfidf', doc_filter=None, exact_total=False, after=None,
+			fuzzy=False):
+		"""
+		Best k (document, score) pairs, in the same order search() ranks them,
+		without scoring and sorting every match (see topk.py). doc_filter is
+		an optional boolean array indexed by doc ID, like url_mask().
+		Phrase/NEAR clauses filter like in search(). With positions in the
+		index the best topk.PROXIMITY_DEPTH hits get the proximity boost,
+		the rest ranks without it (see topk.rerank_proximity()).
+		after=(score, doc ID) of the last hit of one page returns the next page.
+		fuzzy expands query terms like in search().
+		Returns a topk.TopK; for OR queries total_hits is an estimate when
+		pruning skipped postings, unless exact_total is set.
+		"""
+		if k < 1:
+			raise ValueError('k must be at least 1')
+		if search_type not in ('AND','OR'):
+			raise ValueError(f"parameter (search_type) is invalid: {search_type!r}")
+		if scoring not in scoring_engine.SCORING_METHODS:
+			raise ValueError(f"unknown scoring method {scoring!r}")
+
+		metrics.increment('search.top_k_queries')
+		with metrics.span('search.analyze'):
+			terms, clauses = parse_query(query)
+		if fuzzy:
+			with metrics.span('search.fuzzy'):
+				analyzed_query, weights, groups = self._expand(terms, clauses, expand=True)
+		else:
+			analyzed_query, weights, groups = self._expand(terms, clauses)
+		if clauses:
+			with metrics.span('search.positions'):
+				matching = self._matching_clauses(clauses)
+				clause_filter = np.zeros(len(self.all_document_lengths()), dtype=bool)
+				clause_filter[matching] = True if doc_filter is None else doc_filter[matching]
+				doc_filter = clause_filter
+
+		def top_k(k, after):
+			if search_type == 'AND':
+				return topk.top_k_and(self, analyzed_query, k, scoring, doc_filter, after, weights, groups)
+			return topk.top_k_or(self, analyzed_query, k, scoring, doc_filter, exact_total, after, weights)
+
+		# expansions stand in for a query term, they aren't one
+		exact = analyzed_query if weights is None else [term for term, weight in zip(analyzed_query, weights) if weight == 1.0]
+		with metrics.span('search.top_k'):
+			if self.positions is None or len({term for term in exact if term in self.index}) < 2:
+				return top_k(k, after)
+			return topk.rerank_proximity(self, top_k, exact, k, after)
 
 @dataclass
 class Abstract:
@@ -126,15 +459,6 @@ class Abstract:
 	_filename: str
 	_url: str
 
-	def analyze(self):
-		# Counter will create a dictionary counting the unique values in an array:
-
-        # {'london': 12, 'beer': 3, ...}
-		self.term_frequencies = Counter(analyze(self.fulltext))
-
-	def term_frequency(self, term):
-		return self.term_frequencies.get(term, 0)
-
 	@property
 	def fulltext(self):
 		return self.abstract
@@ -148,15 +472,18 @@ class Abstract:
 		return self._url
 	
 
-def load_documents():
+def load_documents(path='data.xml.gz'):
 
-	with gzip.open('data.xml.gz', 'rb') as f:
+	with gzip.open(path, 'rb') as f:
 		doc_id = 1
 		# iterate through doc element <doc></doc>
 		for _, element in etree.iterparse(f, events=('end',), tag='doc'):
 			abstract = element.findtext("./abstract")
 			filename = element.findtext("./filename")
 			url = element.findtext("./url")
+			# main.py writes <doc id="..."> so IDs don't depend on position,
+			# older docs without one are numbered by position
+			doc_id = int(element.get('id', doc_id))
 
 			yield Abstract(ID=doc_id, abstract=abstract, _filename=filename, _url=url)
 
@@ -164,40 +491,13 @@ def load_documents():
 			# element.clear() call will explicitly free up memory
 			element.clear()
 
-def timing(method):
-    """
-    Quick and dirty decorator to time functions: it will record the time when
-    it's calling a function, record the time when it returns and compute the
-    difference. There'll be some overhead, so it's not very precise, but'll
-    suffice to illustrate the examples in the accompanying blog post.
-    @timing
-    def snore():
-        print('zzzzz')
-        time.sleep(5)
-    snore()
-    zzzzz
-    snore took 5.0011749267578125 seconds
-    """
-    def timed(*args, **kwargs):
-        start = time.time()
-        result = method(*args, **kwargs)
-        end = time.time()
-
-        execution_time = end - start
-        if execution_time < 0.001:
-            print(f'{method.__name__} took {execution_time*1000} milliseconds')
-        else:
-            print(f'{method.__name__} took {execution_time} seconds')
-
-        return result
-    return timed
-
-@timing
+@metrics.timed('index.build')
 def index_documents(documents, index):
-    for i, document in enumerate(documents):
+    indexed = len(index.documents)
+    for document in documents:
         index.index_document(document)
-        if i % 5000 == 0:
-            print(f'Indexed {i} documents', end='\r')
+    metrics.increment('index.documents_indexed', len(index.documents) - indexed)
+    index.update_statistics()
     return index
 
 if __name__ == "__main__":
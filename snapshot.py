@@ -0,0 +1,313 @@
+"""
+	On-disk snapshot of the search index.
+
+	Building the index means gunzipping data.xml.gz and running analyze()
+	over every OCR abstract. A snapshot stores the finished index as flat
+	arrays so a worker only has to mmap one file at startup. The header
+	records the sha256 of the corpus the snapshot was built from, and
+	load_or_build() rebuilds the snapshot whenever data.xml.gz changes.
+	The corpus can also be a record file (see corpus_records.py), the
+	app builds from the one MEME_SEARCH_CORPUS names (see index_service.py).
+	An index built with positions (search.Index(positions=True)) keeps
+	them in two extra sections, see positions.py.
+
+	Layout:
+		header    magic, format version, corpus sha256, toc length
+		toc       json, document count, corpus path and {section: [offset, length, dtype]}
+		sections  8-byte aligned arrays, offsets relative to the end of the toc
+
+	Build it offline with:
+		python3 snapshot.py
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+import corpus_records
+import docstore
+import parallel_index
+import positions as positions_engine
+import postings
+import search
+
+MAGIC = b'MEMEIDX\x00'
+VERSION = 2
+HEADER = struct.Struct('<8sI32sI')
+ALIGNMENT = 8
+
+CORPUS_PATH = 'data.xml.gz'
+SNAPSHOT_PATH = 'data.idx'
+
+# bits in the doc_missing section, set when findtext() returned None
+MISSING_ABSTRACT = docstore.MISSING_ABSTRACT
+MISSING_FILENAME = docstore.MISSING_FILENAME
+MISSING_URL = docstore.MISSING_URL
+
+class SnapshotError(Exception):
+	"""
+	Raised for a snapshot that is truncated, from another format version,
+	or not a snapshot at all
+	"""
+
+def corpus_digest(path=CORPUS_PATH) -> bytes:
+	"""
+	sha256 of the corpus file, read in chunks
+	"""
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+	return digest.digest()
+
+def _encode_blobs(blobs):
+	"""
+	Pack a list of bytes into one blob plus an offsets array,
+	item i is blob[offsets[i]:offsets[i + 1]]
+	"""
+	offsets = np.zeros(len(blobs) + 1, dtype=np.uint64)
+	np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+	return np.frombuffer(b''.join(blobs), dtype=np.uint8), offsets
+
+def _encode_strings(values):
+	"""
+	_encode_blobs() for strings, utf-8 encoded
+	"""
+	return _encode_blobs([(value or '').encode('utf-8') for value in values])
+
+def write_snapshot(index, digest: bytes, path=SNAPSHOT_PATH, corpus_path=None):
+	"""
+	Serialize index to path. The file is written next to path and
+	renamed into place so readers never see a half written snapshot.
+	corpus_path is only recorded, for the stale snapshot message.
+	"""
+	terms = sorted(index.index)
+	doc_ids = sorted(index.documents)
+	documents = [index.documents[doc_id] for doc_id in doc_ids]
+
+	postings_ids = [postings.EMPTY]
+	postings_tfs = [postings.EMPTY]
+	postings_lengths = []
+	for term in terms:
+		term_postings = index.index[term]
+		postings_ids.append(term_postings.ids())
+		postings_tfs.append(term_postings.frequencies())
+		postings_lengths.append(len(term_postings))
+
+	postings_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+	np.cumsum(postings_lengths, out=postings_offsets[1:])
+
+	missing = np.zeros(len(documents), dtype=np.uint8)
+	for i, document in enumerate(documents):
+		if document.abstract is None:
+			missing[i] |= MISSING_ABSTRACT
+		if document.filename is None:
+			missing[i] |= MISSING_FILENAME
+		if document.url is None:
+			missing[i] |= MISSING_URL
+
+	sections = {}
+	sections['terms'], sections['term_offsets'] = _encode_strings(terms)
+	sections['postings_offsets'] = postings_offsets
+	sections['postings_ids'] = np.concatenate(postings_ids).astype(np.uint32)
+	sections['postings_tfs'] = np.concatenate(postings_tfs).astype(np.uint32)
+	sections['doc_ids'] = np.array(doc_ids, dtype=np.uint32)
+	sections['doc_missing'] = missing
+	sections['doc_lengths'] = index.document_lengths(np.array(doc_ids, dtype=np.intp)).astype(np.uint32)
+	sections['abstracts'], sections['abstract_offsets'] = _encode_strings([d.abstract for d in documents])
+	sections['filenames'], sections['filename_offsets'] = _encode_strings([d.filename for d in documents])
+	sections['urls'], sections['url_offsets'] = _encode_strings([d.url for d in documents])
+	if index.positions is not None:
+		# one chunk per posting, in postings_ids order
+		chunks = [index.positions[term].chunk(i) for term in terms for i in range(len(index.positions[term]))]
+		sections['positions'], sections['position_offsets'] = _encode_blobs(chunks)
+
+	toc = {'document_count': len(documents), 'corpus': corpus_path, 'sections': {}}
+	offset = 0
+	for name, array in sections.items():
+		toc['sections'][name] = [offset, len(array), array.dtype.str]
+		offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+	toc_bytes = json.dumps(toc).encode('utf-8')
+	toc_bytes += b' ' * (-(HEADER.size + len(toc_bytes)) % ALIGNMENT)
+
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	with open(tmp_path, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, VERSION, digest, len(toc_bytes)))
+		f.write(toc_bytes)
+		for array in sections.values():
+			f.write(array.tobytes())
+			f.write(b'\x00' * (-array.nbytes % ALIGNMENT))
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp_path, path)
+
+class Snapshot:
+	"""
+	Read-only, memory-mapped view of a snapshot file. Arrays returned by
+	array() point straight into the mapping, so every worker that opens
+	the same file shares the pages.
+	"""
+	def __init__(self, path=SNAPSHOT_PATH):
+		self.path = path
+		with open(path, 'rb') as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			self._read_header()
+		except Exception:
+			self._mmap.close()
+			raise
+
+	def _read_header(self):
+		if len(self._mmap) < HEADER.size:
+			raise SnapshotError(f"{self.path} is truncated")
+		magic, version, digest, toc_length = HEADER.unpack_from(self._mmap)
+		if magic != MAGIC:
+			raise SnapshotError(f"{self.path} is not an index snapshot")
+		if version != VERSION:
+			raise SnapshotError(f"{self.path} is format version {version}, expected {VERSION}")
+		toc = json.loads(self._mmap[HEADER.size:HEADER.size + toc_length])
+		self.version = version
+		self.digest = digest
+		self.document_count = toc['document_count']
+		# None for snapshots written before the path was recorded
+		self.corpus_path = toc.get('corpus')
+		self._sections = toc['sections']
+		self._data_start = HEADER.size + toc_length
+
+	def has(self, name) -> bool:
+		return name in self._sections
+
+	def array(self, name):
+		offset, length, dtype = self._sections[name]
+		return np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=length, offset=self._data_start + offset)
+
+	def strings(self, blob_name, offsets_name):
+		"""
+		Decode every string in a blob/offsets section pair
+		"""
+		blob = self.array(blob_name).tobytes()
+		offsets = self.array(offsets_name).tolist()
+		return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+	def close(self):
+		self._mmap.close()
+
+def load_index(snapshot: Snapshot):
+	"""
+	Turn a snapshot back into a search.Index without touching the corpus.
+	Documents stay in the mapping too, see docstore.py.
+	"""
+	index = search.Index(positions=snapshot.has('positions'))
+
+	doc_ids = snapshot.array('doc_ids')
+	index.documents = docstore.DocumentStore(doc_ids, snapshot.array('doc_missing'),
+		snapshot.array('filenames'), snapshot.array('filename_offsets'),
+		snapshot.array('urls'), snapshot.array('url_offsets'),
+		snapshot.array('abstracts'), snapshot.array('abstract_offsets'))
+
+	doc_lengths = np.zeros(int(doc_ids.max(initial=0)) + 1, dtype=np.uint32)
+	doc_lengths[doc_ids] = snapshot.array('doc_lengths')
+	index.doc_lengths = doc_lengths
+
+	# postings stay views into the mmap, the index keeps the mapping open
+	terms = snapshot.strings('terms', 'term_offsets')
+	offsets = snapshot.array('postings_offsets').tolist()
+	postings_ids = snapshot.array('postings_ids')
+	postings_tfs = snapshot.array('postings_tfs')
+	for t, term in enumerate(terms):
+		start, end = offsets[t], offsets[t + 1]
+		index.index[term] = postings.PostingsList(postings_ids[start:end], postings_tfs[start:end])
+
+	if index.positions is not None:
+		# offsets stay absolute into the shared blob, PositionsList copies
+		# its own part out the first time anything is added to it
+		position_offsets = snapshot.array('position_offsets')
+		position_data = snapshot.array('positions')
+		for t, term in enumerate(terms):
+			start, end = offsets[t], offsets[t + 1]
+			index.positions[term] = positions_engine.PositionsList(position_offsets[start:end + 1], position_data)
+
+	index.update_statistics()
+	return index
+
+def build_snapshot(corpus_path=CORPUS_PATH, snapshot_path=SNAPSHOT_PATH, digest=None, workers=1, positions=False):
+	"""
+	Offline build step: index the corpus from scratch and write the snapshot,
+	with workers > 1 the index is built by parallel_index. parallel_index
+	doesn't do positions, so with positions=True it's always one process.
+	"""
+	if digest is None:
+		digest = corpus_digest(corpus_path)
+	documents = corpus_records.load_corpus(corpus_path)
+	if workers > 1 and not positions:
+		index = parallel_index.index_documents(documents, workers=workers)
+	else:
+		index = search.index_documents(documents, search.Index(positions=positions))
+	write_snapshot(index, digest, snapshot_path, corpus_path)
+	return index
+
+def _load_current(snapshot_path, digest, positions=False, corpus_path=CORPUS_PATH):
+	"""
+	The index in snapshot_path if it was built from a corpus with this
+	digest (and has positions, if asked for), otherwise None
+	"""
+	try:
+		snapshot = Snapshot(snapshot_path)
+	except FileNotFoundError:
+		print(f"No snapshot at {snapshot_path}")
+		return None
+	except SnapshotError as e:
+		print(e)
+		return None
+	if snapshot.digest != digest and snapshot.corpus_path not in (None, corpus_path):
+		print(f"{snapshot_path} was built from {snapshot.corpus_path}, not {corpus_path} "
+			f"(set MEME_SEARCH_CORPUS={snapshot.corpus_path} for the app to use it)")
+	elif snapshot.digest != digest:
+		print(f"{snapshot_path} is stale")
+	elif positions and not snapshot.has('positions'):
+		print(f"{snapshot_path} has no positions")
+	else:
+		return load_index(snapshot)
+	snapshot.close()
+	return None
+
+def load_or_build(corpus_path=CORPUS_PATH, snapshot_path=SNAPSHOT_PATH, positions=False):
+	"""
+	Load the snapshot if it was built from the current corpus, otherwise
+	rebuild it from the corpus and write a fresh one. Rebuilds hold a lock
+	file so that when several gunicorn workers notice a new corpus at
+	once, one builds and the rest load what it wrote. With positions=True
+	a snapshot without positions counts as stale too.
+	"""
+	digest = corpus_digest(corpus_path)
+	index = _load_current(snapshot_path, digest, positions, corpus_path)
+	if index is not None:
+		return index
+
+	with open(f"{snapshot_path}.lock", 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		# another worker may have rebuilt it while we waited for the lock
+		index = _load_current(snapshot_path, digest, positions, corpus_path)
+		if index is not None:
+			return index
+		print(f"Building {snapshot_path} from {corpus_path}")
+		build_snapshot(corpus_path, snapshot_path, digest, positions=positions)
+		# load what was just written rather than keep the built index,
+		# its documents are all in memory
+		return load_index(Snapshot(snapshot_path))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Build the on-disk index snapshot')
+	parser.add_argument('--corpus', default=CORPUS_PATH)
+	parser.add_argument('--output', default=SNAPSHOT_PATH)
+	parser.add_argument('--workers', type=int, default=1, help='processes indexing the corpus (default 1)')
+	parser.add_argument('--positions', action='store_true', help='store token positions, for phrase and NEAR queries')
+	args = parser.parse_args()
+
+	start_time = time.time()
+	index = build_snapshot(args.corpus, args.output, workers=max(1, args.workers), positions=args.positions)
+	print(f"Wrote {len(index.documents)} documents to {args.output} in {round(time.time() - start_time, 2)} seconds")
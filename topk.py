@@ -0,0 +1,215 @@
+"""
+	Top-k retrieval with MaxScore pruning.
+
+	Instead of scoring and sorting every document that matches an OR
+	query, tokens are processed from the highest to the lowest score
+	upper bound (the largest contribution the token makes to any doc).
+	Once the upper bounds of the tokens left can no longer lift a doc
+	that hasn't been seen yet above the current k-th best score, the
+	remaining (usually very common, low idf) tokens only update docs
+	already collected, via binary search, rather than merging their
+	whole postings list. Docs that can't reach the k-th best score even
+	with every remaining token are dropped as we go.
+
+	The survivors are rescored with scoring.score() so scores and order
+	match Index.rank exactly.
+
+	after=(score, doc ID) of the last hit of the previous page gives the
+	next page: the best k that rank() puts after that hit. Only docs
+	certain to end up at or below the cursor count towards the k-th best
+	score used for pruning, and docs whose partial score is already
+	above it are dropped before rescoring.
+
+	With positions in the index, rerank_proximity() applies the
+	proximity boost to the best PROXIMITY_DEPTH hits afterwards, since
+	MaxScore needs every term's contribution to be bounded.
+	https://nlp.stanford.edu/IR-book/html/htmledition/efficient-scoring-and-ranking-1.html
+"""
+from dataclasses import dataclass
+from collections import Counter
+import numpy as np
+import positions as positions_engine
+import postings
+import scoring as scoring_engine
+
+# relative slack on pruning comparisons, accumulated scores are summed in
+# a different order than the final rescore so may be off by a few ulps
+PRUNING_TOLERANCE = 1e-9
+
+# hits rescored with the proximity boost, see rerank_proximity()
+PROXIMITY_DEPTH = 100
+
+@dataclass
+class TopK:
+	hits: list
+	# number of documents matching the query, estimated when pruning
+	# skipped part of the postings
+	total_hits: int
+	total_is_estimate: bool = False
+
+def _filtered(ids, doc_filter):
+	if doc_filter is None:
+		return ids
+	return ids[doc_filter[ids]]
+
+def _estimate_union(index, tokens, doc_filter):
+	"""
+	Size of the OR of tokens, assuming they occur independently
+	"""
+	n = len(index.documents)
+	if not n:
+		return 0
+	miss = 1.0
+	for token in tokens:
+		miss *= 1.0 - index.document_frequency(token) / n
+	estimate = n * (1.0 - miss)
+	if doc_filter is not None:
+		estimate *= np.count_nonzero(doc_filter) / n
+	return int(round(estimate))
+
+def _after(doc_ids, scores, after):
+	"""
+	Mask of the docs rank() orders after the (score, doc ID) cursor
+	"""
+	score, doc_id = after
+	return (scores < score) | ((scores == score) & (doc_ids > doc_id))
+
+def _is_after(score, doc_id, after):
+	return score < after[0] or (score == after[0] and doc_id > after[1])
+
+def _best(index, analyzed_query, doc_ids, k, scoring, after=None, weights=None):
+	scores = scoring_engine.score(index, analyzed_query, doc_ids, scoring, weights)
+	if after is not None:
+		keep = _after(doc_ids, scores, after)
+		doc_ids, scores = doc_ids[keep], scores[keep]
+	if len(doc_ids) > k:
+		# anything tied with the k-th score has to stay in for the doc ID tie break
+		kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+		keep = scores >= kth
+		doc_ids, scores = doc_ids[keep], scores[keep]
+	order = scoring_engine.order(doc_ids, scores)[:k]
+	return [(index.documents[doc_id], score) for doc_id, score in zip(doc_ids[order].tolist(), scores[order].tolist())]
+
+def top_k_and(index, analyzed_query, k, scoring='tfidf', doc_filter=None, after=None, weights=None, groups=None):
+	"""
+	groups are lists of tokens a doc needs one of, every token of
+	analyzed_query on its own by default (fuzzy expansions go in a group
+	with the token they stand in for)
+	"""
+	if groups is None:
+		results = index._results(analyzed_query)
+	else:
+		results = [postings.union(index._results(group)) for group in groups]
+	doc_ids = _filtered(postings.intersect(results), doc_filter)
+	return TopK(_best(index, analyzed_query, doc_ids, k, scoring, after, weights), len(doc_ids))
+
+def top_k_or(index, analyzed_query, k, scoring='tfidf', doc_filter=None, exact_total=False, after=None, weights=None):
+	# a token repeated in the query counts once per repeat, like in rank(),
+	# times its weight when there are weights
+	counts = Counter()
+	for i, token in enumerate(analyzed_query):
+		if token in index.index:
+			counts[token] += 1 if weights is None else weights[i]
+	tokens = sorted(counts, key=lambda token: counts[token] * index.max_score(token, scoring), reverse=True)
+	upper_bounds = [counts[token] * index.max_score(token, scoring) for token in tokens]
+
+	acc_ids = postings.EMPTY
+	acc_scores = np.zeros(0)
+	remaining = sum(upper_bounds)
+	threshold = 0.0
+	pruned = False
+	# postings only looked up in, not merged: the union isn't known then
+	skipped = False
+	# docs merged before the first trim, the exact total if nothing was skipped
+	total = None
+	if after is not None:
+		ceiling = after[0] + PRUNING_TOLERANCE * abs(after[0])
+		floor = after[0] - PRUNING_TOLERANCE * abs(after[0])
+
+	for token, upper_bound in zip(tokens, upper_bounds):
+		remaining -= upper_bound
+		term_postings = index.index[token]
+
+		if not pruned:
+			# new docs can still make the top k, merge the whole postings list
+			ids = term_postings.ids()
+			keep = doc_filter[ids] if doc_filter is not None else slice(None)
+			ids = ids[keep]
+			contributions = counts[token] * scoring_engine.term_weights(
+				index, token, term_postings.frequencies()[keep].astype(np.float64), ids, scoring)
+			merged = postings.union([acc_ids, ids])
+			merged_scores = np.zeros(len(merged))
+			merged_scores[np.searchsorted(merged, acc_ids)] += acc_scores
+			merged_scores[np.searchsorted(merged, ids)] += contributions
+			acc_ids, acc_scores = merged, merged_scores
+		else:
+			# only docs we already have can still make it, look them up
+			skipped = True
+			ids = term_postings.ids()
+			positions = np.searchsorted(ids, acc_ids)
+			found = positions < len(ids)
+			found[found] = ids[positions[found]] == acc_ids[found]
+			hits = positions[found]
+			acc_scores[found] += counts[token] * scoring_engine.term_weights(
+				index, token, term_postings.frequencies()[hits].astype(np.float64), ids[hits], scoring)
+
+		if after is not None:
+			# docs that could still end up above the cursor (on an earlier
+			# page) can't set the threshold
+			eligible = acc_scores[acc_scores + remaining < floor]
+		else:
+			eligible = acc_scores
+
+		if len(eligible) >= k:
+			threshold = np.partition(eligible, len(eligible) - k)[len(eligible) - k]
+			cutoff = threshold - PRUNING_TOLERANCE * abs(threshold)
+			if not pruned and remaining < cutoff:
+				pruned = True
+				total = len(acc_ids)
+			if pruned:
+				alive = acc_scores + remaining >= cutoff
+				acc_ids, acc_scores = acc_ids[alive], acc_scores[alive]
+
+	if total is None:
+		total = len(acc_ids)
+	if after is not None:
+		# scores only go up, so these are already above the cursor
+		below = acc_scores <= ceiling
+		acc_ids, acc_scores = acc_ids[below], acc_scores[below]
+	hits = _best(index, analyzed_query, acc_ids, k, scoring, after, weights)
+	if not skipped:
+		return TopK(hits, total)
+	if exact_total:
+		union = postings.union([_filtered(index.index[token].ids(), doc_filter) for token in tokens])
+		return TopK(hits, len(union))
+	return TopK(hits, _estimate_union(index, tokens, doc_filter), total_is_estimate=True)
+
+def rerank_proximity(index, top_k, terms, k, after=None, depth=PROXIMITY_DEPTH):
+	"""
+	Best k hits with positions.proximity()'s boost for terms, where
+	top_k(k, after) is a top_k_and/top_k_or call. Only the best depth
+	hits (or k, if more) get boosted. The boost is at least 1, so a
+	boosted hit still scores at least as much as anything below them,
+	and boosted scores followed by the unboosted rest stay one ranking
+	that after= can page through.
+	"""
+	depth = max(depth, k)
+	pool = top_k(depth, None)
+	if not pool.hits:
+		return pool
+	doc_ids = np.array([document.ID for document, _ in pool.hits], dtype=np.intp)
+	scores = np.array([score for _, score in pool.hits]) * positions_engine.proximity(index, terms, doc_ids)
+	order = scoring_engine.order(doc_ids, scores).tolist()
+	ranked = [(pool.hits[i][0], float(scores[i])) for i in order]
+	if after is not None:
+		ranked = [(document, score) for document, score in ranked if _is_after(score, document.ID, after)]
+	hits = ranked[:k]
+	if len(hits) < k and len(pool.hits) == depth:
+		# the rest is ranked like top_k ranks it, from the last hit of the
+		# pool or from the cursor, whichever is further down
+		last_document, last_score = pool.hits[-1]
+		boundary = (last_score, last_document.ID)
+		if after is not None and _is_after(after[0], after[1], boundary):
+			boundary = after
+		hits += top_k(k - len(hits), boundary).hits
+	return TopK(hits, pool.total_hits, pool.total_is_estimate)